@@ -5,22 +5,53 @@ Groq/compound-miniを使用した鑑定文生成
 
 import google.generativeai as genai
 from groq import Groq
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple, Callable
 import os
+import time
 import concurrent.futures
 from dotenv import load_dotenv
+from llm_hedging import hedged_executor
+from llm_health import provider_health
+from llm_scheduler import llm_scheduler, estimate_tokens, request_priority
+from numerology_scoring import numerology_score_table
+from ai_cache import AITextCache
+from nickname_rewriter import rewrite_nicknames
+from llm_usage import track_usage, record_llm_call, record_cache_hit, record_degraded, task_latency_stats
+from llm_deadline import call_deadline, call_timeout, remaining_time, MIN_CALL_TIMEOUT
+from reading_library import reading_library, is_generic_consultation, numerology_signature, horoscope_signature
+from prompt_builder import PromptBuilder, count_tokens, first_sentences, prompt_token_stats
+from template_reading import template_reader, template_tier, template_tier_active
+from horoscope_data import SIGN_MEANINGS
+from structured_reading import (
+    ComprehensiveReading, ComprehensiveCompatibilityReading, COMPREHENSIVE_SECTIONS, COMPATIBILITY_SECTIONS,
+    schema_example, parse_reading, render_section_texts, clean_section_text
+)
 
 load_dotenv(dotenv_path='.env.local')
 
+# セクション完了の通知（セクション番号, キー, 見出し, 本文）
+SectionCallback = Callable[[int, str, str, str], None]
+
 class AIAnalysisGenerator:
     """AI鑑定文生成クラス"""
     
+    # タスク種別ごとのモデルと出力上限（判定・抽出は小さく速いモデル、鑑定文などの文章は大きいモデル）
+    # model: 'small' / 'large'、max_tokens: 出力トークン上限、temperature: 判定・抽出は決定的にする
+    TASK_ROUTES: Dict[str, Dict[str, Any]] = {
+        'transit_decision': {'model': 'small', 'max_tokens': 5, 'temperature': 0.0},     # YES / NO
+        'target_date': {'model': 'small', 'max_tokens': 24, 'temperature': 0.0},         # YYYY-MM-DD HH:MM
+        'spread_selection': {'model': 'small', 'max_tokens': 24, 'temperature': 0.0},    # スプレッドID
+        'compatibility_score': {'model': 'small', 'max_tokens': 8, 'temperature': 0.0},  # 0-100の整数
+        'prose': {'model': 'large', 'max_tokens': 1000, 'temperature': 0.7},
+    }
+    
     def __init__(self):
         # Google Gemini APIキーを設定（フォールバック用）
         gemini_api_key = os.getenv('GOOGLE_GEMINI_API_KEY')
         if gemini_api_key:
             genai.configure(api_key=gemini_api_key)
-            self.gemini_model = genai.GenerativeModel('models/gemini-2.5-flash-lite')
+            self.gemini_model_name = 'models/gemini-2.5-flash-lite'
+            self.gemini_model = genai.GenerativeModel(self.gemini_model_name)
         else:
             self.gemini_model = None
         
@@ -29,198 +60,442 @@ class AIAnalysisGenerator:
         if not groq_api_key:
             raise ValueError("GROQ_API_KEYが設定されていません")
         
-        self.groq_client = Groq(api_key=groq_api_key)
+        # 1回のHTTP呼び出しのタイムアウト（期限が設定されていればその残り時間まで短縮）
+        # SDKの自動リトライは期限を超えて待ち続ける原因になるため無効化（フォールバックはヘッジで行う）
+        self.request_timeout = float(os.getenv('LLM_REQUEST_TIMEOUT', '20'))
+        self.groq_client = Groq(api_key=groq_api_key, max_retries=0, timeout=self.request_timeout)
         self.groq_model = "llama-3.3-70b-versatile"
+        # 判定・抽出タスク用の小さく速いモデル
+        self.groq_small_model = os.getenv('GROQ_SMALL_MODEL', 'llama-3.1-8b-instant')
         
-        # キャッシュ機能を追加（メモリ効率化）
-        self._cache = {}
-        self._cache_size_limit = 100  # キャッシュサイズ制限
+        # キャッシュ機能を追加（メモリ効率化、言い回しが異なるだけの相談も類似度で再利用）
+        self._cache_size_limit = int(os.getenv('AI_CACHE_SIZE', '100'))  # キャッシュサイズ制限
+        self._cache = AITextCache(size_limit=self._cache_size_limit)
+        # タロットはスプレッドと引いたカードの組み合わせで鑑定文を再利用（削除・TTLの方針は他のキャッシュと共通）
+        self._tarot_cache = AITextCache(size_limit=int(os.getenv('AI_TAROT_CACHE_SIZE', str(self._cache_size_limit))))
         self._processing_requests = set()  # 処理中のリクエストを追跡
         
         # AIスコア生成の設定（環境変数で制御可能）
         self.use_ai_scoring = os.getenv('USE_AI_SCORING', 'true').lower() == 'true'
         
-        # 並列処理用のスレッドプール
-        import concurrent.futures
-        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+        # 鑑定文生成の全体タイムアウト（ヘッジ発行を含む）
+        self.analysis_timeout = float(os.getenv('LLM_ANALYSIS_TIMEOUT', '24'))
+        
+        # LLMが使えないときにテンプレート鑑定文で答えるか（無効の場合は従来のタイムアウト文面）と、
+        # 全プロバイダーの待ち行列がこの長さ以上なら過負荷としてLLMを呼ばずにテンプレートで即答する
+        self.template_fallback = os.getenv('LLM_TEMPLATE_FALLBACK', 'true').lower() == 'true'
+        self.overload_queue_depth = int(os.getenv('LLM_OVERLOAD_QUEUE_DEPTH', '20'))
+        
+        # セクション単位の並列生成で1セクションあたりに求める文字数と出力トークン上限
+        self.section_chars = int(os.getenv('SECTION_TARGET_CHARS', '200'))
+        self.section_max_tokens = int(os.getenv('SECTION_MAX_TOKENS', '500'))
+        
+        # LLM呼び出しを並列に発行するプール（占い結果生成サービスが共有I/Oプールを設定する。未設定なら順に実行）
+        self._io_submit: Callable[..., concurrent.futures.Future] | None = None
     
-    def __del__(self):
-        """リソースクリーンアップ"""
-        if hasattr(self, '_executor'):
-            self._executor.shutdown(wait=False)
+    def use_io_pool(self, submit: Callable[..., concurrent.futures.Future]):
+        """セクションの並列生成などに使うプールのsubmit関数を設定（呼び出し元のコンテキストを引き継ぐもの）"""
+        self._io_submit = submit
     
-    def _generate_with_groq(self, prompt: str, max_tokens: int = 1000) -> str:
-        """Groqを使用してテキストを生成（判断・推測用）"""
-        try:
+    def _call_groq(self, prompt: str, max_tokens: int = 1000, model: str | None = None, temperature: float = 0.7) -> str:
+        """Groqを直接呼び出す（フォールバックなし、失敗時は例外を送出。modelを省略すると大きいモデル）"""
+        model = model or self.groq_model
+        
+        def request(timeout: float):
+            started = time.perf_counter()
             response = self.groq_client.chat.completions.create(
-                model=self.groq_model,
+                model=model,
                 messages=[
                     {"role": "system", "content": "あなたは専門的な占い師です。日本語で丁寧に回答してください。"},
                     {"role": "user", "content": prompt}
                 ],
                 max_tokens=max_tokens,
-                temperature=0.7,
-                top_p=0.9
+                temperature=temperature,
+                top_p=0.9,
+                timeout=timeout
             )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"Groq生成エラー: {e}")
-            # フォールバック: Geminiを使用
-            if self.gemini_model:
-                try:
-                    response = self.gemini_model.generate_content(prompt)
-                    return response.text.strip()
-                except Exception as gemini_error:
-                    print(f"Gemini生成エラー: {gemini_error}")
-                    return self._get_timeout_message()
-            else:
-                return self._get_timeout_message()
+            text = response.choices[0].message.content.strip()
+            usage = getattr(response, 'usage', None)
+            self._record_usage('groq', model, prompt, text, started,
+                               getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
+            return text
+        
+        return self._scheduled_call('groq', prompt, max_tokens, request)
+    
+    def _call_gemini(self, prompt: str) -> str:
+        """Geminiを直接呼び出す（フォールバックなし、失敗時は例外を送出）"""
+        if not self.gemini_model:
+            raise ValueError("Gemini model not available")
+        
+        def request(timeout: float):
+            started = time.perf_counter()
+            response = self.gemini_model.generate_content(prompt, request_options={'timeout': timeout})
+            text = response.text.strip()
+            usage = getattr(response, 'usage_metadata', None)
+            self._record_usage('gemini', self.gemini_model_name, prompt, text, started,
+                               getattr(usage, 'prompt_token_count', None), getattr(usage, 'candidates_token_count', None))
+            return text
+        
+        return self._scheduled_call('gemini', prompt, 1000, request)
     
-    def _generate_analysis_with_gemini(self, prompt: str) -> str:
-        """Gemini 2.5 Flash Liteを使用して鑑定文を生成"""
+    def _scheduled_call(self, name: str, prompt: str, max_tokens: int, request) -> str:
+        """
+        サーキットブレーカーの呼び出し許可を得てから、スケジューラーでレート制限の枠を確保して呼び出す
+        （half_openで許可されなかった呼び出しがレート制限の枠を消費しないよう、許可を先に取る）。
+        requestには期限までの残り時間をHTTPタイムアウトとして渡す（期限を過ぎた呼び出しはその場で中断される）
+        """
+        health = provider_health.admit(name)
         try:
-            if not self.gemini_model:
-                raise ValueError("Gemini model not available")
-            
-            response = self.gemini_model.generate_content(prompt)
-            return response.text.strip()
+            llm_scheduler.acquire(name, estimate_tokens(prompt, max_tokens, name), timeout=call_timeout(llm_scheduler.max_wait))
+            timeout = call_timeout(self.request_timeout)
+        except Exception:
+            # 枠を確保できずに呼び出さなかった場合はプローブの許可を返す
+            health.release()
+            raise
+        prompt_token_stats.record(name, count_tokens(prompt, name))
+        return provider_health.call_admitted(health, lambda: request(timeout))
+    
+    def _record_usage(self, provider: str, model: str, prompt: str, text: str, started: float, prompt_tokens: int | None, completion_tokens: int | None):
+        """LLM呼び出しの使用量を現在のリクエストに記録（プロバイダーが返さない場合は概算）"""
+        estimated = prompt_tokens is None or completion_tokens is None
+        record_llm_call(
+            provider, model,
+            prompt_tokens if prompt_tokens is not None else count_tokens(prompt, provider),
+            completion_tokens if completion_tokens is not None else count_tokens(text, provider),
+            time.perf_counter() - started, estimated
+        )
+    
+    def track_usage(self):
+        """このコンテキスト内のLLM呼び出しのトークン数・コストを記録する台帳を用意するコンテキストマネージャー"""
+        return track_usage()
+    
+    def _submit(self, fn, *args) -> concurrent.futures.Future:
+        """共有I/Oプールで実行（未設定なら呼び出し元のスレッドで実行して完了済みのFutureを返す）"""
+        if self._io_submit is not None:
+            return self._io_submit(fn, *args)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
         except Exception as e:
-            print(f"Gemini鑑定文生成エラー: {e}")
-            # フォールバック: Groqを使用
+            future.set_exception(e)
+        return future
+    
+    def _call_with_deadline(self, timeout: float, fn, *args):
+        """
+        期限付きで呼び出し元のスレッドで実行する（占い結果の生成では既に共有I/Oプールのワーカー上にいる）。
+        期限はプロバイダーのHTTPタイムアウトとヘッジの待ち時間まで引き継がれるため、期限を過ぎて待ち続けることはない
+        """
+        with call_deadline(timeout):
+            return fn(*args)
+    
+    def request_priority(self, plan_type: str | None):
+        """プラン種別に応じたLLM呼び出しの優先度を設定するコンテキストマネージャー"""
+        return request_priority(plan_type)
+    
+    def template_tier(self, enabled: bool = True):
+        """このコンテキスト内の鑑定文をテンプレートで生成するコンテキストマネージャー（クイック鑑定用）"""
+        return template_tier(enabled)
+    
+    def use_template_tier(self) -> bool:
+        """LLMを呼ばずにテンプレート鑑定文で答えるべきか（クイック鑑定、または全プロバイダーの遮断・過負荷）"""
+        if template_tier_active():
+            return True
+        if not self.template_fallback:
+            return False
+        ranked = self._available_providers(['gemini', 'groq'])
+        if not ranked:
+            return True
+        queues = llm_scheduler.snapshot()
+        return all(queues.get(name, {}).get('queue_depth', 0) >= self.overload_queue_depth for name in ranked)
+    
+    def _template_reading(self, text: str) -> str:
+        """
+        テンプレート鑑定文を返したことを記録（LLM呼び出しなし）
+        クイック鑑定以外（過負荷・全プロバイダーの遮断・重複リクエスト・期限切れによる代替）は、結果をキャッシュしないよう劣化として記録する
+        """
+        record_cache_hit('template_reading')
+        if not template_tier_active():
+            record_degraded('template_fallback')
+        return text
+    
+    def _timeout_reading(self, compose: Callable[[], str]) -> str:
+        """期限切れ時の鑑定文（テンプレート鑑定文、無効の場合は従来のタイムアウト文面）"""
+        record_degraded('timeout_reading')
+        if not self.template_fallback:
+            return self._get_timeout_message()
+        return self._template_reading(compose())
+    
+    def _available_providers(self, preferred: List[str]) -> List[str]:
+        """設定済みのプロバイダーを健全な順に返す（サーキットが開いているものは除外）"""
+        configured = [name for name in preferred if name != 'gemini' or self.gemini_model]
+        return provider_health.rank(configured)
+    
+    def _call_provider(self, name: str, prompt: str, max_tokens: int = 1000, route: Dict[str, Any] | None = None) -> str:
+        """プロバイダー名を指定して呼び出す（routeがあればGroqはタスクに応じたモデル・出力上限で呼ぶ）"""
+        if name == 'gemini':
+            return self._call_gemini(prompt)
+        if route is not None:
+            model = self.groq_small_model if route['model'] == 'small' else self.groq_model
+            return self._call_groq(prompt, route['max_tokens'], model=model, temperature=route['temperature'])
+        return self._call_groq(prompt, max_tokens)
+    
+    def _route_model(self, name: str, route: Dict[str, Any] | None) -> str:
+        """タスク別レイテンシの集計に使うモデル名"""
+        if name == 'gemini':
+            return self.gemini_model_name
+        if route is not None and route['model'] == 'small':
+            return self.groq_small_model
+        return self.groq_model
+    
+    def _analysis_deadline(self, default: float) -> float:
+        """プロバイダーの健全性に応じた待機時間（全プロバイダー遮断時は即座に諦める）"""
+        return provider_health.suggest_timeout(self._available_providers(['gemini', 'groq']), default)
+    
+    def _generate_with_groq(self, prompt: str, max_tokens: int = 1000, task: str | None = None) -> str:
+        """
+        Groqを使用してテキストを生成（判断・推測用、不調時は最も健全なプロバイダーへ）。
+        taskを指定するとTASK_ROUTESに従ってモデルと出力上限を選び、タスク別のレイテンシを記録する
+        """
+        route = self.TASK_ROUTES.get(task) if task else None
+        for name in self._available_providers(['groq', 'gemini']):
+            started = time.perf_counter()
+            model = self._route_model(name, route)
             try:
-                return self._generate_with_groq(prompt, max_tokens=1000)
-            except Exception as groq_error:
-                print(f"Groqフォールバックエラー: {groq_error}")
-                return self._get_timeout_message()
+                text = self._call_provider(name, prompt, max_tokens, route)
+                task_latency_stats.record(task or 'untagged', model, time.perf_counter() - started)
+                return text
+            except Exception as e:
+                task_latency_stats.record(task or 'untagged', model, time.perf_counter() - started, ok=False)
+                print(f"{name}生成エラー: {e}")
+        record_degraded('llm_unavailable')
+        return self._get_timeout_message()
+    
+    def _generate_analysis_with_gemini(self, prompt: str, max_tokens: int = 1000) -> str:
+        """Gemini 2.5 Flash Liteを使用して鑑定文を生成（遅延時は次に健全なプロバイダーへヘッジ）"""
+        ranked = self._available_providers(['gemini', 'groq'])
+        if not ranked:
+            print("全てのLLMプロバイダーのサーキットが開いています")
+            record_degraded('llm_unavailable')
+            return self._get_timeout_message()
+        
+        timeout = remaining_time(self._analysis_deadline(self.analysis_timeout))
+        if timeout < MIN_CALL_TIMEOUT:
+            print("鑑定文生成の期限を過ぎているため、LLMを呼び出しません")
+            record_degraded('llm_deadline')
+            return self._get_timeout_message()
+        
+        primary = (ranked[0], lambda: self._call_provider(ranked[0], prompt, max_tokens=max_tokens))
+        secondary = (ranked[1], lambda: self._call_provider(ranked[1], prompt, max_tokens=max_tokens)) if len(ranked) > 1 else None
+        
+        try:
+            # ヘッジで発行する両方の呼び出しに期限を引き継ぐ（負けた側は送信前なら打ち切り、送信済みならHTTPタイムアウトで終わる）
+            with call_deadline(timeout):
+                return hedged_executor.run(primary, secondary, timeout=timeout)
+        except Exception as e:
+            print(f"鑑定文生成エラー（ヘッジ含む）: {e}")
+            record_degraded('llm_unavailable')
+            return self._get_timeout_message()
+    
+    def get_ai_stats(self) -> Dict[str, Any]:
+        """AI呼び出しの統計情報を取得（テールレイテンシ調整・キャッシュヒット率）"""
+        return {
+            'hedging': hedged_executor.get_stats(),
+            'providers': provider_health.snapshot(),
+            'scheduler': llm_scheduler.snapshot(),
+            'cache': self._cache.stats(),
+            'tarot_cache': self._tarot_cache.stats(),
+            'prompts': prompt_token_stats.snapshot(),
+            'library': reading_library.stats(),
+            'tasks': task_latency_stats.snapshot()
+        }
     
     def generate_numerology_analysis(self, numerology_data: Dict[str, Any], consultation: str = "") -> str:
-        """数秘術の鑑定文を生成"""
-        # キャッシュキーを生成
-        cache_key = f"numerology_{numerology_data['life_path']['number']}_{numerology_data['destiny']['number']}_{numerology_data['soul']['number']}_{numerology_data['personal']['number']}_{numerology_data['birthday']['number']}_{numerology_data['maturity']['number']}_{consultation}"
+        """数秘術の鑑定文を生成（一般的な相談は事前生成した鑑定文ライブラリから返す）"""
+        # ニックネームを取得（プロファイルデータから）
+        nickname = numerology_data.get('nickname', 'あなた')
+        names = {'{nickname}': nickname}
+        
+        # キャッシュキーを生成（チャートのシグネチャ + 正規化した相談内容）
+        signature = self.numerology_cache_signature(numerology_data)
+        cache_key = self._cache.key(signature, consultation)
+        
+        if is_generic_consultation(consultation):
+            library_text = reading_library.get(signature, nickname)
+            if library_text is not None:
+                print(f"AI分析を鑑定文ライブラリから取得: {signature}")
+                record_cache_hit('reading_library')
+                return library_text
         
-        # キャッシュから取得を試行
-        if cache_key in self._cache:
+        # キャッシュから取得を試行（類似した相談も含む、ニックネームは差し込み直して返す）
+        # 古くなった鑑定文はそのまま返し、バックグラウンドで再生成する
+        cached = self._named_cache_get(self._cache, 'ai_cache', signature, consultation, names, lambda text: self.numerology_prompt(numerology_data, text, nickname))
+        if cached is not None:
             print(f"AI分析をキャッシュから取得: {cache_key}")
-            return self._cache[cache_key]
+            return cached
         
-        # キャッシュサイズ制限チェック
-        if len(self._cache) >= self._cache_size_limit:
-            # 古いキャッシュエントリを削除（FIFO）
-            oldest_key = next(iter(self._cache))
-            del self._cache[oldest_key]
+        # クイック鑑定・過負荷時はテンプレート鑑定文で即答
+        if self.use_template_tier():
+            return self._template_reading(template_reader.numerology(numerology_data, consultation, nickname))
         
         # 処理中のリクエストをチェック（重複防止）
         if cache_key in self._processing_requests:
             print(f"AI分析が既に処理中: {cache_key}")
-            return self._get_default_numerology_analysis(numerology_data)
+            return self._get_default_numerology_analysis(numerology_data, consultation)
         
         # 処理中フラグを設定
         self._processing_requests.add(cache_key)
         
-        # ニックネームを取得（プロファイルデータから）
-        nickname = numerology_data.get('nickname', 'あなた')
-        
-        prompt = f"""数秘術師として、{nickname}さんの数秘術を分析してください。
-
-数秘術: LP{numerology_data['life_path']['number']}, D{numerology_data['destiny']['number']}, S{numerology_data['soul']['number']}, P{numerology_data['personal']['number']}, B{numerology_data['birthday']['number']}, M{numerology_data['maturity']['number']}
-
-相談: {consultation if consultation else "今日の運勢について"}
-
-500文字以内で、{nickname}さんに向けた温かい鑑定文を生成してください。"""
+        prompt = self.numerology_prompt(numerology_data, consultation, nickname)
         
         try:
             print(f"AI分析を新規生成: {cache_key}")
             print(f"プロンプト: {prompt[:100]}...")
             
             # タイムアウト処理付きでAI分析を実行（並列処理最適化）
-            future = self._executor.submit(self._generate_analysis_with_gemini, prompt)
-            result = future.result(timeout=25)  # 25秒に短縮
+            result = self._call_with_deadline(self._analysis_deadline(25), self._generate_analysis_with_gemini, prompt)  # プロバイダーの健全性に応じて短縮
                 
             print(f"AI分析完了: {len(result)}文字")
                 
-            # キャッシュに保存
-            self._cache[cache_key] = result
+            # キャッシュに保存（期限切れで中断された場合はキャッシュせずテンプレート鑑定文で返す）
+            if result == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.numerology(numerology_data, consultation, nickname))
+            self._cache.set(signature, consultation, self._to_name_template(result, names))
             return result
             
         except concurrent.futures.TimeoutError:
             print("AI数秘術分析タイムアウト（25秒）")
-            return self._get_timeout_message()
+            return self._timeout_reading(lambda: template_reader.numerology(numerology_data, consultation, nickname))
         except Exception as e:
             print(f"AI鑑定文生成エラー: {e}")
             print(f"エラーの詳細: {type(e).__name__}: {str(e)}")
-            return self._get_default_numerology_analysis(numerology_data)
+            return self._get_default_numerology_analysis(numerology_data, consultation)
         finally:
             # 処理中フラグをクリア
             self._processing_requests.discard(cache_key)
     
     def generate_horoscope_analysis(self, horoscope_data: Dict[str, Any], consultation: str = "") -> str:
-        """西洋占星術の鑑定文を生成"""
-        # キャッシュキーを生成
-        cache_key = f"horoscope_{horoscope_data.get('sun_sign', '')}_{horoscope_data.get('moon_sign', '')}_{horoscope_data.get('rising_sign', '')}_{consultation}"
+        """西洋占星術の鑑定文を生成（一般的な相談は事前生成した鑑定文ライブラリから返す）"""
+        sun_sign = horoscope_data.get('sun_sign', 'Aries')
+        moon_sign = horoscope_data.get('moon_sign', 'Cancer')
+        rising_sign = horoscope_data.get('rising_sign', 'Leo')
         
-        # キャッシュから取得を試行
-        if cache_key in self._cache:
+        # ニックネームを取得
+        nickname = horoscope_data.get('nickname', 'あなた')
+        names = {'{nickname}': nickname}
+        
+        # キャッシュキーを生成（チャートのシグネチャ + 正規化した相談内容）
+        signature = self.horoscope_cache_signature(horoscope_data.get('sun_sign', ''), horoscope_data.get('moon_sign', ''), horoscope_data.get('rising_sign', ''))
+        cache_key = self._cache.key(signature, consultation)
+        
+        if is_generic_consultation(consultation):
+            # ライブラリは日本語の星座名で引く（kerykeionの短縮形と英語名の表記揺れを吸収）
+            library_signature = horoscope_signature(
+                self._convert_sign_to_japanese(sun_sign), self._convert_sign_to_japanese(moon_sign), self._convert_sign_to_japanese(rising_sign)
+            )
+            library_text = reading_library.get(library_signature, nickname)
+            if library_text is not None:
+                print(f"AI分析を鑑定文ライブラリから取得: {library_signature}")
+                record_cache_hit('reading_library')
+                return library_text
+        
+        # キャッシュから取得を試行（類似した相談も含む、ニックネームは差し込み直して返す）
+        # 古くなった鑑定文はそのまま返し、バックグラウンドで再生成する
+        cached = self._named_cache_get(self._cache, 'ai_cache', signature, consultation, names, lambda text: self.horoscope_prompt(sun_sign, moon_sign, rising_sign, text, nickname))
+        if cached is not None:
             print(f"AI分析をキャッシュから取得: {cache_key}")
-            return self._cache[cache_key]
+            return cached
+        
+        # クイック鑑定・過負荷時はテンプレート鑑定文で即答
+        if self.use_template_tier():
+            return self._template_reading(template_reader.horoscope(horoscope_data, consultation, nickname))
         
         # 処理中のリクエストをチェック（重複防止）
         if cache_key in self._processing_requests:
             print(f"AI分析が既に処理中: {cache_key}")
-            return self._get_default_horoscope_analysis(horoscope_data)
+            return self._get_default_horoscope_analysis(horoscope_data, consultation)
         
         # 処理中フラグを設定
         self._processing_requests.add(cache_key)
         
-        sun_sign = horoscope_data.get('sun_sign', 'Aries')
-        moon_sign = horoscope_data.get('moon_sign', 'Cancer')
-        rising_sign = horoscope_data.get('rising_sign', 'Leo')
-        
-        # ニックネームを取得
-        nickname = horoscope_data.get('nickname', 'あなた')
-        
-        prompt = f"""西洋占星術師として、{nickname}さんのホロスコープを分析してください。
-
-ホロスコープ: 太陽{sun_sign}, 月{moon_sign}, 上昇{rising_sign}
-
-相談: {consultation if consultation else "今日の運勢について"}
-
-500文字以内で、{nickname}さんに向けた温かい鑑定文を生成してください。"""
+        prompt = self.horoscope_prompt(sun_sign, moon_sign, rising_sign, consultation, nickname)
         
         try:
             print(f"AI分析を新規生成: {cache_key}")
             print(f"プロンプト: {prompt[:100]}...")
             
             # タイムアウト処理付きでAI分析を実行（並列処理最適化）
-            future = self._executor.submit(self._generate_analysis_with_gemini, prompt)
-            result = future.result(timeout=25)  # 25秒に短縮
+            result = self._call_with_deadline(self._analysis_deadline(25), self._generate_analysis_with_gemini, prompt)  # プロバイダーの健全性に応じて短縮
                 
             print(f"AI分析完了: {len(result)}文字")
                 
-            # キャッシュに保存
-            self._cache[cache_key] = result
+            # キャッシュに保存（期限切れで中断された場合はキャッシュせずテンプレート鑑定文で返す）
+            if result == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.horoscope(horoscope_data, consultation, nickname))
+            self._cache.set(signature, consultation, self._to_name_template(result, names))
             return result
         except concurrent.futures.TimeoutError:
             print("AIホロスコープ分析タイムアウト（25秒）")
-            return self._get_timeout_message()
+            return self._timeout_reading(lambda: template_reader.horoscope(horoscope_data, consultation, nickname))
         except Exception as e:
             print(f"AI鑑定文生成エラー: {e}")
             print(f"エラーの詳細: {type(e).__name__}: {str(e)}")
-            return self._get_default_horoscope_analysis(horoscope_data)
+            return self._get_default_horoscope_analysis(horoscope_data, consultation)
         finally:
             # 処理中フラグをクリア
             self._processing_requests.discard(cache_key)
     
-    def generate_tarot_analysis(self, tarot_data: Dict[str, Any], consultation: str = "") -> str:
-        """タロット占いの鑑定文を生成"""
-        # ニックネームを取得
-        nickname = tarot_data.get('nickname', 'あなた')
-        
-        # カード情報を詳細に構築
-        drawn_cards = tarot_data.get('drawn_cards', [])
-        spread_name = tarot_data.get('spread_name', 'タロットスプレッド')
-        
+    def numerology_cache_signature(self, numerology_data: Dict[str, Any]) -> str:
+        """数秘術の鑑定文キャッシュのシグネチャ（鑑定文ライブラリと共通）"""
+        return numerology_signature(numerology_data)
+    
+    def horoscope_cache_signature(self, sun_sign: str, moon_sign: str, rising_sign: str) -> str:
+        """西洋占星術の鑑定文キャッシュのシグネチャ"""
+        return f"horoscope_{sun_sign}_{moon_sign}_{rising_sign}"
+    
+    def preload_cache(self, signature: str, consultation: str, text: str, nickname: str, created_at: float | None = None) -> bool:
+        """
+        過去の鑑定文をキャッシュに読み込む（デプロイ直後のウォームアップ用、created_atは生成時刻のUNIX時間）
+        「〇〇さん」はプレースホルダーに置き換え、それ以外の形でニックネームが残る鑑定文は別の利用者に返さないよう読み込まない
+        """
+        if not nickname:
+            return False
+        template = self._to_name_template(text, {'{nickname}': nickname})
+        if nickname in template.replace('{nickname}', ''):
+            return False
+        self._cache.set(signature, consultation, template, created_at)
+        return True
+    
+    def _refresh_text(self, prompt: str) -> str | None:
+        """キャッシュの再生成用に鑑定文を生成（期限切れ・失敗時はNoneを返し、古い鑑定文を残す）"""
+        result = self._call_with_deadline(self._analysis_deadline(25), self._generate_analysis_with_gemini, prompt)
+        if not result or result == self._get_timeout_message():
+            return None
+        return result
+    
+    def numerology_prompt(self, numerology_data: Dict[str, Any], consultation: str = "", nickname: str = "あなた") -> str:
+        """数秘術の鑑定文のプロンプト（鑑定文ライブラリのバッチ生成と共通）"""
+        return f"""数秘術師として、{nickname}さんの数秘術を分析してください。
+
+数秘術: LP{numerology_data['life_path']['number']}, D{numerology_data['destiny']['number']}, S{numerology_data['soul']['number']}, P{numerology_data['personal']['number']}, B{numerology_data['birthday']['number']}, M{numerology_data['maturity']['number']}
+
+相談: {consultation if consultation else "今日の運勢について"}
+
+500文字以内で、{nickname}さんに向けた温かい鑑定文を生成してください。"""
+    
+    def horoscope_prompt(self, sun_sign: str, moon_sign: str, rising_sign: str, consultation: str = "", nickname: str = "あなた") -> str:
+        """西洋占星術の鑑定文のプロンプト（鑑定文ライブラリのバッチ生成と共通）"""
+        return f"""西洋占星術師として、{nickname}さんのホロスコープを分析してください。
+
+ホロスコープ: 太陽{sun_sign}, 月{moon_sign}, 上昇{rising_sign}
+
+相談: {consultation if consultation else "今日の運勢について"}
+
+500文字以内で、{nickname}さんに向けた温かい鑑定文を生成してください。"""
+    
+    def _format_tarot_cards(self, drawn_cards: List[Dict[str, Any]], compact: bool = False) -> str:
+        """引かれたカードをプロンプト用に整形（compactの場合は1枚1行・意味は先頭の一文のみ）"""
         cards_info = []
-        for i, card in enumerate(drawn_cards):
+        for card in drawn_cards:
             card_name = card.get('card_name', '')
             position_name = card.get('position_name', '')
             position_meaning = card.get('position_meaning', '')
@@ -230,67 +505,316 @@ class AIAnalysisGenerator:
             
             # 逆位置の場合は特別に強調
             if is_reversed and reversed_meaning:
-                card_text = f"【{position_name}】{card_name}（逆位置）\n意味: {reversed_meaning}\n位置の意味: {position_meaning}"
+                label, meaning = f"{card_name}（逆位置）", reversed_meaning
             else:
-                card_text = f"【{position_name}】{card_name}\n意味: {card_description}\n位置の意味: {position_meaning}"
+                label, meaning = card_name, card_description
             
-            cards_info.append(card_text)
+            if compact:
+                cards_info.append(f"【{position_name}】{label}: {first_sentences(meaning, 40)}")
+            else:
+                cards_info.append(f"【{position_name}】{label}\n意味: {meaning}\n位置の意味: {position_meaning}")
         
-        cards_text = "\n\n".join(cards_info)
+        return "\n".join(cards_info) if compact else "\n\n".join(cards_info)
+    
+    def generate_tarot_analysis(self, tarot_data: Dict[str, Any], consultation: str = "") -> str:
+        """タロット占いの鑑定文を生成（同じスプレッド・カードの並びと類似した相談はキャッシュから返す）"""
+        # ニックネームを取得
+        nickname = tarot_data.get('nickname', 'あなた')
+        names = {'{nickname}': nickname}
+        
+        # キャッシュから取得を試行（ニックネームは差し込み直して返す）
+        signature = self.tarot_cache_signature(tarot_data, 'personal')
+        if signature is not None:
+            cached = self._tarot_cache_get(signature, consultation, names, lambda text: self.tarot_prompt(tarot_data, text, nickname))
+            if cached is not None:
+                print(f"タロット分析をキャッシュから取得: {signature}")
+                return cached
+        
+        # クイック鑑定・過負荷時はテンプレート鑑定文で即答
+        if self.use_template_tier():
+            return self._template_reading(template_reader.tarot(tarot_data, consultation, nickname))
+        
+        prompt = self.tarot_prompt(tarot_data, consultation, nickname)
+        
+        try:
+            # タイムアウト設定を追加（タロット分析の高速化）
+            result = self._call_with_deadline(self._analysis_deadline(20), self._generate_analysis_with_gemini, prompt)  # プロバイダーの健全性に応じて短縮
+            if result == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.tarot(tarot_data, consultation, nickname))
+            if signature is not None:
+                self._tarot_cache.set(signature, consultation, self._to_name_template(result, names))
+            return result
+        except Exception as e:
+            print(f"AI tarot analysis error: {e}")
+            return self._timeout_reading(lambda: template_reader.tarot(tarot_data, consultation, nickname))
+    
+    def tarot_prompt(self, tarot_data: Dict[str, Any], consultation: str = "", nickname: str = "あなた") -> str:
+        """タロット占いの鑑定文のプロンプト"""
+        # カード情報を詳細に構築
+        drawn_cards = tarot_data.get('drawn_cards', [])
+        spread_name = tarot_data.get('spread_name', 'タロットスプレッド')
         
-        prompt = f"""あなたは経験豊富なタロット占い師です。以下のタロットカードから温かい鑑定文を生成してください。
+        # トークン予算を超える場合はカードの説明から圧縮する（相談内容は先頭を残して切り詰め）
+        return PromptBuilder().add('header', f"""あなたは経験豊富なタロット占い師です。以下のタロットカードから温かい鑑定文を生成してください。
 
 【{nickname}さんのタロット占い結果】
-スプレッド: {spread_name}
-
-引かれたカード:
-{cards_text}
-
-相談内容: {consultation if consultation else "今日の運勢について"}
-
-【重要】
+スプレッド: {spread_name}""").add(
+            'cards', f"引かれたカード:\n{self._format_tarot_cards(drawn_cards)}", priority=2,
+            compact=lambda: f"引かれたカード:\n{self._format_tarot_cards(drawn_cards, compact=True)}"
+        ).add(
+            'consultation', f"相談内容: {consultation if consultation else '今日の運勢について'}", priority=1, min_chars=100
+        ).add('instructions', f"""【重要】
 - 逆位置のカードがある場合は、その特別な意味を必ず考慮してください
 - 各カードの位置（過去・現在・未来など）の意味も重要です
 - {nickname}さんという名前で呼びかけてください
 
 500文字前後で、{nickname}さんに向けた温かい鑑定文を生成してください。
 逆位置のカードの意味や、各位置でのカードの意味を適切に解釈し、
-具体的で実用的なアドバイスを含めてください。"""
+具体的で実用的なアドバイスを含めてください。""").build().text
+    
+    def tarot_cache_signature(self, tarot_data: Dict[str, Any], kind: str) -> str | None:
+        """タロットの鑑定文キャッシュのシグネチャ（スプレッドと引いたカード・正逆の並び、IDのない結果はキャッシュしない）"""
+        spread_id = tarot_data.get('spread_id')
+        drawn_cards = tarot_data.get('drawn_cards', [])
+        if not spread_id or not drawn_cards or any(not card.get('card_id') for card in drawn_cards):
+            return None
+        draw = "-".join(f"{card['card_id']}{'R' if card.get('is_reversed') else 'U'}" for card in drawn_cards)
+        return f"tarot_{kind}_{spread_id}_{draw}"
+    
+    def _tarot_cache_get(self, signature: str, consultation: str, names: Dict[str, str], prompt_for: Callable[[str], str]) -> str | None:
+        """タロットの鑑定文キャッシュから取得（古くなった鑑定文はそのまま返し、バックグラウンドで再生成する）"""
+        return self._named_cache_get(self._tarot_cache, 'tarot_cache', signature, consultation, names, prompt_for)
+    
+    def _named_cache_get(self, cache: AITextCache, source: str, signature: str, consultation: str, names: Dict[str, str], prompt_for: Callable[[str], str]) -> str | None:
+        """
+        ニックネームをプレースホルダーにして保存した鑑定文キャッシュから取得し、今の利用者のニックネームを差し込んで返す
+        （再生成した鑑定文もプレースホルダーに置き換えてから保存する）
+        """
+        def refresh(text: str) -> str | None:
+            result = self._refresh_text(prompt_for(text))
+            return self._to_name_template(result, names) if result else None
+        
+        cached = cache.get(signature, consultation, refresh=refresh)
+        if cached is None:
+            return None
+        record_cache_hit(source)
+        for placeholder, name in names.items():
+            cached = cached.replace(placeholder, name)
+        return cached
+    
+    def _to_name_template(self, text: str, names: Dict[str, str]) -> str:
+        """鑑定文の「〇〇さん」をプレースホルダーに置き換える（別の利用者に同じ鑑定文を返すため）"""
+        # 一方のニックネームがもう一方に含まれる場合に備えて長い順に置換
+        for placeholder, name in sorted(names.items(), key=lambda item: len(item[1]), reverse=True):
+            if name:
+                text = text.replace(f"{name}さん", f"{placeholder}さん")
+        return text
+
+    def generate_group_analysis(self, group_data: Dict[str, Any], fortune_type: str, consultation: str = "") -> str:
+        """グループ相性（3人以上）の鑑定文を1回の呼び出しで生成（スコア行列は計算済みのものを使う）"""
+        # クイック鑑定・過負荷時はテンプレート鑑定文で即答
+        if self.use_template_tier():
+            return self._template_reading(template_reader.group(group_data, fortune_type, consultation))
+        
+        members = group_data.get('members', [])
+        names = "、".join(f"{member['nickname']}さん" for member in members)
+        
+        def member_line(member: Dict[str, Any]) -> str:
+            details = []
+            if 'life_path' in member:
+                details.append(f"LP{member['life_path']}, D{member['destiny']}, S{member['soul']}, P{member['personal']}")
+            if 'sun_sign' in member:
+                details.append(f"太陽{self._convert_sign_to_japanese(member.get('sun_sign'))}, 月{self._convert_sign_to_japanese(member.get('moon_sign'))}")
+            return f"{member['nickname']}: {' / '.join(details)}"
+        
+        def pair_lines(pairs: List[Dict[str, Any]]) -> str:
+            return "、".join(f"{pair['person1']}さんと{pair['person2']}さん（{pair['score']}/100）" for pair in pairs)
+        
+        # トークン予算を超える場合はメンバーごとの詳細から切り詰める（スコアの要約は残す）
+        prompt = PromptBuilder().add('header', f"""あなたは経験豊富な占い師です。{names}の{len(members)}人のグループ相性を鑑定してください。""").add(
+            'members', "メンバー:\n" + "\n".join(member_line(member) for member in members), priority=2, min_chars=100
+        ).add('scores', f"""グループの平均相性スコア: {group_data.get('average_score')}/100
+相性の良いペア: {pair_lines(group_data.get('best_pairs', []))}
+課題のあるペア: {pair_lines(group_data.get('worst_pairs', []))}""").add(
+            'consultation', f"相談内容: {consultation if consultation else 'グループの関係について'}", priority=1, min_chars=100
+        ).add('instructions', """600文字前後で、グループ全体の傾向、相性の良いペアと課題のあるペアの関わり方、
+皆さんがより良い関係を築くための具体的なアドバイスを含む温かい鑑定文を生成してください。
+メンバーは必ず「〇〇さん」とニックネームで呼んでください。""").build().text
         
         try:
-            # タイムアウト設定を追加（タロット分析の高速化）
-            future = self._executor.submit(self._generate_analysis_with_gemini, prompt)
-            result = future.result(timeout=20)  # 20秒に短縮
+            result = self._call_with_deadline(self._analysis_deadline(25), self._generate_analysis_with_gemini, prompt)  # プロバイダーの健全性に応じて短縮
+            if result == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.group(group_data, fortune_type, consultation))
             return result
         except Exception as e:
-            print(f"AI tarot analysis error: {e}")
-            return f"{nickname}さんのタロット占いの鑑定文を生成中です..."
-
+            print(f"AI group analysis error: {e}")
+            return self._timeout_reading(lambda: template_reader.group(group_data, fortune_type, consultation))
+    
     def generate_comprehensive_analysis(self, comprehensive_data: Dict[str, Any], consultation: str = "") -> str:
         """総合鑑定の鑑定文を生成"""
         # ニックネームを取得
         nickname = comprehensive_data.get('nickname', 'あなた')
         
-        prompt = f"""総合占い師として、以下の複数の占術結果から温かい鑑定文を生成してください。
+        prompt = PromptBuilder().add('header', f"""総合占い師として、以下の複数の占術結果から温かい鑑定文を生成してください。
 
-{nickname}さんの総合鑑定:
-数秘術: {comprehensive_data.get('numerology', 'データ取得中...')}
+{nickname}さんの総合鑑定:""").add(
+            'results', f"""数秘術: {comprehensive_data.get('numerology', 'データ取得中...')}
 ホロスコープ: {comprehensive_data.get('horoscope', 'データ取得中...')}
-タロット: {comprehensive_data.get('tarot', 'データ取得中...')}
-
-相談: {consultation if consultation else "今日の運勢について"}
-
-500文字前後で、{nickname}さんに向けた総合鑑定文を生成してください。
-複数の占術の結果を統合し、温かく希望的な内容で、具体的で実用的なアドバイスを含めてください。"""
+タロット: {comprehensive_data.get('tarot', 'データ取得中...')}""", priority=2, min_chars=300
+        ).add(
+            'consultation', f"相談: {consultation if consultation else '今日の運勢について'}", priority=1, min_chars=100
+        ).add('instructions', f"""500文字前後で、{nickname}さんに向けた総合鑑定文を生成してください。
+複数の占術の結果を統合し、温かく希望的な内容で、具体的で実用的なアドバイスを含めてください。""").build().text
         
         try:
-            return self._generate_with_groq(prompt, max_tokens=1000)
+            return self._generate_with_groq(prompt, max_tokens=1000, task='prose')
         except Exception as e:
             print(f"AI comprehensive analysis error: {e}")
             return f"{nickname}さんの総合鑑定文を生成中です..."
 
+    def generate_template_comprehensive(self, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], consultation: str = "", nickname: str = "あなた") -> str:
+        """総合鑑定（個人）のテンプレート鑑定文"""
+        return self._template_reading(template_reader.comprehensive(numerology_data, horoscope_data, consultation, nickname))
+    
+    def generate_template_comprehensive_compatibility(self, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], consultation: str = "") -> str:
+        """総合相性のテンプレート鑑定文"""
+        return self._template_reading(template_reader.comprehensive_compatibility(numerology_compatibility, horoscope_compatibility, consultation))
+    
+    def _comprehensive_context(self, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], nickname: str) -> str:
+        """総合鑑定（個人）のプロンプトで共有するコンテキスト"""
+        numbers = ", ".join(
+            f"{label}{numerology_data[key]['number']}（{numerology_data[key].get('meaning', '')}）"
+            for key, label in [('life_path', 'ライフパス'), ('destiny', 'ディスティニー'), ('soul', 'ソウル'), ('personal', 'パーソナル')]
+        )
+        signs = f"太陽{self._convert_sign_to_japanese(horoscope_data.get('sun_sign', 'Aries'))}, 月{self._convert_sign_to_japanese(horoscope_data.get('moon_sign', 'Cancer'))}, 上昇{self._convert_sign_to_japanese(horoscope_data.get('rising_sign', 'Leo'))}"
+        return f"""あなたは経験豊富な占い師です。{nickname}さんの数秘術と西洋占星術の結果を統合して、総合的な鑑定を行ってください。
+
+数秘術: {numbers}
+ホロスコープ: {signs}"""
+    
+    def _comprehensive_compatibility_context(self, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], person1_nickname: str, person2_nickname: str) -> str:
+        """総合鑑定（相性）のプロンプトで共有するコンテキスト"""
+        def person_line(nickname: str, numerology: Dict[str, Any], horoscope: Dict[str, Any]) -> str:
+            return (f"{nickname}: LP{numerology['life_path']['number']}, D{numerology['destiny']['number']}, S{numerology['soul']['number']}, P{numerology['personal']['number']} / "
+                    f"太陽{self._convert_sign_to_japanese(horoscope.get('sun_sign', 'Aries'))}, 月{self._convert_sign_to_japanese(horoscope.get('moon_sign', 'Cancer'))}, 上昇{self._convert_sign_to_japanese(horoscope.get('rising_sign', 'Leo'))}")
+        
+        return f"""あなたは経験豊富な占い師です。{person1_nickname}さんと{person2_nickname}さんの数秘術と西洋占星術の相性を統合して、総合的な相性鑑定を行ってください。
+
+{person_line(person1_nickname, numerology_compatibility['person1'], horoscope_compatibility['person1'])}
+{person_line(person2_nickname, numerology_compatibility['person2'], horoscope_compatibility['person2'])}
+数秘術の相性スコア: {numerology_compatibility['compatibility_score']}/100
+星座の組み合わせによる参考スコア: {horoscope_compatibility['compatibility_score']}/100"""
+    
+    def generate_structured_comprehensive(self, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], consultation: str = "", nickname: str = "あなた") -> ComprehensiveReading | None:
+        """数秘術と西洋占星術をまとめた総合鑑定を1回の呼び出しでJSONとして生成（検証失敗時はNone）"""
+        prompt = PromptBuilder().add('header', self._comprehensive_context(numerology_data, horoscope_data, nickname)).add(
+            'consultation', f"相談内容: {consultation if consultation else '一般的な運勢について'}", priority=1, min_chars=100
+        ).add('instructions', f"""各セクションは{nickname}さんに呼びかける温かい文章で、具体的で実用的なアドバイスを含めてください。
+以下のJSON形式のみで回答してください（説明文やコードブロックは不要）:
+{schema_example(COMPREHENSIVE_SECTIONS)}""").build().text
+        
+        return self._generate_structured(prompt, ComprehensiveReading)
+    
+    def generate_structured_comprehensive_compatibility(self, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], consultation: str = "", person1_nickname: str = "あなた", person2_nickname: str = "相手") -> ComprehensiveCompatibilityReading | None:
+        """数秘術と西洋占星術の相性をまとめた総合相性鑑定を1回の呼び出しでJSONとして生成（検証失敗時はNone）"""
+        prompt = PromptBuilder().add('header', self._comprehensive_compatibility_context(
+            numerology_compatibility, horoscope_compatibility, person1_nickname, person2_nickname
+        )).add(
+            'consultation', f"相談内容: {consultation if consultation else '一般的な相性について'}", priority=1, min_chars=100
+        ).add('instructions', f"""horoscope_scoreは西洋占星術の観点での相性スコア、overall_scoreは総合的な相性スコア（いずれも0-100の整数）です。
+各セクションは必ず「{person1_nickname}さん」と「{person2_nickname}さん」のニックネームを使い、相談内容を踏まえた建設的なアドバイスを含めてください。
+以下のJSON形式のみで回答してください（説明文やコードブロックは不要）:
+{schema_example(COMPATIBILITY_SECTIONS, scores=('overall_score', 'horoscope_score'))}""").build().text
+        
+        return self._generate_structured(prompt, ComprehensiveCompatibilityReading)
+    
+    def _generate_structured(self, prompt: str, model):
+        """構造化出力を1回の呼び出しで生成しスキーマ検証する"""
+        try:
+            response_text = self._call_with_deadline(self._analysis_deadline(25), self._generate_analysis_with_gemini, prompt, 2000)  # プロバイダーの健全性に応じて短縮
+        except Exception as e:
+            print(f"構造化出力の生成エラー: {e}")
+            return None
+        return parse_reading(response_text, model)
+    
+    def generate_sectioned_comprehensive(self, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], consultation: str = "", nickname: str = "あなた", on_section: SectionCallback | None = None) -> str | None:
+        """総合鑑定（個人）の各セクションを並列に生成して連結（生成できたセクションが半数未満ならNone）"""
+        return self._generate_sections(
+            self._comprehensive_context(numerology_data, horoscope_data, nickname),
+            f"相談内容: {consultation if consultation else '一般的な運勢について'}",
+            f"{nickname}さんに呼びかける温かい文章で、具体的で実用的なアドバイスを含めてください。",
+            COMPREHENSIVE_SECTIONS, on_section
+        )
+    
+    def generate_sectioned_comprehensive_compatibility(self, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], consultation: str = "", person1_nickname: str = "あなた", person2_nickname: str = "相手", on_section: SectionCallback | None = None) -> str | None:
+        """総合鑑定（相性）の各セクションを並列に生成して連結（生成できたセクションが半数未満ならNone）"""
+        return self._generate_sections(
+            self._comprehensive_compatibility_context(numerology_compatibility, horoscope_compatibility, person1_nickname, person2_nickname),
+            f"相談内容: {consultation if consultation else '一般的な相性について'}",
+            f"必ず「{person1_nickname}さん」と「{person2_nickname}さん」のニックネームを使い、相談内容を踏まえた建設的なアドバイスを含めてください。",
+            COMPATIBILITY_SECTIONS, on_section,
+            postprocess=lambda text: self._fix_nickname_usage(text, person1_nickname, person2_nickname)
+        )
+    
+    def _generate_sections(self, context: str, consultation_line: str, style: str, layout: List[Tuple[str, str]], on_section: SectionCallback | None = None, postprocess: Callable[[str], str] | None = None) -> str | None:
+        """
+        共通のコンテキストにセクションごとの指示を付けて並列に呼び出し、完了した順にon_sectionへ通知する。
+        全体の所要時間は各セクションの合計ではなく最も遅いセクションで決まる。
+        """
+        titles = "、".join(title for _, title in layout)
+        prompts = [
+            PromptBuilder().add('header', context).add('consultation', consultation_line, priority=1, min_chars=100).add('instructions', f"""鑑定は「{titles}」のセクションで構成され、各セクションは別々に作成されます。
+あなたの担当は「{title}」のセクションだけです。他のセクションと内容が重ならないようにしてください。
+{style}
+見出しや番号は付けず、本文のみを{self.section_chars}文字前後で書いてください。""").build().text
+            for _, title in layout
+        ]
+        
+        texts: Dict[str, str] = {}
+        timeout_message = self._get_timeout_message()
+        timeout = self._analysis_deadline(self.analysis_timeout)
+        # 全セクションを共有I/Oプールへ同時に発行し、期限を各セクションのHTTPタイムアウトまで引き継いで打ち切ったセクションが残らないようにする
+        with call_deadline(timeout):
+            futures = {
+                self._submit(self._generate_analysis_with_gemini, prompt, self.section_max_tokens): index
+                for index, prompt in enumerate(prompts)
+            }
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=timeout):
+                index = futures[future]
+                key, title = layout[index]
+                try:
+                    text = clean_section_text(future.result(), title)
+                except Exception as e:
+                    print(f"セクション生成エラー（{title}）: {e}")
+                    continue
+                if not text or text == timeout_message:
+                    print(f"セクションを生成できませんでした: {title}")
+                    continue
+                if postprocess:
+                    text = postprocess(text)
+                texts[key] = text
+                if on_section:
+                    try:
+                        on_section(index, key, title, text)
+                    except Exception as e:
+                        print(f"セクション通知エラー（{title}）: {e}")
+        except concurrent.futures.TimeoutError:
+            print(f"セクション生成がタイムアウトしました（完了: {len(texts)}/{len(layout)}）")
+        finally:
+            # まだ始まっていないセクションは取り消す
+            for future in futures:
+                future.cancel()
+        
+        if len(texts) * 2 < len(layout):
+            return None
+        return render_section_texts(texts, layout)
+    
     def generate_compatibility_analysis(self, compatibility_data: Dict[str, Any], fortune_type: str, consultation: str = "") -> str:
         """相性分析の鑑定文を生成"""
+        # クイック鑑定・過負荷時はテンプレート鑑定文で即答
+        if fortune_type in ('numerology', 'horoscope', 'tarot') and self.use_template_tier():
+            return self._template_reading(template_reader.compatibility(compatibility_data, fortune_type, consultation))
         if fortune_type == 'numerology':
             return self._generate_numerology_compatibility(compatibility_data, consultation)
         elif fortune_type == 'horoscope':
@@ -324,8 +848,9 @@ class AIAnalysisGenerator:
         
         try:
             # タイムアウト設定を追加（並列処理最適化）
-            future = self._executor.submit(self._generate_analysis_with_gemini, prompt)
-            analysis_text = future.result(timeout=25)  # 25秒に短縮
+            analysis_text = self._call_with_deadline(self._analysis_deadline(25), self._generate_analysis_with_gemini, prompt)  # プロバイダーの健全性に応じて短縮
+            if analysis_text == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.compatibility(data, 'numerology', consultation))
                 
             # ニックネームの後処理チェック
             analysis_text = self._fix_nickname_usage(analysis_text, person1_nickname, person2_nickname)
@@ -333,46 +858,16 @@ class AIAnalysisGenerator:
             return analysis_text
         except concurrent.futures.TimeoutError:
             print("AI相性分析タイムアウト（25秒）")
-            return self._get_timeout_message()
+            return self._timeout_reading(lambda: template_reader.compatibility(data, 'numerology', consultation))
         except Exception as e:
             print(f"AI相性分析生成エラー: {e}")
-            return self._get_fallback_compatibility_analysis(data)
+            return self._get_fallback_compatibility_analysis(data, consultation)
     
-    def _get_fallback_compatibility_analysis(self, data: Dict[str, Any]) -> str:
-        """フォールバック用の相性分析"""
-        person1_nickname = data.get('person1_nickname', '人物1')
-        person2_nickname = data.get('person2_nickname', '人物2')
-        score = data.get('compatibility_score', 50)  # デフォルト値を設定
+    def _get_fallback_compatibility_analysis(self, data: Dict[str, Any], consultation: str = "") -> str:
+        """フォールバック用の相性分析（意味テーブルから組み立てるテンプレート鑑定文）"""
+        record_degraded('compatibility_fallback')
         fortune_type = data.get('fortune_type', 'numerology')
-        
-        # 占いの種類に応じた分析
-        if fortune_type == 'horoscope':
-            if score >= 80:
-                return f"{person1_nickname}さんと{person2_nickname}さんは非常に良い相性です。星座のエネルギーが調和し、お互いを高め合える素晴らしい関係を築けるでしょう。"
-            elif score >= 60:
-                return f"{person1_nickname}さんと{person2_nickname}さんは良い相性です。星座の特性を理解し合えば、安定した関係を築けるでしょう。"
-            elif score >= 40:
-                return f"{person1_nickname}さんと{person2_nickname}さんは普通の相性です。努力次第で良い関係を築くことができます。星座の違いを理解し合うことが大切です。"
-            else:
-                return f"{person1_nickname}さんと{person2_nickname}さんの相性には課題があります。お互いの星座の特性を理解し、時間をかけて関係を築いていくことをお勧めします。"
-        elif fortune_type == 'tarot':
-            if score >= 80:
-                return f"{person1_nickname}さんと{person2_nickname}さんは非常に良い相性です。タロットカードが示すように、お互いを高め合える素晴らしい関係を築けるでしょう。"
-            elif score >= 60:
-                return f"{person1_nickname}さんと{person2_nickname}さんは良い相性です。カードの導きに従い、安定した関係を築けるでしょう。"
-            elif score >= 40:
-                return f"{person1_nickname}さんと{person2_nickname}さんは普通の相性です。努力次第で良い関係を築くことができます。カードのメッセージを大切にしてください。"
-            else:
-                return f"{person1_nickname}さんと{person2_nickname}さんの相性には課題があります。カードが示すメッセージを理解し、時間をかけて関係を築いていくことをお勧めします。"
-        else:  # numerology
-            if score >= 80:
-                return f"{person1_nickname}さんと{person2_nickname}さんは非常に良い相性です。数秘術のエネルギーが調和し、お互いを高め合える素晴らしい関係を築けるでしょう。"
-            elif score >= 60:
-                return f"{person1_nickname}さんと{person2_nickname}さんは良い相性です。数秘術の観点からも、バランスの取れた関係性が期待できます。"
-            elif score >= 40:
-                return f"{person1_nickname}さんと{person2_nickname}さんは普通の相性です。数秘術のエネルギーを活かして、お互いを理解し合うことが大切です。"
-            else:
-                return f"{person1_nickname}さんと{person2_nickname}さんの相性には課題があります。数秘術の観点からも、時間をかけて関係を築いていくことをお勧めします。"
+        return self._template_reading(template_reader.compatibility(data, fortune_type, consultation))
     
     def _generate_horoscope_compatibility(self, data: Dict[str, Any], consultation: str = "") -> str:
         """西洋占星術相性分析を生成"""
@@ -402,7 +897,9 @@ class AIAnalysisGenerator:
 500文字前後で、{person1_nickname}さんと{person2_nickname}さんの相性分析を生成してください。"""
         
         try:
-            analysis_text = self._generate_with_groq(prompt, max_tokens=1000)
+            analysis_text = self._generate_with_groq(prompt, max_tokens=1000, task='prose')
+            if analysis_text == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.compatibility(data, 'horoscope', consultation))
             
             # ニックネームの後処理チェック
             analysis_text = self._fix_nickname_usage(analysis_text, person1_nickname, person2_nickname)
@@ -410,10 +907,38 @@ class AIAnalysisGenerator:
             return analysis_text
         except Exception as e:
             print(f"AI相性分析生成エラー: {e}")
-            return self._get_fallback_compatibility_analysis(data)
+            return self._get_fallback_compatibility_analysis(data, consultation)
     
     def _generate_tarot_compatibility(self, data: Dict[str, Any], consultation: str = "") -> str:
-        """タロット相性分析を生成"""
+        """タロット相性分析を生成（同じスプレッド・カードの並びと類似した相談はキャッシュから返す）"""
+        person1_nickname = data.get('person1_nickname', '人物1')
+        person2_nickname = data.get('person2_nickname', '人物2')
+        names = {'{person1}': person1_nickname, '{person2}': person2_nickname}
+        
+        # キャッシュから取得を試行（相性スコアはカードから決まるためシグネチャに含めない）
+        signature = self.tarot_cache_signature(data, 'compatibility')
+        if signature is not None:
+            cached = self._tarot_cache_get(signature, consultation, names, lambda text: self.tarot_compatibility_prompt(data, text))
+            if cached is not None:
+                print(f"タロット相性分析をキャッシュから取得: {signature}")
+                return cached
+        
+        prompt = self.tarot_compatibility_prompt(data, consultation)
+        
+        try:
+            # タイムアウト設定を追加（相性タロット分析の高速化）
+            result = self._call_with_deadline(self._analysis_deadline(20), self._generate_analysis_with_gemini, prompt)  # プロバイダーの健全性に応じて短縮
+            if result == self._get_timeout_message():
+                return self._timeout_reading(lambda: template_reader.compatibility(data, 'tarot', consultation))
+            if signature is not None:
+                self._tarot_cache.set(signature, consultation, self._to_name_template(result, names))
+            return result
+        except Exception as e:
+            print(f"AI相性分析生成エラー: {e}")
+            return self._get_fallback_compatibility_analysis(data, consultation)
+    
+    def tarot_compatibility_prompt(self, data: Dict[str, Any], consultation: str = "") -> str:
+        """タロット相性分析のプロンプト"""
         person1_nickname = data.get('person1_nickname', '人物1')
         person2_nickname = data.get('person2_nickname', '人物2')
         compatibility_score = data.get('compatibility_score', 50)
@@ -422,37 +947,17 @@ class AIAnalysisGenerator:
         drawn_cards = data.get('drawn_cards', [])
         spread_name = data.get('spread_name', 'ケルト十字')
         
-        cards_info = []
-        for i, card in enumerate(drawn_cards):
-            card_name = card.get('card_name', '')
-            position_name = card.get('position_name', '')
-            position_meaning = card.get('position_meaning', '')
-            is_reversed = card.get('is_reversed', False)
-            card_description = card.get('card_description', '')
-            reversed_meaning = card.get('reversed_meaning', '')
-            
-            # 逆位置の場合は特別に強調
-            if is_reversed and reversed_meaning:
-                card_text = f"【{position_name}】{card_name}（逆位置）\n意味: {reversed_meaning}\n位置の意味: {position_meaning}"
-            else:
-                card_text = f"【{position_name}】{card_name}\n意味: {card_description}\n位置の意味: {position_meaning}"
-            
-            cards_info.append(card_text)
-        
-        cards_text = "\n\n".join(cards_info)
-        
-        prompt = f"""あなたは経験豊富なタロット占い師です。以下の相性タロットから温かい相性分析を生成してください。
+        # トークン予算を超える場合はカードの説明から圧縮する（相談内容は先頭を残して切り詰め）
+        return PromptBuilder().add('header', f"""あなたは経験豊富なタロット占い師です。以下の相性タロットから温かい相性分析を生成してください。
 
 【{person1_nickname}さんと{person2_nickname}さんの相性タロット】
 スプレッド: {spread_name}
-相性スコア: {compatibility_score}/100
-
-引かれたカード:
-{cards_text}
-
-相談内容: {consultation if consultation else "一般的な相性について"}
-
-【重要】
+相性スコア: {compatibility_score}/100""").add(
+            'cards', f"引かれたカード:\n{self._format_tarot_cards(drawn_cards)}", priority=2,
+            compact=lambda: f"引かれたカード:\n{self._format_tarot_cards(drawn_cards, compact=True)}"
+        ).add(
+            'consultation', f"相談内容: {consultation if consultation else '一般的な相性について'}", priority=1, min_chars=100
+        ).add('instructions', f"""【重要】
 - 逆位置のカードがある場合は、その特別な意味を必ず考慮してください
 - 各カードの位置（現在・過去・未来など）の意味も重要です
 - 必ず「{person1_nickname}さん」と「{person2_nickname}さん」のニックネームを使用してください
@@ -460,121 +965,19 @@ class AIAnalysisGenerator:
 
 500文字前後で、{person1_nickname}さんと{person2_nickname}さんの相性分析を生成してください。
 逆位置のカードの意味や、各位置でのカードの意味を適切に解釈し、
-具体的で実用的なアドバイスを含めてください。"""
-        
-        try:
-            # タイムアウト設定を追加（相性タロット分析の高速化）
-            future = self._executor.submit(self._generate_analysis_with_gemini, prompt)
-            result = future.result(timeout=20)  # 20秒に短縮
-            return result
-        except Exception as e:
-            print(f"AI相性分析生成エラー: {e}")
-            return self._get_fallback_compatibility_analysis(data)
+具体的で実用的なアドバイスを含めてください。""").build().text
     
     def _get_sign_meaning(self, sign: str) -> str:
         """星座の意味を取得"""
-        meanings = {
-            'Aries': '牡羊座 - 情熱的でリーダーシップがある',
-            'Taurus': '牡牛座 - 安定感があり、実用的',
-            'Gemini': '双子座 - 好奇心旺盛でコミュニケーション能力が高い',
-            'Cancer': '蟹座 - 感情的で家族を大切にする',
-            'Leo': '獅子座 - 創造的で自信に満ちている',
-            'Virgo': '乙女座 - 分析的で完璧主義',
-            'Libra': '天秤座 - バランス感覚があり、調和を求める',
-            'Scorpio': '蠍座 - 神秘的で情熱的',
-            'Sagittarius': '射手座 - 冒険的で哲学的な思考',
-            'Capricorn': '山羊座 - 責任感が強く、目標志向',
-            'Aquarius': '水瓶座 - 革新的で独立心が強い',
-            'Pisces': '魚座 - 直感的で共感力が高い'
-        }
-        return meanings.get(sign, f'{sign} - 特別な意味')
+        return SIGN_MEANINGS.get(sign, f'{sign} - 特別な意味')
     
-    def _get_default_numerology_analysis(self, numerology_data: Dict[str, Any]) -> str:
-        """デフォルトの数秘術鑑定文"""
-        life_path = numerology_data['life_path']['number']
-        return f"""
-【数秘術鑑定結果】
-
-あなたのライフパスナンバーは{life_path}です。
-この数字は、あなたの人生の方向性と使命を示しています。
-
-{self._get_number_analysis(life_path)}
-
-数秘術は、あなたの潜在能力と人生の可能性を教えてくれます。
-今日から、この数字の力を意識して生活してみてください。
-"""
+    def _get_default_numerology_analysis(self, numerology_data: Dict[str, Any], consultation: str = "") -> str:
+        """デフォルトの数秘術鑑定文（意味テーブルから組み立てるテンプレート鑑定文）"""
+        return self._template_reading(template_reader.numerology(numerology_data, consultation))
     
-    def _get_default_horoscope_analysis(self, horoscope_data: Dict[str, Any]) -> str:
-        """デフォルトの西洋占星術鑑定文"""
-        sun_sign = horoscope_data.get('sun_sign', 'Aries')
-        return f"""
-【西洋占星術鑑定結果】
-
-あなたの太陽星座は{sun_sign}です。
-この星座は、あなたの基本的な性格とアイデンティティを示しています。
-
-{self._get_sign_analysis(sun_sign)}
-
-ホロスコープは、あなたの人生の可能性を教えてくれます。
-今日から、この星座の特性を活かして生活してみてください。
-"""
-    
-    def _get_number_analysis(self, number: int) -> str:
-        """数字の分析を取得"""
-        analyses = {
-            1: "リーダーシップと創造性に満ちた人生が待っています。独立心を大切にし、新しい道を切り開いていきましょう。",
-            2: "協調性とバランス感覚があなたの強みです。周囲との調和を大切にし、平和な関係を築いていきましょう。",
-            3: "表現力と創造性が豊かな人生が約束されています。芸術やコミュニケーションの分野で才能を発揮できるでしょう。",
-            4: "安定と実用性を重視する人生です。着実に努力を重ね、長期的な目標に向かって進んでいきましょう。",
-            5: "自由と変化に満ちた人生が待っています。新しい経験を恐れず、冒険心を持って挑戦していきましょう。",
-            6: "責任感と愛情深さがあなたの特徴です。家族や周囲の人々を大切にし、調和の取れた関係を築いていきましょう。",
-            7: "精神性と内省的な人生が約束されています。深い思考と直感を大切にし、内面の成長を目指していきましょう。",
-            8: "成功と物質的達成があなたの目標です。リーダーシップを発揮し、大きな成果を上げることができるでしょう。",
-            9: "完成と智慧に満ちた人生です。奉仕の精神を持ち、他者のために行動することで、真の幸せを見つけられるでしょう。",
-            11: "直感と啓示に満ちた特別な人生です。スピリチュアルな成長を目指し、高い意識レベルを追求していきましょう。",
-            22: "マスタービルダーとしての使命があります。大きな夢を実現し、社会に貢献する人生が待っています。",
-            33: "マスターティーチャーとしての特別な使命があります。他者を癒し、導くことで、真の幸せを見つけられるでしょう。"
-        }
-        return analyses.get(number, "特別な意味を持つ数字です。")
-    
-    def _get_sign_analysis(self, sign: str) -> str:
-        """星座の分析を取得"""
-        analyses = {
-            'Aries': "情熱的でリーダーシップに満ちた人生が待っています。新しい挑戦を恐れず、積極的に行動していきましょう。",
-            'Taurus': "安定感と実用性を重視する人生です。着実に努力を重ね、美しいものを大切にしていきましょう。",
-            'Gemini': "好奇心旺盛でコミュニケーション能力が高い人生です。新しい知識を学び、多様な人々と交流していきましょう。",
-            'Cancer': "感情的で家族を大切にする人生です。直感を信じ、愛する人々との絆を深めていきましょう。",
-            'Leo': "創造的で自信に満ちた人生が約束されています。自己表現を大切にし、周囲を明るく照らしていきましょう。",
-            'Virgo': "分析的で完璧主義な人生です。細部にこだわり、実用的な解決策を見つけていきましょう。",
-            'Libra': "バランス感覚と調和を求める人生です。美しさと正義を大切にし、平和な関係を築いていきましょう。",
-            'Scorpio': "神秘的で情熱的な人生が待っています。深い洞察力を持ち、真実を追求していきましょう。",
-            'Sagittarius': "冒険的で哲学的な人生です。新しい文化や思想に触れ、人生の意味を探求していきましょう。",
-            'Capricorn': "責任感と目標志向の人生です。長期的な視点を持ち、着実に成功を積み上げていきましょう。",
-            'Aquarius': "革新的で独立心が強い人生です。新しいアイデアを大切にし、社会の進歩に貢献していきましょう。",
-            'Pisces': "直感的で共感力が高い人生です。芸術やスピリチュアルな分野で才能を発揮し、他者を癒していきましょう。"
-        }
-        return analyses.get(sign, "特別な意味を持つ星座です。")
-    
-    def _get_default_horoscope_analysis(self, horoscope_data: Dict[str, Any]) -> str:
-        """デフォルトのホロスコープ分析を取得"""
-        nickname = horoscope_data.get('nickname', 'あなた')
-        sun_sign = horoscope_data.get('sun_sign', 'Aries')
-        moon_sign = horoscope_data.get('moon_sign', 'Cancer')
-        rising_sign = horoscope_data.get('rising_sign', 'Leo')
-        
-        return f"""{nickname}さん、こんにちは！西洋占星術師uranAIです。
-
-{nickname}さんのホロスコープを拝見しました。太陽星座が{sun_sign}、月星座が{moon_sign}、上昇星座が{rising_sign}という素晴らしい組み合わせですね。
-
-太陽星座の{sun_sign}は、{self._get_sign_analysis(sun_sign)}
-
-月星座の{moon_sign}は、感情面で{self._get_sign_analysis(moon_sign)}
-
-上昇星座の{rising_sign}は、第一印象として{self._get_sign_analysis(rising_sign)}
-
-{nickname}さんは、これらの星座の特性を活かして、素晴らしい人生を歩んでいけるでしょう。星々からのメッセージを信じて、前向きに進んでいってくださいね。
-
-uranAIは、{nickname}さんの輝く未来を心から応援しています！"""
+    def _get_default_horoscope_analysis(self, horoscope_data: Dict[str, Any], consultation: str = "") -> str:
+        """デフォルトのホロスコープ分析を取得（意味テーブルから組み立てるテンプレート鑑定文）"""
+        return self._template_reading(template_reader.horoscope(horoscope_data, consultation))
     
     def _convert_sign_to_japanese(self, sign_name: str) -> str:
         """星座名を日本語に変換"""
@@ -595,28 +998,8 @@ uranAIは、{nickname}さんの輝く未来を心から応援しています！"
         return sign_mapping.get(sign_name, '牡羊座')
     
     def _fix_nickname_usage(self, text: str, person1_nickname: str, person2_nickname: str) -> str:
-        """ニックネームの使用を修正する後処理"""
-        import re
-        
-        # 人物1、人物2などの一般的な呼び方をニックネームに置換
-        # より具体的なパターンから先に処理する
-        replacements = [
-            (r'人物1さんさん', f'{person1_nickname}さん'),
-            (r'人物2さんさん', f'{person2_nickname}さん'),
-            (r'人物1さん', f'{person1_nickname}さん'),
-            (r'人物2さん', f'{person2_nickname}さん'),
-            (r'人物1', f'{person1_nickname}さん'),
-            (r'人物2', f'{person2_nickname}さん'),
-            (r'あなたさん', f'{person1_nickname}さん'),
-            (r'相手さん', f'{person2_nickname}さん'),
-            (r'あなた', f'{person1_nickname}さん'),
-            (r'相手', f'{person2_nickname}さん'),
-        ]
-        
-        for pattern, replacement in replacements:
-            text = re.sub(pattern, replacement, text)
-        
-        return text
+        """ニックネームの使用を修正する後処理（人物1、人物2などの一般的な呼び方を1回の走査で置換）"""
+        return rewrite_nicknames(text, person1_nickname, person2_nickname)
     
     def generate_ai_compatibility_score(self, data: Dict[str, Any], fortune_type: str) -> int:
         """AIを使用して相性スコアを生成"""
@@ -638,36 +1021,8 @@ uranAIは、{nickname}さんの輝く未来を心から応援しています！"
             return 50  # フォールバックスコア
     
     def _generate_numerology_ai_score(self, data: Dict[str, Any]) -> int:
-        """数秘術のAI相性スコアを生成"""
-        person1 = data['person1']
-        person2 = data['person2']
-        person1_nickname = data.get('person1_nickname', '人物1')
-        person2_nickname = data.get('person2_nickname', '人物2')
-        consultation = data.get('consultation', '')
-        
-        prompt = f"""数秘術師として、以下の二人の相性スコアを0-100の整数で算出してください。
-
-{person1_nickname}: LP{person1['life_path']['number']}, D{person1['destiny']['number']}, S{person1['soul']['number']}, P{person1['personal']['number']}
-{person2_nickname}: LP{person2['life_path']['number']}, D{person2['destiny']['number']}, S{person2['soul']['number']}, P{person2['personal']['number']}
-
-相談内容: {consultation if consultation else "一般的な相性について"}
-
-数秘術の観点から、お二人の相性を総合的に評価し、0-100の整数でスコアを算出してください。
-数値のみを回答してください（例: 75）"""
-
-        try:
-            score_text = self._generate_with_groq(prompt, max_tokens=100)
-            # 数値のみを抽出
-            import re
-            score_match = re.search(r'\b(\d{1,3})\b', score_text)
-            if score_match:
-                score = int(score_match.group(1))
-                return max(0, min(100, score))  # 0-100の範囲に制限
-            else:
-                return 50
-        except Exception as e:
-            print(f"Numerology AI score generation failed: {e}")
-            return 50
+        """数秘術の相性スコアを事前計算テーブルから取得（LLM呼び出しなし）"""
+        return numerology_score_table.score(data['person1'], data['person2'])
     
     def _generate_horoscope_ai_score(self, data: Dict[str, Any]) -> int:
         """ホロスコープのAI相性スコアを生成"""
@@ -694,7 +1049,7 @@ uranAIは、{nickname}さんの輝く未来を心から応援しています！"
 数値のみを回答してください（例: 75）"""
 
         try:
-            score_text = self._generate_with_groq(prompt, max_tokens=100)
+            score_text = self._generate_with_groq(prompt, max_tokens=100, task='compatibility_score')
             # 数値のみを抽出
             import re
             score_match = re.search(r'\b(\d{1,3})\b', score_text)
@@ -732,7 +1087,7 @@ uranAIは、{nickname}さんの輝く未来を心から応援しています！"
 数値のみを回答してください（例: 75）"""
 
         try:
-            score_text = self._generate_with_groq(prompt, max_tokens=100)
+            score_text = self._generate_with_groq(prompt, max_tokens=100, task='compatibility_score')
             # 数値のみを抽出
             import re
             score_match = re.search(r'\b(\d{1,3})\b', score_text)
@@ -773,11 +1128,12 @@ uranAIは、{nickname}さんの輝く未来を心から応援しています！"
 
 回答形式: YES または NO"""
             
-            result = self._generate_with_groq(prompt, max_tokens=50)
+            result = self._generate_with_groq(prompt, max_tokens=50, task='transit_decision')
             result = result.strip().upper()
             
             print(f"トランジット法判断結果: {result}")
-            return result == "YES"
+            # 小さいモデルは「YES。」のように句読点を付けることがあるため先頭で判定
+            return result.startswith("YES")
             
         except Exception as e:
             print(f"トランジット法判断エラー: {e}")
@@ -808,7 +1164,7 @@ uranAIは、{nickname}さんの輝く未来を心から応援しています！"
 
 推測した日時:"""
             
-            result = self._generate_with_groq(prompt, max_tokens=100)
+            result = self._generate_with_groq(prompt, max_tokens=100, task='target_date')
             result = result.strip()
             
             # 日時形式を検証
@@ -0,0 +1,227 @@
+"""
+AI鑑定文キャッシュ
+チャートのシグネチャと相談内容をキーに保存し、言い回しだけが異なる相談も類似度で再利用する。
+ソフトTTLを過ぎた鑑定文はそのまま返しつつバックグラウンドで1回だけ再生成し（stale-while-revalidate）、
+ハードTTLを過ぎたものはミスとして扱う
+"""
+
+import os
+import time
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, Callable
+
+from consultation_similarity import (
+    normalize_consultation, shingles, jaccard, anchors, MinHasher, LSHIndex, similarity_threshold
+)
+from llm_scheduler import TokenBucket, background_priority
+
+# ソフトTTL（これを過ぎたら返しつつ再生成）とハードTTL（これを過ぎたら返さない）、秒
+DEFAULT_SOFT_TTL = float(os.getenv('AI_CACHE_SOFT_TTL', str(6 * 3600)))
+DEFAULT_HARD_TTL = float(os.getenv('AI_CACHE_HARD_TTL', str(24 * 3600)))
+
+# 再生成に使う関数（相談内容を受け取り、鑑定文を返す。失敗時はNone）
+RefreshFunction = Callable[[str], str | None]
+
+
+class BackgroundRefresher:
+    """
+    期限切れが近い鑑定文のバックグラウンド再生成。
+    同じキーの再生成は1つだけ、同時実行数と1分あたりの件数に上限を設け、
+    スケジューラーでは最低優先度で待つため、ユーザーのリクエストやプロバイダーのレート制限を圧迫しない
+    """
+
+    def __init__(self, workers: int = 1, per_minute: float = 6.0):
+        self.workers = workers
+        self.per_minute = per_minute
+        self._budget = TokenBucket(max(1.0, per_minute), per_minute / 60.0)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai-cache-refresh')
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._stats = {'scheduled': 0, 'completed': 0, 'failed': 0, 'skipped_duplicate': 0, 'skipped_budget': 0}
+
+    def schedule(self, key: str, job: Callable[[], None]) -> bool:
+        """再生成を予約（同じキーが処理中、または件数の上限に達している場合は見送る）"""
+        with self._lock:
+            if key in self._pending:
+                self._stats['skipped_duplicate'] += 1
+                return False
+            # 実行待ちが同時実行数を超えて積み上がらないようにする
+            if len(self._pending) >= self.workers or self._budget.time_until(1) > 0:
+                self._stats['skipped_budget'] += 1
+                return False
+            self._budget.consume(1)
+            self._pending.add(key)
+            self._stats['scheduled'] += 1
+        # 呼び出し元のコンテキスト（利用量の記録先など）は引き継がない
+        self._executor.submit(self._run, key, job)
+        return True
+
+    def _run(self, key: str, job: Callable[[], None]):
+        try:
+            with background_priority():
+                job()
+            with self._lock:
+                self._stats['completed'] += 1
+        except Exception as e:
+            print(f"AIキャッシュの再生成に失敗しました: {e}")
+            with self._lock:
+                self._stats['failed'] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._pending), workers=self.workers, per_minute=self.per_minute)
+
+
+# プロセス全体で共有する再生成の実行枠（AIAnalysisGeneratorごとのキャッシュで共有し、合計を制限する）
+cache_refresher = BackgroundRefresher(
+    workers=int(os.getenv('AI_CACHE_REFRESH_WORKERS', '1')),
+    per_minute=float(os.getenv('AI_CACHE_REFRESH_PER_MINUTE', '6'))
+)
+
+
+class CacheEntry:
+    """キャッシュエントリ"""
+
+    def __init__(self, signature: str, consultation: str, normalized: str, value: str, created_at: float | None = None):
+        self.signature = signature
+        self.consultation = consultation
+        self.normalized = normalized
+        self.grams = shingles(normalized)
+        self.anchors = anchors(normalized)
+        self.value = value
+        self.created_at = time.time() if created_at is None else created_at
+
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+class AITextCache:
+    """チャートシグネチャ + 相談内容の類似判定付きFIFOキャッシュ（ソフト/ハードTTL付き）"""
+
+    def __init__(self, size_limit: int = 100, threshold: float | None = None, soft_ttl: float = DEFAULT_SOFT_TTL, hard_ttl: float = DEFAULT_HARD_TTL, refresher: BackgroundRefresher | None = None):
+        self.size_limit = size_limit
+        self.threshold = similarity_threshold() if threshold is None else threshold
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = max(hard_ttl, soft_ttl)
+        self.refresher = refresher or cache_refresher
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._hasher = MinHasher()
+        self._index = LSHIndex(num_perm=self._hasher.num_perm)
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'normalized_hits': 0, 'near_hits': 0, 'misses': 0, 'stale_hits': 0, 'expired': 0}
+
+    @staticmethod
+    def key(signature: str, consultation: str) -> str:
+        """正規化した相談内容を含むキャッシュキー"""
+        return f"{signature}_{normalize_consultation(consultation)}"
+
+    def _find_similar(self, signature: str, normalized: str) -> Tuple[CacheEntry | None, float]:
+        if self.threshold >= 1.0:
+            return None, 0.0
+        grams = shingles(normalized)
+        query_anchors = anchors(normalized)
+        best, best_score = None, 0.0
+        for key in self._index.candidates(signature, self._hasher.signature(grams)):
+            entry = self._entries.get(key)
+            if entry is None or entry.anchors != query_anchors or entry.age() > self.hard_ttl:
+                continue
+            score = jaccard(grams, entry.grams)
+            if score >= self.threshold and score > best_score:
+                best, best_score = entry, score
+        return best, best_score
+
+    def _remove(self, key: str):
+        if self._entries.pop(key, None) is not None:
+            self._index.remove(key)
+
+    def get(self, signature: str, consultation: str, refresh: RefreshFunction | None = None) -> str | None:
+        """
+        同一または類似の相談に対するキャッシュ済み鑑定文を返す。
+        ソフトTTLを過ぎていればそのまま返し、refreshが指定されていればバックグラウンドで再生成する
+        """
+        normalized = normalize_consultation(consultation)
+        with self._lock:
+            key = f"{signature}_{normalized}"
+            entry = self._entries.get(key)
+            if entry is not None and entry.age() > self.hard_ttl:
+                # ハードTTLを過ぎた鑑定文は返さない
+                self._remove(key)
+                self._stats['expired'] += 1
+                entry = None
+            if entry is not None:
+                self._stats['exact_hits' if consultation == entry.consultation else 'normalized_hits'] += 1
+            else:
+                entry, score = self._find_similar(signature, normalized)
+                if entry is not None:
+                    self._stats['near_hits'] += 1
+                    print(f"AI分析を類似相談のキャッシュから取得（類似度{score:.2f}）: 「{consultation}」≒「{entry.normalized}」")
+                else:
+                    self._stats['misses'] += 1
+                    return None
+            stale = entry.age() > self.soft_ttl
+            if stale:
+                self._stats['stale_hits'] += 1
+            value = entry.value
+
+        if stale and refresh is not None:
+            self._schedule_refresh(entry, refresh)
+        return value
+
+    def _schedule_refresh(self, entry: CacheEntry, refresh: RefreshFunction):
+        """古くなったエントリを、そのエントリ自身の相談内容で再生成して置き換える"""
+        def job():
+            value = refresh(entry.consultation)
+            if value:
+                self.set(entry.signature, entry.consultation, value)
+                print(f"AI分析キャッシュを再生成しました: {entry.signature}_{entry.normalized}")
+
+        self.refresher.schedule(f"{entry.signature}_{entry.normalized}", job)
+
+    def set(self, signature: str, consultation: str, value: str, created_at: float | None = None):
+        """鑑定文を保存（created_atは生成時刻のUNIX時間、省略時は現在）"""
+        if created_at is not None and time.time() - created_at > self.hard_ttl:
+            return
+        normalized = normalize_consultation(consultation)
+        key = f"{signature}_{normalized}"
+        with self._lock:
+            if key in self._entries:
+                entry = self._entries[key]
+                entry.value = value
+                entry.created_at = time.time() if created_at is None else created_at
+                return
+            # キャッシュサイズ制限チェック（古いエントリから削除: FIFO）
+            while len(self._entries) >= self.size_limit:
+                oldest_key, _ = self._entries.popitem(last=False)
+                self._index.remove(oldest_key)
+            entry = CacheEntry(signature, consultation, normalized, value, created_at)
+            self._entries[key] = entry
+            self._index.add(key, signature, self._hasher.signature(entry.grams))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率と類似判定による上積み"""
+        with self._lock:
+            stats = dict(self._stats)
+            size = len(self._entries)
+        lookups = stats['exact_hits'] + stats['normalized_hits'] + stats['near_hits'] + stats['misses']
+        hits = stats['exact_hits'] + stats['normalized_hits'] + stats['near_hits']
+        stats.update({
+            'size': size,
+            'size_limit': self.size_limit,
+            'similarity_threshold': self.threshold,
+            'soft_ttl': self.soft_ttl,
+            'hard_ttl': self.hard_ttl,
+            'refresh': self.refresher.stats(),
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            # 生の相談文の完全一致だけでは得られなかったヒットの割合
+            'similarity_gain': round((stats['normalized_hits'] + stats['near_hits']) / lookups, 4) if lookups else 0.0
+        })
+        return stats
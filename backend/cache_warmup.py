@@ -0,0 +1,128 @@
+"""
+AI鑑定文キャッシュのウォームアップ
+デプロイ直後はキャッシュが空のため、保存済みの占い結果から最近の鑑定文を読み込んでおく
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Tuple
+
+from .database import SessionLocal, DivinationResult
+
+NUMEROLOGY_KEYS = ('life_path', 'destiny', 'soul', 'personal', 'birthday', 'maturity')
+
+# キャッシュ対象の鑑定文（個人の数秘術・西洋占星術のAI分析）
+WARMUP_FORTUNE_TYPES = ('numerology', 'horoscope')
+
+
+class CacheWarmup:
+    """保存済みの占い結果をバッチで読み込み、AI鑑定文キャッシュを事前に埋める"""
+
+    def __init__(self, ai_generator, session_factory=SessionLocal):
+        self.ai_generator = ai_generator
+        self.session_factory = session_factory
+        self.enabled = os.getenv('CACHE_WARMUP_ENABLED', 'true').lower() == 'true'
+        # キャッシュに収まる件数を超えて読み込んでも押し出されるだけなので、既定はキャッシュサイズ
+        self.limit = int(os.getenv('CACHE_WARMUP_LIMIT', str(ai_generator._cache_size_limit)))
+        self.max_age_days = int(os.getenv('CACHE_WARMUP_DAYS', '30'))
+        self.batch_size = int(os.getenv('CACHE_WARMUP_BATCH', '200'))
+        self._done = threading.Event()
+        self._status: Dict[str, Any] = {'state': 'pending', 'scanned': 0, 'loaded': 0, 'skipped': 0, 'seconds': None, 'error': None}
+
+    def _signature(self, fortune_type: str, visual_result: Dict[str, Any]) -> str | None:
+        """保存済みのビジュアル結果から鑑定文生成時と同じシグネチャを組み立てる"""
+        if fortune_type == 'numerology':
+            numbers = visual_result.get('numbers') or {}
+            if not all(numbers.get(key) for key in NUMEROLOGY_KEYS):
+                return None
+            return self.ai_generator.numerology_cache_signature({key: {'number': numbers[key]} for key in NUMEROLOGY_KEYS})
+        signs = visual_result.get('signs') or {}
+        if not all(signs.get(key) for key in ('sun', 'moon', 'rising')):
+            return None
+        return self.ai_generator.horoscope_cache_signature(signs['sun'], signs['moon'], signs['rising'])
+
+    def _is_reusable(self, text: str) -> bool:
+        """タイムアウトやエラー時の文面はキャッシュしない"""
+        return bool(text) and text != self.ai_generator._get_timeout_message() and not text.endswith('生成中です...')
+
+    def _collect(self) -> List[Tuple[str, str, str, str, float | None]]:
+        """最近の占い結果を新しい順にバッチで読み、(シグネチャ, 相談内容, 鑑定文, ニックネーム, 生成時刻) を集める"""
+        entries: List[Tuple[str, str, str, str, float | None]] = []
+        seen = set()
+        db = self.session_factory()
+        try:
+            query = db.query(
+                DivinationResult.fortune_type, DivinationResult.request_data, DivinationResult.visual_result, DivinationResult.ai_text,
+                DivinationResult.created_at, DivinationResult.llm_usage
+            ).filter(
+                DivinationResult.fortune_type.in_(WARMUP_FORTUNE_TYPES),
+                DivinationResult.created_at >= datetime.utcnow() - timedelta(days=self.max_age_days)
+            ).order_by(DivinationResult.created_at.desc()).yield_per(self.batch_size)
+
+            for fortune_type, request_data, visual_result, ai_text, created_at, llm_usage in query:
+                self._status['scanned'] += 1
+                request_data = request_data or {}
+                # 相性占いの鑑定文は各計算クラスで生成されサービスのキャッシュには入らない
+                # テンプレート鑑定文（クイック鑑定・過負荷時）はAI鑑定文としてキャッシュしない
+                template = 'template_reading' in ((llm_usage or {}).get('cache_hit_sources') or {})
+                profiles = request_data.get('profiles') or []
+                # 鑑定文は元の利用者のニックネーム宛てのため、ニックネームが分からないものは読み込まない
+                nickname = (profiles[0].get('nickname') if len(profiles) == 1 and isinstance(profiles[0], dict) else None) or ''
+                if not nickname or template or not self._is_reusable(ai_text):
+                    self._status['skipped'] += 1
+                    continue
+                signature = self._signature(fortune_type, visual_result or {})
+                consultation = request_data.get('consultation', '') or ''
+                key = (signature, consultation)
+                if signature is None or key in seen:
+                    self._status['skipped'] += 1
+                    continue
+                seen.add(key)
+                # 生成時刻を引き継ぎ、古い鑑定文がキャッシュのTTLで再生成・失効されるようにする
+                entries.append((signature, consultation, ai_text, nickname, created_at.replace(tzinfo=timezone.utc).timestamp() if created_at else None))
+                if len(entries) >= self.limit:
+                    break
+        finally:
+            db.close()
+        return entries
+
+    def run(self):
+        """ウォームアップを実行（失敗してもサービスは通常どおり動作する）"""
+        started = time.perf_counter()
+        self._status['state'] = 'running'
+        try:
+            entries = self._collect()
+            # FIFOキャッシュで新しい鑑定文が長く残るよう、古い順に読み込む
+            # ニックネームはプレースホルダーに置き換えて読み込む（置き換えきれない鑑定文は読み込まない）
+            loaded = 0
+            for signature, consultation, text, nickname, created_at in reversed(entries):
+                if self.ai_generator.preload_cache(signature, consultation, text, nickname, created_at):
+                    loaded += 1
+                else:
+                    self._status['skipped'] += 1
+            self._status['loaded'] = loaded
+            self._status['state'] = 'done'
+            print(f"AIキャッシュのウォームアップ完了: {loaded}件（走査{self._status['scanned']}件）")
+        except Exception as e:
+            self._status['state'] = 'failed'
+            self._status['error'] = str(e)
+            print(f"AIキャッシュのウォームアップに失敗しました: {e}")
+        finally:
+            self._status['seconds'] = round(time.perf_counter() - started, 2)
+            self._done.set()
+
+    def start(self):
+        """バックグラウンドスレッドでウォームアップを開始"""
+        if not self.enabled or self.limit <= 0:
+            self._status['state'] = 'disabled'
+            self._done.set()
+            return
+        threading.Thread(target=self.run, name='cache-warmup', daemon=True).start()
+
+    def is_ready(self) -> bool:
+        return self._done.is_set()
+
+    def status(self) -> Dict[str, Any]:
+        return dict(self._status)
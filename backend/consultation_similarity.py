@@ -0,0 +1,114 @@
+"""
+相談内容の正規化と類似判定
+NFKC正規化・丁寧語末尾の除去・文字n-gramのMinHash/LSHで、言い回しだけが異なる相談を同一視する
+"""
+
+import os
+import re
+import random
+import unicodedata
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+
+# 末尾から繰り返し除去する丁寧表現（長いものから判定）
+_POLITE_ENDINGS = sorted([
+    'をお願いします', 'お願いします', 'お願いいたします', 'をお願い', 'お願い',
+    'してください', 'ください', '下さい', 'くださいませ',
+    'を教えてほしい', '教えてほしい', 'を教えて欲しい', '教えて欲しい', 'を教えて', '教えて',
+    'を知りたいです', '知りたいです', 'を知りたい', '知りたい',
+    'を占って', '占って', 'を見て', 'みて',
+    'でしょうか', 'ですか', 'ますか', 'かな', 'です', 'ます', 'について', 'か',
+], key=len, reverse=True)
+
+_PUNCTUATION = re.compile(r'[\s、。！？!?,.・…〜~「」『』（）()\[\]【】♪☆★]+')
+
+# 一致していなければ別の相談とみなす語（時期・否定など、少しの違いで意味が変わるもの）
+_ANCHOR_PATTERN = re.compile(r'\d+|今日|明日|明後日|昨日|今週|来週|先週|今月|来月|先月|今年|来年|去年|春|夏|秋|冬|ない|ません|なかった|別れ|復縁')
+
+
+def normalize_consultation(text: str) -> str:
+    """相談内容を比較用に正規化（NFKC・小文字化・記号除去・丁寧語末尾の除去）"""
+    normalized = _PUNCTUATION.sub('', unicodedata.normalize('NFKC', text or '').lower())
+    stripped = True
+    while stripped and normalized:
+        stripped = False
+        for ending in _POLITE_ENDINGS:
+            if normalized.endswith(ending) and len(normalized) > len(ending):
+                normalized = normalized[:-len(ending)]
+                stripped = True
+                break
+    return normalized
+
+
+def shingles(text: str, n: int = 2) -> Set[str]:
+    """文字n-gramの集合"""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def anchors(text: str) -> Tuple[str, ...]:
+    """意味を変える語（数字・時期・否定）を出現順に抽出"""
+    return tuple(_ANCHOR_PATTERN.findall(text))
+
+
+class MinHasher:
+    """文字n-gram集合のMinHash署名を生成"""
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(rng.randrange(1, self._PRIME), rng.randrange(0, self._PRIME)) for _ in range(num_perm)]
+
+    def signature(self, grams: Set[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(gram.encode('utf-8')) for gram in grams] or [0]
+        return tuple(min((a * h + b) % self._PRIME for h in hashes) for a, b in self._params)
+
+
+class LSHIndex:
+    """MinHash署名のバンド分割による近傍候補インデックス"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: Dict[Tuple, Set[str]] = defaultdict(set)
+        self._keys: Dict[str, List[Tuple]] = {}
+
+    def _bucket_keys(self, namespace: str, signature: Tuple[int, ...]) -> List[Tuple]:
+        return [(namespace, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def add(self, key: str, namespace: str, signature: Tuple[int, ...]):
+        bucket_keys = self._bucket_keys(namespace, signature)
+        for bucket_key in bucket_keys:
+            self._buckets[bucket_key].add(key)
+        self._keys[key] = bucket_keys
+
+    def remove(self, key: str):
+        for bucket_key in self._keys.pop(key, []):
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[bucket_key]
+
+    def candidates(self, namespace: str, signature: Tuple[int, ...]) -> Set[str]:
+        found: Set[str] = set()
+        for bucket_key in self._bucket_keys(namespace, signature):
+            found |= self._buckets.get(bucket_key, set())
+        return found
+
+
+def similarity_threshold() -> float:
+    """類似判定の閾値（環境変数 AI_CACHE_SIMILARITY_THRESHOLD、1.0で完全一致のみ）"""
+    return float(os.getenv('AI_CACHE_SIMILARITY_THRESHOLD', str(DEFAULT_SIMILARITY_THRESHOLD)))
@@ -10,6 +10,7 @@ from sqlalchemy import (
     JSON,
     Text,
     Boolean,
+    UniqueConstraint,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
@@ -76,10 +77,31 @@ class DivinationResult(Base):
     request_data = Column(JSON)
     visual_result = Column(JSON)
     ai_text = Column(Text)
+    llm_usage = Column(JSON, nullable=True)  # LLM呼び出しのトークン数・コストの集計
     created_at = Column(TIMESTAMP)
 
     owner = relationship("User", back_populates="divination_results")
 
+class DivinationJob(Base):
+    """占い結果生成のジョブ（ワーカーが順に処理し、完了した結果はDivinationResultに保存する）"""
+    __tablename__ = "divination_jobs"
+    __table_args__ = (UniqueConstraint("user_id", "idempotency_key", name="uq_divination_jobs_idempotency"),)
+
+    id = Column(String, primary_key=True, index=True)  # UUID
+    user_id = Column(String, ForeignKey("users.user_id"), index=True)
+    status = Column(String, default="queued", index=True)  # queued, running, succeeded, failed
+    idempotency_key = Column(String, nullable=True, index=True)  # 同じキーの再送は同じジョブを返す
+    plan_type = Column(String, nullable=True)
+    result_data = Column(JSON)  # POST /divination-results/ と同じリクエストボディ
+    result_id = Column(Integer, ForeignKey("divination_results.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    available_at = Column(TIMESTAMP)  # この時刻以降に処理を開始できる（混雑時の再試行待ち）
+    created_at = Column(TIMESTAMP)
+    started_at = Column(TIMESTAMP, nullable=True)
+    finished_at = Column(TIMESTAMP, nullable=True)
+    updated_at = Column(TIMESTAMP)
+
 class Favorite(Base):
     __tablename__ = "favorites"
 
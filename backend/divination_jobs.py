@@ -0,0 +1,300 @@
+"""
+占い結果生成のジョブキュー
+POSTではジョブをデータベースに登録して202を返し、ローカルのワーカープールがキューから順に処理する
+（LLMの待ち時間の間HTTP接続を開いたままにしないため、プロキシのタイムアウトや再接続による重複生成を防げる）
+"""
+
+import os
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, DivinationJob, DivinationResult, engine
+from .service_executor import QueueFullError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+TERMINAL_STATUSES = (SUCCEEDED, FAILED)
+
+# 生成した占い結果をDivinationResultとして追加する関数（db, user_id, result_data, divination_result -> DivinationResult、コミットは呼び出し側）
+SaveResult = Callable[[Session, str, Dict[str, Any], Dict[str, Any]], DivinationResult]
+
+
+class DivinationJobWorker:
+    """データベース上のジョブキューを処理するワーカープール（複数プロセスで動かしても同じジョブを二重に処理しない）"""
+
+    def __init__(self, divination_service, save_result: SaveResult, session_factory=SessionLocal):
+        self.divination_service = divination_service
+        self.save_result = save_result
+        self.session_factory = session_factory
+        self.enabled = os.getenv('DIVINATION_JOB_WORKERS_ENABLED', 'true').lower() == 'true'
+        self.workers = int(os.getenv('DIVINATION_JOB_WORKERS', '2'))
+        self.poll_interval = float(os.getenv('DIVINATION_JOB_POLL_INTERVAL', '1.0'))
+        # この時間を過ぎても実行中のジョブは、処理していたプロセスが落ちたとみなして再登録する
+        self.stale_after = float(os.getenv('DIVINATION_JOB_STALE_SECONDS', '300'))
+        self.max_attempts = int(os.getenv('DIVINATION_JOB_MAX_ATTEMPTS', '3'))
+        # 失敗したジョブを再実行するまでの待ち時間（試行ごとに倍にする）
+        self.retry_backoff = float(os.getenv('DIVINATION_JOB_RETRY_BACKOFF', '5'))
+        self.retry_backoff_max = float(os.getenv('DIVINATION_JOB_RETRY_BACKOFF_MAX', '120'))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # 同じプロセス内の購読者（SSE）にジョブの状態変化を知らせる
+        self._changed = threading.Condition()
+        self._lock = threading.Lock()
+        self._last_recovery = 0.0
+        self._stats = {'claimed': 0, 'succeeded': 0, 'failed': 0, 'retried': 0, 'deferred_busy': 0, 'recovered': 0, 'superseded': 0}
+
+    def start(self):
+        """ワーカースレッドを起動（ジョブテーブルがなければ作成する）"""
+        if not self.enabled or self.workers <= 0 or self._threads:
+            return
+        DivinationJob.__table__.create(bind=engine, checkfirst=True)
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f'divination-job-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def enqueue(self, db: Session, user_id: str, result_data: Dict[str, Any], plan_type: str | None, idempotency_key: str | None = None) -> Tuple[DivinationJob, bool]:
+        """ジョブを登録し (ジョブ, 新規登録か) を返す（同じIdempotency-Keyの再送は既存のジョブを返す）"""
+        if idempotency_key:
+            existing = self._find_by_key(db, user_id, idempotency_key)
+            if existing is not None:
+                return existing, False
+        now = datetime.utcnow()
+        job = DivinationJob(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            status=QUEUED,
+            idempotency_key=idempotency_key,
+            plan_type=plan_type,
+            result_data=result_data,
+            attempts=0,
+            available_at=now,
+            created_at=now,
+            updated_at=now
+        )
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # 同じキーの同時送信に負けた場合は先に登録されたジョブを返す
+            db.rollback()
+            existing = self._find_by_key(db, user_id, idempotency_key)
+            if existing is None:
+                raise
+            return existing, False
+        db.refresh(job)
+        self._wake.set()
+        return job, True
+
+    def _find_by_key(self, db: Session, user_id: str, idempotency_key: str) -> DivinationJob | None:
+        return db.query(DivinationJob).filter(
+            DivinationJob.user_id == user_id,
+            DivinationJob.idempotency_key == idempotency_key
+        ).first()
+
+    def get(self, db: Session, user_id: str, job_id: str) -> DivinationJob | None:
+        return db.query(DivinationJob).filter(DivinationJob.id == job_id, DivinationJob.user_id == user_id).first()
+
+    def describe(self, db: Session, job: DivinationJob) -> Dict[str, Any]:
+        """ジョブの状態（完了していれば保存済みの占い結果も含める）"""
+        payload = {
+            "job_id": job.id,
+            "status": job.status,
+            "result_id": job.result_id,
+            "error": job.error,
+            "attempts": job.attempts,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at
+        }
+        if job.status == SUCCEEDED and job.result_id is not None:
+            result = db.query(DivinationResult).filter(DivinationResult.id == job.result_id).first()
+            if result is not None:
+                payload["result"] = {
+                    "id": result.id,
+                    "fortune_type": result.fortune_type,
+                    "request_data": result.request_data,
+                    "visual_result": result.visual_result,
+                    "ai_text": result.ai_text,
+                    "created_at": result.created_at
+                }
+        return payload
+
+    def wait_for_change(self, timeout: float):
+        """このプロセスのワーカーがいずれかのジョブの状態を更新するか、timeout秒が経つまで待つ"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self._claim()
+            except Exception as e:
+                print(f"ジョブの取得に失敗しました: {e}")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._process(job_id)
+
+    def _claim(self) -> str | None:
+        """実行可能な最も古いジョブを1件取得して実行中にする（他のワーカーがロック中の行は飛ばす）"""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            self._recover_stale(db, now)
+            candidate = db.query(DivinationJob.id).filter(
+                DivinationJob.status == QUEUED,
+                DivinationJob.available_at <= now
+            ).order_by(DivinationJob.created_at).with_for_update(skip_locked=True).first()
+            if candidate is None:
+                db.commit()
+                return None
+            # 行ロックのないSQLiteでも二重に取得しないよう、状態を条件に更新する
+            claimed = db.query(DivinationJob).filter(
+                DivinationJob.id == candidate.id,
+                DivinationJob.status == QUEUED
+            ).update({
+                DivinationJob.status: RUNNING,
+                DivinationJob.attempts: DivinationJob.attempts + 1,
+                DivinationJob.started_at: now,
+                DivinationJob.updated_at: now
+            }, synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if not claimed:
+            return None
+        with self._lock:
+            self._stats['claimed'] += 1
+        self._notify()
+        return candidate.id
+
+    def _recover_stale(self, db: Session, now: datetime):
+        """処理中のまま止まったジョブを再登録（試行回数の上限を超えたものは失敗にする）"""
+        if time.monotonic() - self._last_recovery < self.stale_after / 4:
+            return
+        self._last_recovery = time.monotonic()
+        stale = (DivinationJob.status == RUNNING, DivinationJob.started_at < now - timedelta(seconds=self.stale_after))
+        failed = db.query(DivinationJob).filter(*stale, DivinationJob.attempts >= self.max_attempts).update({
+            DivinationJob.status: FAILED,
+            DivinationJob.error: "ワーカーが応答しないまま試行回数の上限に達しました",
+            DivinationJob.finished_at: now,
+            DivinationJob.updated_at: now
+        }, synchronize_session=False)
+        requeued = db.query(DivinationJob).filter(*stale).update({
+            DivinationJob.status: QUEUED,
+            DivinationJob.available_at: now,
+            DivinationJob.updated_at: now
+        }, synchronize_session=False)
+        if failed or requeued:
+            print(f"止まっていたジョブを回収しました: 再登録{requeued}件、失敗{failed}件")
+            with self._lock:
+                self._stats['recovered'] += failed + requeued
+
+    def _retry_delay(self, attempts: int) -> float:
+        """attempts回目の失敗後、再実行までの秒数"""
+        return min(self.retry_backoff_max, self.retry_backoff * 2 ** max(0, attempts - 1))
+
+    def _transition(self, db: Session, job_id: str, attempts: int, values: Dict[Any, Any]) -> bool:
+        """
+        このワーカーが取得した実行のままであれば（実行中かつ試行回数が取得時と同じ）ジョブを更新する。
+        止まったとみなされて再登録・別のワーカーに再取得されていた場合は何もせずFalseを返す
+        """
+        values[DivinationJob.updated_at] = datetime.utcnow()
+        return bool(db.query(DivinationJob).filter(
+            DivinationJob.id == job_id,
+            DivinationJob.status == RUNNING,
+            DivinationJob.attempts == attempts
+        ).update(values, synchronize_session=False))
+
+    def _process(self, job_id: str):
+        """ジョブを実行し、占い結果の保存とジョブの完了を1つのトランザクションで記録する"""
+        db = self.session_factory()
+        try:
+            job = db.query(DivinationJob).filter(DivinationJob.id == job_id).first()
+            if job is None:
+                return
+            attempts = job.attempts or 0
+            result_data = job.result_data or {}
+            try:
+                divination_result = self.divination_service.generate_divination_result(result_data.get("request_data", {}), plan_type=job.plan_type)
+                new_result = self.save_result(db, job.user_id, result_data, divination_result)
+                db.flush()
+                updated = self._transition(db, job_id, attempts, {
+                    DivinationJob.status: SUCCEEDED,
+                    DivinationJob.result_id: new_result.id,
+                    DivinationJob.error: None,
+                    DivinationJob.finished_at: datetime.utcnow()
+                })
+                outcome = 'succeeded'
+            except QueueFullError as e:
+                # 混雑中は失敗にせず、Retry-Afterの秒数だけ待ってから再開する（試行回数にも数えない）
+                db.rollback()
+                updated = self._transition(db, job_id, attempts, {
+                    DivinationJob.status: QUEUED,
+                    DivinationJob.attempts: max(0, attempts - 1),
+                    DivinationJob.available_at: datetime.utcnow() + timedelta(seconds=e.retry_after)
+                })
+                outcome = 'deferred_busy'
+            except Exception as e:
+                db.rollback()
+                print(f"ジョブの処理に失敗しました ({job_id}, {attempts}回目): {e}")
+                traceback.print_exc()
+                if attempts < self.max_attempts:
+                    # 一時的な失敗（LLM・DBの瞬断など）に備え、上限までは間隔を空けて再実行する
+                    updated = self._transition(db, job_id, attempts, {
+                        DivinationJob.status: QUEUED,
+                        DivinationJob.error: str(e),
+                        DivinationJob.available_at: datetime.utcnow() + timedelta(seconds=self._retry_delay(attempts))
+                    })
+                    outcome = 'retried'
+                else:
+                    updated = self._transition(db, job_id, attempts, {
+                        DivinationJob.status: FAILED,
+                        DivinationJob.error: str(e),
+                        DivinationJob.finished_at: datetime.utcnow()
+                    })
+                    outcome = 'failed'
+            if not updated:
+                # 止まったとみなされて再登録されたジョブは、再実行側の結果だけを残す（保存した占い結果も取り消す）
+                db.rollback()
+                print(f"ジョブは別の実行に引き継がれたため、結果を破棄しました ({job_id}, {attempts}回目)")
+                outcome = 'superseded'
+            else:
+                db.commit()
+            with self._lock:
+                self._stats[outcome] += 1
+        except Exception as e:
+            db.rollback()
+            print(f"ジョブの状態の保存に失敗しました ({job_id}): {e}")
+        finally:
+            db.close()
+            self._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, workers=len(self._threads), enabled=self.enabled)
@@ -3,13 +3,24 @@
 数秘術と西洋占星術の結果を統合してAI鑑定文を生成
 """
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 from .numerology_calculator import NumerologyCalculator
 from .horoscope import HoroscopeCalculator
 from .tarot import TarotCalculator
-from .ai_analysis import AIAnalysisGenerator
+from .ai_analysis import AIAnalysisGenerator, SectionCallback
+from .prompt_builder import PromptBuilder, first_sentences
+from .temporal_parser import parse_consultation_date, DEFAULT_CONFIDENCE_THRESHOLD
+from .template_reading import uses_template_tier
+from .service_executor import service_executor, QueueFullError
+from .stage_graph import StageGraph, stage_trace
+from .group_reading import build_group_data, MAX_GROUP_SIZE
+from .result_cache import result_cache, result_cache_key
+# 計算モジュールと同じメモを使うため絶対インポート（numerology_calculatorの読み込みでbackendがパスに追加される）
+from shared_inputs import shared_inputs
+import os
 import json
 import asyncio
+import contextvars
 import concurrent.futures
 
 class DivinationService:
@@ -20,6 +31,41 @@ class DivinationService:
         self.horoscope_calculator = HoroscopeCalculator()
         self.tarot_calculator = TarotCalculator()
         self.ai_generator = AIAnalysisGenerator()
+        # セクションの並列生成などのLLM呼び出しも共有I/Oプールで実行し、プールの待ち行列・503が実際の負荷を反映するようにする
+        self.ai_generator.use_io_pool(service_executor.submit_io)
+        # ローカル時間表現解析の信頼度がこの値未満の場合のみLLMで判定
+        self.temporal_confidence_threshold = float(os.getenv('TEMPORAL_PARSER_CONFIDENCE', str(DEFAULT_CONFIDENCE_THRESHOLD)))
+        # 総合占いの生成方式（structured: 1回の構造化出力 / sections: セクションごとに並列生成 / chained: 個別生成してから統合）
+        self.comprehensive_mode = os.getenv('COMPREHENSIVE_MODE', 'structured')
+        # ステージごとの実行時間を常に結果へ含める（request_data['debug']でリクエスト単位でも有効化できる）
+        self.stage_trace_enabled = os.getenv('DIVINATION_STAGE_TRACE', 'false').lower() == 'true'
+        # 同じ入力の数秘術・ホロスコープ（シード指定のタロット）は生成済みの結果を返す
+        self.result_cache_enabled = os.getenv('DIVINATION_RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+        # バッチ生成で一度に受け付ける占いの件数と、同時に進める件数（各占いの計算・LLM呼び出し自体は共有プールで実行）
+        self.batch_max_items = int(os.getenv('DIVINATION_BATCH_MAX_ITEMS', '10'))
+        self._batch_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.getenv('DIVINATION_BATCH_CONCURRENCY', '4')),
+            thread_name_prefix='divination-batch'
+        )
+    
+    def check_capacity(self):
+        """共有プールに空きがなければQueueFullErrorを送出（ストリーミング開始前の受付判定用）"""
+        service_executor.check_capacity()
+    
+    def get_executor_stats(self) -> Dict[str, Any]:
+        """共有プールの待ち行列・実行中の件数"""
+        return service_executor.snapshot()
+    
+    def get_result_cache_stats(self) -> Dict[str, Any]:
+        """占い結果キャッシュのヒット率・件数"""
+        return dict(result_cache.stats(), enabled=self.result_cache_enabled)
+    
+    def invalidate_profile(self, profile_id) -> int:
+        """プロフィールの更新・削除時に、そのプロフィールを含むキャッシュ済みの占い結果を削除"""
+        removed = result_cache.invalidate_profile(profile_id)
+        if removed:
+            print(f"プロフィール{profile_id}のキャッシュ済み占い結果を{removed}件削除しました")
+        return removed
     
     def _calculate_temporal_fortune_safe(self, profile: Dict[str, Any], target_date: str) -> Dict[str, Any] | None:
         """安全な今日の運勢計算（エラーハンドリング付き）"""
@@ -29,73 +75,94 @@ class DivinationService:
             print(f"Temporal fortune calculation failed: {e}")
             return None
     
-    def _extract_target_date_from_consultation(self, consultation: str) -> str | None:
-        """相談内容から特定の日付を抽出"""
-        if not consultation:
-            return None
-        
-        import re
-        from datetime import datetime, timedelta
+    def _resolve_transit_target(self, consultation: str, profile: Dict[str, Any]) -> str | None:
+        """トランジット法の対象日時を決定（ローカル解析で確信度が低い場合のみAIに判断させる）"""
+        parsed = parse_consultation_date(consultation, birth_date=profile.get('birth_date'))
+        if parsed.confidence >= self.temporal_confidence_threshold:
+            if parsed.use_transit:
+                print(f"ローカル判定: トランジット法を使用、対象日時: {parsed.target_date}（{parsed.matched}）")
+            else:
+                print("ローカル判定: 通常のホロスコープ計算を使用")
+            return parsed.target_date if parsed.use_transit else None
         
-        # 日付パターンを検索
-        date_patterns = [
-            r'(\d{4})年(\d{1,2})月(\d{1,2})日',
-            r'(\d{1,2})月(\d{1,2})日',
-            r'(\d{1,2})日',
-            r'(\d{4})-(\d{1,2})-(\d{1,2})',
-            r'(\d{1,2})/(\d{1,2})',
-            r'(\d{1,2})/(\d{1,2})/(\d{4})'
-        ]
+        # クイック鑑定・過負荷時はLLMに判断させず、確信度の低いローカル解析の結果をそのまま使う
+        if self.ai_generator.use_template_tier():
+            return parsed.target_date if parsed.use_transit else None
         
-        for pattern in date_patterns:
-            match = re.search(pattern, consultation)
-            if match:
-                groups = match.groups()
-                try:
-                    if len(groups) == 3:
-                        if len(groups[0]) == 4:  # 年が4桁
-                            year, month, day = groups
-                        else:  # 月/日/年
-                            month, day, year = groups
-                    elif len(groups) == 2:
-                        if len(groups[0]) == 4:  # 年-月-日
-                            year, month, day = groups
-                            day = '01'  # 日が指定されていない場合は1日
-                        else:  # 月/日
-                            month, day = groups
-                            year = datetime.now().year
-                    else:  # 日のみ
-                        day = groups[0]
-                        month = datetime.now().month
-                        year = datetime.now().year
-                    
-                    # 日付を構築
-                    target_date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                    
-                    # 日付の妥当性をチェック
-                    datetime.strptime(target_date, "%Y-%m-%d")
-                    return target_date
-                except ValueError:
-                    continue
+        # AIにトランジット法を使用すべきか判断させる
+        if not self.ai_generator.should_use_transit_method(consultation):
+            print("AI判断: 通常のホロスコープ計算を使用")
+            return None
         
-        # 相対的な日付表現をチェック
-        relative_patterns = {
-            '今日': 0,
-            '明日': 1,
-            '明後日': 2,
-            '来週': 7,
-            '来月': 30
-        }
+        # AIに日時を推測させる
+        target_date = self.ai_generator.predict_target_date(consultation)
+        print(f"AI判断: トランジット法を使用、対象日時: {target_date}")
+        return target_date
+    
+    def generate_divination_result(self, request_data: Dict[str, Any], plan_type: str | None = None, on_section: SectionCallback | None = None) -> Dict[str, Any]:
+        """
+        占い結果を生成（プラン種別に応じてLLM呼び出しの優先度を設定し、LLMの利用量を記録）
+        on_sectionを指定すると、総合占いはセクション単位で並列生成し、完了したセクションから通知する
+        クイック鑑定（request_data['quick']）やテンプレートを既定とするプランでは、鑑定文をLLMを呼ばずにテンプレートで生成する
+        デバッグ時（request_data['debug']またはDIVINATION_STAGE_TRACE）は、ステージごとの実行時間をresult['stage_trace']に含める
+        同じ入力の数秘術・ホロスコープ（request_data['tarot_seed']を指定したタロット）は、処理を始める前にキャッシュ済みの結果を返す
+        """
+        quick = uses_template_tier(request_data, plan_type)
+        debug = bool(request_data.get('debug')) or self.stage_trace_enabled
+        # デバッグ時はステージを計測するためキャッシュを使わない
+        cache_key = None
+        if self.result_cache_enabled and not debug:
+            cache_key = result_cache_key(request_data, quick, 'sections' if on_section else self.comprehensive_mode)
+        if cache_key is not None:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                with self.ai_generator.track_usage() as usage:
+                    usage.add_cache_hit('result_cache')
+                cached['llm_usage'] = dict(usage.summary(), plan_type=plan_type)
+                return cached
+        # 共有プールが満杯なら処理を始めずにQueueFullErrorで断る（APIでは503 + Retry-After）
+        service_executor.check_capacity()
+        with self.ai_generator.request_priority(plan_type), self.ai_generator.template_tier(quick), self.ai_generator.track_usage() as usage, stage_trace(debug) as trace:
+            result = self._generate_divination_result(request_data, on_section)
+        # LLMの失敗や計算エラーで代替の結果になった場合はキャッシュせず、次のリクエストで生成し直す
+        if cache_key is not None and not usage.is_degraded():
+            result_cache.set(cache_key, request_data, result)
+        # LLM呼び出しのトークン数・コストの集計（保存時にDivinationResult.llm_usageへ移す）
+        result['llm_usage'] = dict(usage.summary(), plan_type=plan_type)
+        if trace is not None:
+            result['stage_trace'] = trace
+        return result
+    
+    def generate_divination_batch(self, items: List[Dict[str, Any]], plan_type: str | None = None) -> Dict[str, Any]:
+        """
+        複数の占いをまとめて生成（itemsは generate_divination_result と同じrequest_dataのリスト）
+        ローマ字変換・ジオコーディング・出生図はバッチ内で1回だけ計算して共有し、各占いは並行して生成する
+        結果は入力順に {'result': ...} または {'error': ..., 'retry_after': 混雑時のみ} を返し、1件の失敗で他の占いを止めない
+        """
+        if not items:
+            raise ValueError("占いの指定が必要です")
+        if len(items) > self.batch_max_items:
+            raise ValueError(f"一度に生成できる占いは{self.batch_max_items}件までです")
+        # 共有プールが満杯ならバッチ全体を断る（APIでは503 + Retry-After）
+        service_executor.check_capacity()
         
-        for keyword, days in relative_patterns.items():
-            if keyword in consultation:
-                target_date = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
-                return target_date
+        def run(request_data: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                return {'result': self.generate_divination_result(request_data, plan_type=plan_type)}
+            except QueueFullError as e:
+                return {'error': str(e), 'retry_after': e.retry_after}
+            except Exception as e:
+                print(f"バッチ内の占い生成エラー: {e}")
+                return {'error': str(e)}
         
-        return None
+        with shared_inputs() as memo:
+            # 占いごとにコンテキストを分け（LLM利用量の記録先など）、共有入力のメモだけを引き継ぐ
+            futures = [self._batch_pool.submit(contextvars.copy_context().run, run, request_data) for request_data in items]
+            outcomes = [future.result() for future in futures]
+        return {'items': outcomes, 'shared_inputs': memo.stats()}
     
-    def generate_divination_result(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
-        """占い結果を生成"""
+    def _generate_divination_result(self, request_data: Dict[str, Any], on_section: SectionCallback | None = None) -> Dict[str, Any]:
+        """占術タイプに応じて結果を生成"""
         fortune_type = request_data.get('type')
         profiles = request_data.get('profiles', [])
         consultation = request_data.get('consultation', '')
@@ -103,52 +170,48 @@ class DivinationService:
         if not profiles:
             raise ValueError("プロフィールデータが必要です")
         
+        # 3人以上はグループ相性
+        if len(profiles) > 2:
+            return self._generate_group_result(fortune_type, profiles, consultation)
+        
         if fortune_type == 'numerology':
             return self._generate_numerology_result(profiles, consultation)
         elif fortune_type == 'horoscope':
             return self._generate_horoscope_result(profiles, consultation)
         elif fortune_type == 'tarot':
-            return self._generate_tarot_result(profiles, consultation)
+            return self._generate_tarot_result(profiles, consultation, request_data.get('tarot_seed'))
         elif fortune_type == 'comprehensive':
-            return self._generate_comprehensive_result(profiles, consultation)
+            return self._generate_comprehensive_result(profiles, consultation, on_section)
         else:
             raise ValueError(f"未対応の占術タイプ: {fortune_type}")
     
+    def _run_stages(self, graph: StageGraph) -> Dict[str, Any]:
+        """ステージグラフを共有プール（CPU・I/O）で実行し、ステージ名 -> 結果 を返す"""
+        return graph.run({'cpu': service_executor.submit_cpu, 'io': service_executor.submit_io})
+    
     def _generate_numerology_result(self, profiles: List[Dict[str, Any]], consultation: str) -> Dict[str, Any]:
         """数秘術の結果を生成"""
         if len(profiles) == 1:
             # 個人占い
             profile = profiles[0]
             
-            # 数秘術計算を先に完了（精度を保つため）
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                # 数秘術計算、今日の運勢計算、AI分析を並列実行
-                numerology_future = executor.submit(self.numerology_calculator.get_numerology_reading, profile)
-                
-                from datetime import date
-                today = date.today().isoformat()
-                temporal_future = executor.submit(self._calculate_temporal_fortune_safe, profile, today)
-                
-                # 数秘術計算の完了を待機
-                numerology_data = numerology_future.result()
-                temporal_fortune = temporal_future.result()
-                
-                # AI分析を並列実行（数秘術データが揃った後）
-                ai_future = executor.submit(self.ai_generator.generate_numerology_analysis, numerology_data, consultation)
-                
-                # ビジュアル結果を生成
-                visual_result = self._generate_numerology_visual(numerology_data)
-                
-                # AI分析の完了を待機
-                ai_analysis = ai_future.result()
+            from datetime import date
+            today = date.today().isoformat()
+            
+            # 数秘術計算と今日の運勢計算は独立して実行し、AI分析とビジュアルは数秘術計算の完了後に実行
+            stages = self._run_stages(StageGraph('numerology')
+                .add('numerology_data', lambda: self.numerology_calculator.get_numerology_reading(profile), pool='cpu')
+                .add('temporal_fortune', lambda: self._calculate_temporal_fortune_safe(profile, today), pool='cpu')
+                .add('ai_analysis', lambda numerology_data: self.ai_generator.generate_numerology_analysis(numerology_data, consultation), ('numerology_data',), pool='io')
+                .add('visual_result', self._generate_numerology_visual, ('numerology_data',)))
             
             return {
                 'fortune_type': 'numerology',
                 'purpose': 'personal',
-                'numerology_data': numerology_data,
-                'temporal_fortune': temporal_fortune,
-                'ai_analysis': ai_analysis,
-                'visual_result': visual_result
+                'numerology_data': stages['numerology_data'],
+                'temporal_fortune': stages['temporal_fortune'],
+                'ai_analysis': stages['ai_analysis'],
+                'visual_result': stages['visual_result']
             }
         else:
             # 相性占い（並列処理最適化）
@@ -158,21 +221,13 @@ class DivinationService:
             print(f"Profile 2: {profile2}")
             
             try:
-                # 並列処理で相性分析を実行
-                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                    compatibility_future = executor.submit(self.numerology_calculator.get_compatibility_analysis, profile1, profile2, consultation)
-                    compatibility_data = compatibility_future.result()
+                # 相性分析（内部でLLMを呼ぶためI/Oプールで実行し、同時実行数を抑える）
+                stages = self._run_stages(StageGraph('numerology_compatibility')
+                    .add('compatibility_data', lambda: self.numerology_calculator.get_compatibility_analysis(profile1, profile2, consultation), pool='io')
+                    .add('ai_analysis', lambda compatibility_data: self._fix_compatibility_analysis(compatibility_data, profile1, profile2, '相性分析を生成中です...'), ('compatibility_data',))
+                    .add('visual_result', lambda compatibility_data: self._generate_compatibility_visual(compatibility_data, 'numerology'), ('compatibility_data',)))
                 
-                print(f"Compatibility data generated: {compatibility_data}")
-                # AI analysis is now handled within get_compatibility_analysis
-                ai_analysis = compatibility_data.get('analysis', '相性分析を生成中です...')
-                # 後処理チェックを適用
-                if ai_analysis:
-                    ai_analysis = self.ai_generator._fix_nickname_usage(
-                        ai_analysis, 
-                        profile1.get('nickname', 'あなた'), 
-                        profile2.get('nickname', '相手')
-                    )
+                print(f"Compatibility data generated: {stages['compatibility_data']}")
                 print(f"AI analysis generated for compatibility with consultation: {consultation}")
             except Exception as e:
                 print(f"Error in compatibility analysis: {e}")
@@ -183,189 +238,275 @@ class DivinationService:
             return {
                 'fortune_type': 'numerology',
                 'purpose': 'compatibility',
-                'compatibility_data': compatibility_data,
-                'ai_analysis': ai_analysis,
-                'visual_result': self._generate_compatibility_visual(compatibility_data, 'numerology')
+                'compatibility_data': stages['compatibility_data'],
+                'ai_analysis': stages['ai_analysis'],
+                'visual_result': stages['visual_result']
             }
     
+    def _fix_compatibility_analysis(self, compatibility_data: Dict[str, Any], profile1: Dict[str, Any], profile2: Dict[str, Any], default: str = '') -> str:
+        """相性計算に含まれるAI分析を取り出し、ニックネームの後処理チェックを適用"""
+        ai_analysis = compatibility_data.get('analysis', default)
+        if ai_analysis:
+            ai_analysis = self.ai_generator._fix_nickname_usage(
+                ai_analysis, 
+                profile1.get('nickname', 'あなた'), 
+                profile2.get('nickname', '相手')
+            )
+        return ai_analysis
+    
+    def _calculate_horoscope_for_target(self, profile: Dict[str, Any], target_date: str | None) -> Dict[str, Any]:
+        """対象日時があればトランジット法、なければ通常のホロスコープを計算し、ニックネームを追加"""
+        if target_date:
+            horoscope_data = self.horoscope_calculator.calculate_transit_horoscope(profile, target_date)
+        else:
+            horoscope_data = self.horoscope_calculator.calculate_horoscope(profile)
+        horoscope_data['nickname'] = profile.get('nickname', 'あなた')
+        return horoscope_data
+    
     def _generate_horoscope_result(self, profiles: List[Dict[str, Any]], consultation: str) -> Dict[str, Any]:
-        """西洋占星術の結果を生成（AI判断によるトランジット法対応）"""
+        """西洋占星術の結果を生成（ローカル解析・AI判断によるトランジット法対応）"""
         if len(profiles) == 1:
             # 個人占い（並列処理最適化）
             profile = profiles[0]
             
-            # AIにトランジット法を使用すべきか判断させる
-            should_use_transit = self.ai_generator.should_use_transit_method(consultation)
-            target_date = None
-            
-            if should_use_transit:
-                # AIに日時を推測させる
-                target_date = self.ai_generator.predict_target_date(consultation)
-                print(f"AI判断: トランジット法を使用、対象日時: {target_date}")
-            else:
-                print(f"AI判断: 通常のホロスコープ計算を使用")
-            
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                if target_date:
-                    # トランジット法を使用
-                    horoscope_future = executor.submit(self.horoscope_calculator.calculate_transit_horoscope, profile, target_date)
-                else:
-                    # 通常のホロスコープ計算
-                    horoscope_future = executor.submit(self.horoscope_calculator.calculate_horoscope, profile)
-                
-                horoscope_data = horoscope_future.result()
-                
-                # ニックネームを追加
-                horoscope_data['nickname'] = profile.get('nickname', 'あなた')
-                
-                # AI分析を並列実行
-                ai_future = executor.submit(self.ai_generator.generate_horoscope_analysis, horoscope_data, consultation)
-                ai_analysis = ai_future.result()
+            # トランジット法の要否と対象日時の判定（AIに判断させることがあるためI/Oプール）→ ホロスコープ計算 → AI分析・ビジュアル
+            stages = self._run_stages(StageGraph('horoscope')
+                .add('target_date', lambda: self._resolve_transit_target(consultation, profile), pool='io')
+                .add('horoscope_data', lambda target_date: self._calculate_horoscope_for_target(profile, target_date), ('target_date',), pool='cpu')
+                .add('ai_analysis', lambda horoscope_data: self.ai_generator.generate_horoscope_analysis(horoscope_data, consultation), ('horoscope_data',), pool='io')
+                .add('visual_result', self._generate_horoscope_visual, ('horoscope_data',)))
             
             return {
                 'fortune_type': 'horoscope',
                 'purpose': 'personal',
-                'horoscope_data': horoscope_data,
-                'ai_analysis': ai_analysis,
-                'visual_result': self._generate_horoscope_visual(horoscope_data)
+                'horoscope_data': stages['horoscope_data'],
+                'ai_analysis': stages['ai_analysis'],
+                'visual_result': stages['visual_result']
             }
         else:
             # 相性占い（並列処理最適化）
             profile1, profile2 = profiles[0], profiles[1]
             
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                compatibility_future = executor.submit(self.horoscope_calculator.get_compatibility_analysis, profile1, profile2, consultation)
-                compatibility_data = compatibility_future.result()
-            
-            # AI分析は既にcompatibility_dataに含まれているが、後処理チェックを適用
-            ai_analysis = compatibility_data.get('analysis', '')
-            if ai_analysis:
-                # 後処理チェックを適用
-                ai_analysis = self.ai_generator._fix_nickname_usage(
-                    ai_analysis, 
-                    profile1.get('nickname', 'あなた'), 
-                    profile2.get('nickname', '相手')
-                )
+            # 相性分析（内部でLLMを呼ぶためI/Oプールで実行）、AI分析は既にcompatibility_dataに含まれているが後処理チェックを適用
+            stages = self._run_stages(StageGraph('horoscope_compatibility')
+                .add('compatibility_data', lambda: self.horoscope_calculator.get_compatibility_analysis(profile1, profile2, consultation), pool='io')
+                .add('ai_analysis', lambda compatibility_data: self._fix_compatibility_analysis(compatibility_data, profile1, profile2), ('compatibility_data',))
+                .add('visual_result', lambda compatibility_data: self._generate_compatibility_visual(compatibility_data, 'horoscope'), ('compatibility_data',)))
             
             return {
                 'fortune_type': 'horoscope',
                 'purpose': 'compatibility',
-                'compatibility_data': compatibility_data,
-                'ai_analysis': ai_analysis,
-                'visual_result': self._generate_compatibility_visual(compatibility_data, 'horoscope')
+                'compatibility_data': stages['compatibility_data'],
+                'ai_analysis': stages['ai_analysis'],
+                'visual_result': stages['visual_result']
             }
     
-    def _generate_tarot_result(self, profiles: List[Dict[str, Any]], consultation: str) -> Dict[str, Any]:
-        """タロット占いの結果を生成（並列処理で高速化）"""
+    def _generate_tarot_result(self, profiles: List[Dict[str, Any]], consultation: str, seed: int | str | None = None) -> Dict[str, Any]:
+        """タロット占いの結果を生成（並列処理で高速化、seedを指定するとカードの引き方を固定する）"""
         if len(profiles) == 1:
             # 個人占い
             profile = profiles[0]
             nickname = profile.get('nickname', 'あなた')
             
-            # タロット計算とAI分析を並列実行
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                # タロット計算を開始
-                tarot_future = executor.submit(self.tarot_calculator.perform_tarot_reading, consultation, nickname)
-                
-                # タロット計算の完了を待機
-                tarot_data = tarot_future.result()
-                
-                # AI分析を並列実行（タロットデータが揃った後）
-                ai_future = executor.submit(self.ai_generator.generate_tarot_analysis, tarot_data, consultation)
-                
-                # ビジュアル結果を生成（並列）
-                visual_future = executor.submit(self._generate_tarot_visual, tarot_data)
-                
-                # 結果を取得
-                ai_analysis = ai_future.result()
-                visual_result = visual_future.result()
+            # タロット計算（スプレッド選択でLLMを呼ぶことがあるためI/Oプール）の後、AI分析とビジュアルを並行して生成
+            stages = self._run_stages(StageGraph('tarot')
+                .add('tarot_data', lambda: self.tarot_calculator.perform_tarot_reading(consultation, nickname, seed), pool='io')
+                .add('ai_analysis', lambda tarot_data: self.ai_generator.generate_tarot_analysis(tarot_data, consultation), ('tarot_data',), pool='io')
+                .add('visual_result', self._generate_tarot_visual, ('tarot_data',)))
             
             return {
                 'fortune_type': 'tarot',
                 'purpose': 'personal',
-                'tarot_data': tarot_data,
-                'ai_analysis': ai_analysis,
-                'visual_result': visual_result
+                'tarot_data': stages['tarot_data'],
+                'ai_analysis': stages['ai_analysis'],
+                'visual_result': stages['visual_result']
             }
         else:
             # 相性占い
             profile1, profile2 = profiles[0], profiles[1]
             
-            # 相性タロット計算とAI分析を並列実行
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                # 相性タロット計算を開始
-                tarot_future = executor.submit(self.tarot_calculator.get_compatibility_analysis, profile1, profile2, consultation)
-                
-                # タロット計算の完了を待機
-                tarot_data = tarot_future.result()
-                
-                # AI分析を並列実行（タロットデータが揃った後）
-                ai_future = executor.submit(self.ai_generator.generate_compatibility_analysis, tarot_data, 'tarot', consultation)
-                
-                # ビジュアル結果を生成（並列）
-                visual_future = executor.submit(self._generate_tarot_compatibility_visual, tarot_data)
-                
-                # 結果を取得
-                ai_analysis = ai_future.result()
-                visual_result = visual_future.result()
+            # 相性タロット計算の後、AI分析とビジュアルを並行して生成
+            stages = self._run_stages(StageGraph('tarot_compatibility')
+                .add('tarot_data', lambda: self.tarot_calculator.get_compatibility_analysis(profile1, profile2, consultation, seed), pool='io')
+                .add('ai_analysis', lambda tarot_data: self.ai_generator.generate_compatibility_analysis(tarot_data, 'tarot', consultation), ('tarot_data',), pool='io')
+                .add('visual_result', self._generate_tarot_compatibility_visual, ('tarot_data',)))
             
             return {
                 'fortune_type': 'tarot',
                 'purpose': 'compatibility',
-                'compatibility_data': tarot_data,
-                'ai_analysis': ai_analysis,
-                'visual_result': visual_result
+                'compatibility_data': stages['tarot_data'],
+                'ai_analysis': stages['ai_analysis'],
+                'visual_result': stages['visual_result']
             }
     
-    def _generate_comprehensive_result(self, profiles: List[Dict[str, Any]], consultation: str) -> Dict[str, Any]:
+    def _generate_comprehensive_result(self, profiles: List[Dict[str, Any]], consultation: str, on_section: SectionCallback | None = None) -> Dict[str, Any]:
         """総合占いの結果を生成"""
+        mode = 'sections' if on_section else self.comprehensive_mode
+        # クイック鑑定・過負荷時はLLMを呼ばずにテンプレート鑑定文で即答
+        if self.ai_generator.use_template_tier():
+            mode = 'template'
         if len(profiles) == 1:
             # 個人占い
             profile = profiles[0]
+            nickname = profile.get('nickname', 'あなた')
             
-            # 数秘術と西洋占星術の両方を計算
-            numerology_data = self.numerology_calculator.get_numerology_reading(profile)
-            horoscope_data = self.horoscope_calculator.calculate_horoscope(profile)
+            # 数秘術と西洋占星術は独立して計算し、両方が揃ったら鑑定文とビジュアルを生成
+            graph = (StageGraph('comprehensive')
+                .add('numerology_data', lambda: self.numerology_calculator.get_numerology_reading(profile), pool='cpu')
+                .add('horoscope_data', lambda: self.horoscope_calculator.calculate_horoscope(profile), pool='cpu')
+                .add('visual_result', self._generate_comprehensive_visual, ('numerology_data', 'horoscope_data')))
+            if mode != 'chained':
+                graph.add('reading', lambda numerology_data, horoscope_data: self._generate_comprehensive_reading(
+                    mode, numerology_data, horoscope_data, consultation, nickname, on_section
+                ), ('numerology_data', 'horoscope_data'), pool='io')
+            stages = self._run_stages(graph)
             
-            # 総合的なAI分析を生成
-            ai_analysis = self._generate_comprehensive_analysis(numerology_data, horoscope_data, consultation)
+            # 1回の構造化出力・セクション単位の生成に失敗した場合（またはchainedモード）は個別生成してから統合
+            ai_analysis = stages.get('reading')
+            if ai_analysis is None:
+                ai_analysis = self._generate_comprehensive_analysis(stages['numerology_data'], stages['horoscope_data'], consultation)
             
             return {
                 'fortune_type': 'comprehensive',
                 'purpose': 'personal',
-                'numerology_data': numerology_data,
-                'horoscope_data': horoscope_data,
+                'numerology_data': stages['numerology_data'],
+                'horoscope_data': stages['horoscope_data'],
                 'ai_analysis': ai_analysis,
-                'visual_result': self._generate_comprehensive_visual(numerology_data, horoscope_data)
+                'visual_result': stages['visual_result']
             }
         else:
             # 相性占い
             profile1, profile2 = profiles[0], profiles[1]
+            include_ai = mode not in ('structured', 'sections', 'template')
             
-            # 数秘術と西洋占星術の相性分析
-            numerology_compatibility = self.numerology_calculator.get_compatibility_analysis(profile1, profile2, consultation)
-            # fortune_typeを追加
-            numerology_compatibility['fortune_type'] = 'numerology'
-            horoscope_compatibility = self.horoscope_calculator.get_compatibility_analysis(profile1, profile2, consultation)
-            # fortune_typeを追加
-            horoscope_compatibility['fortune_type'] = 'horoscope'
+            # 数秘術と西洋占星術の相性分析は独立して実行（構造化出力・セクションモードでは各計算でAIを呼ばない）
+            graph = (StageGraph('comprehensive_compatibility')
+                .add('numerology_compatibility', lambda: dict(
+                    self.numerology_calculator.get_compatibility_analysis(profile1, profile2, consultation, include_ai=include_ai), fortune_type='numerology'
+                ), pool='io')
+                .add('horoscope_compatibility', lambda: dict(
+                    self.horoscope_calculator.get_compatibility_analysis(profile1, profile2, consultation, include_ai=include_ai), fortune_type='horoscope'
+                ), pool='io'))
+            if mode != 'chained':
+                # 構造化出力では西洋占星術の相性スコアを書き換えるため、ビジュアルは鑑定文の生成後に作る
+                graph.add('reading', lambda numerology_compatibility, horoscope_compatibility: self._generate_comprehensive_compatibility_reading(
+                    mode, numerology_compatibility, horoscope_compatibility, consultation, profile1, profile2, on_section
+                ), ('numerology_compatibility', 'horoscope_compatibility'), pool='io')
+            graph.add('visual_result', lambda numerology_compatibility, horoscope_compatibility, *_: self._generate_comprehensive_compatibility_visual(
+                numerology_compatibility, horoscope_compatibility
+            ), ('numerology_compatibility', 'horoscope_compatibility') + (('reading',) if mode != 'chained' else ()))
+            stages = self._run_stages(graph)
+            numerology_compatibility = stages['numerology_compatibility']
+            horoscope_compatibility = stages['horoscope_compatibility']
             
-            # 総合的な相性分析を生成
-            ai_analysis = self._generate_comprehensive_compatibility_analysis(
-                numerology_compatibility, horoscope_compatibility, consultation
-            )
+            # 総合的な相性分析（失敗時・chainedモードは個別生成してから統合）
+            ai_analysis, compatibility_score = stages.get('reading') or (None, None)
+            if ai_analysis is None:
+                ai_analysis = self._generate_comprehensive_compatibility_analysis(
+                    numerology_compatibility, horoscope_compatibility, consultation
+                )
+            if compatibility_score is None:
+                compatibility_score = round((numerology_compatibility['compatibility_score'] + horoscope_compatibility['compatibility_score']) / 2)
             
             return {
                 'fortune_type': 'comprehensive',
                 'purpose': 'compatibility',
+                'compatibility_score': compatibility_score,
                 'numerology_compatibility': numerology_compatibility,
                 'horoscope_compatibility': horoscope_compatibility,
                 'ai_analysis': ai_analysis,
-                'visual_result': self._generate_comprehensive_compatibility_visual(
-                    numerology_compatibility, horoscope_compatibility
-                )
+                'visual_result': stages['visual_result']
             }
     
+    def _generate_group_result(self, fortune_type: str, profiles: List[Dict[str, Any]], consultation: str) -> Dict[str, Any]:
+        """
+        グループ相性（3人以上）の結果を生成
+        各メンバーの数秘術・ホロスコープを1回ずつ並行して計算し、全ペアのスコアを行列でまとめて算出してから、鑑定文を1回で生成する
+        """
+        if fortune_type not in ('numerology', 'horoscope', 'comprehensive'):
+            raise ValueError(f"グループ相性に未対応の占術タイプ: {fortune_type}")
+        if len(profiles) > MAX_GROUP_SIZE:
+            raise ValueError(f"グループ相性は{MAX_GROUP_SIZE}人までです")
+        
+        nicknames = [profile.get('nickname') or f"メンバー{index + 1}" for index, profile in enumerate(profiles)]
+        use_numerology = fortune_type in ('numerology', 'comprehensive')
+        use_horoscope = fortune_type in ('horoscope', 'comprehensive')
+        
+        graph = StageGraph(f'{fortune_type}_group')
+        chart_stages = []
+        for index, profile in enumerate(profiles):
+            if use_numerology:
+                graph.add(f'numerology_{index}', lambda profile=profile: self.numerology_calculator.get_numerology_reading(profile), pool='cpu')
+                chart_stages.append(f'numerology_{index}')
+            if use_horoscope:
+                graph.add(f'horoscope_{index}', lambda profile=profile: self.horoscope_calculator.calculate_horoscope(profile), pool='cpu')
+                chart_stages.append(f'horoscope_{index}')
+        
+        def group_scores(*charts) -> Dict[str, Any]:
+            results = dict(zip(chart_stages, charts))
+            numerology_readings = [results[f'numerology_{index}'] for index in range(len(profiles))] if use_numerology else None
+            horoscopes = [results[f'horoscope_{index}'] for index in range(len(profiles))] if use_horoscope else None
+            return build_group_data(nicknames, numerology_readings, horoscopes, consultation)
+        
+        stages = self._run_stages(graph
+            .add('group_data', group_scores, tuple(chart_stages))
+            .add('ai_analysis', lambda group_data: self.ai_generator.generate_group_analysis(group_data, fortune_type, consultation), ('group_data',), pool='io'))
+        group_data = stages['group_data']
+        
+        return {
+            'fortune_type': fortune_type,
+            'purpose': 'group',
+            'group_data': group_data,
+            'ai_analysis': stages['ai_analysis'],
+            'visual_result': {
+                'type': 'group',
+                'fortune_type': fortune_type,
+                'members': nicknames,
+                'score_matrix': group_data['score_matrix'],
+                'average_score': group_data['average_score'],
+                'best_pairs': group_data['best_pairs'],
+                'worst_pairs': group_data['worst_pairs']
+            }
+        }
+    
+    def _generate_comprehensive_reading(self, mode: str, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], consultation: str, nickname: str, on_section: SectionCallback | None = None) -> str | None:
+        """総合鑑定（個人）の鑑定文を生成（構造化出力モードでは1回の呼び出しで全セクションを、セクションモードでは各セクションを並列に生成、失敗時はNone）"""
+        if mode == 'template':
+            return self.ai_generator.generate_template_comprehensive(numerology_data, horoscope_data, consultation, nickname)
+        if mode == 'structured':
+            reading = self.ai_generator.generate_structured_comprehensive(numerology_data, horoscope_data, consultation, nickname)
+            if reading is not None:
+                return reading.render()
+            print("構造化出力に失敗したため、従来の統合方式にフォールバック")
+        elif mode == 'sections':
+            ai_analysis = self.ai_generator.generate_sectioned_comprehensive(numerology_data, horoscope_data, consultation, nickname, on_section)
+            if ai_analysis is not None:
+                return ai_analysis
+            print("セクション単位の生成に失敗したため、従来の統合方式にフォールバック")
+        return None
+    
+    def _generate_comprehensive_compatibility_reading(self, mode: str, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], consultation: str, profile1: Dict[str, Any], profile2: Dict[str, Any], on_section: SectionCallback | None = None) -> Tuple[str | None, int | None]:
+        """総合鑑定（相性）の鑑定文と総合スコアを生成（失敗時は鑑定文がNone、スコアは構造化出力のときのみ）"""
+        person1_nickname, person2_nickname = profile1.get('nickname', 'あなた'), profile2.get('nickname', '相手')
+        if mode == 'template':
+            return self.ai_generator.generate_template_comprehensive_compatibility(numerology_compatibility, horoscope_compatibility, consultation), None
+        if mode == 'structured':
+            reading = self.ai_generator.generate_structured_comprehensive_compatibility(
+                numerology_compatibility, horoscope_compatibility, consultation, person1_nickname, person2_nickname
+            )
+            if reading is not None:
+                horoscope_compatibility['compatibility_score'] = reading.horoscope_score
+                return reading.render(), reading.overall_score
+            print("構造化出力に失敗したため、従来の統合方式にフォールバック")
+        elif mode == 'sections':
+            ai_analysis = self.ai_generator.generate_sectioned_comprehensive_compatibility(
+                numerology_compatibility, horoscope_compatibility, consultation, person1_nickname, person2_nickname, on_section
+            )
+            if ai_analysis is not None:
+                return ai_analysis, None
+            print("セクション単位の生成に失敗したため、従来の統合方式にフォールバック")
+        return None, None
+    
     def _generate_numerology_visual(self, numerology_data: Dict[str, Any]) -> Dict[str, Any]:
         """数秘術のビジュアル結果を生成"""
         return {
@@ -510,116 +651,76 @@ class DivinationService:
     def _generate_comprehensive_analysis(self, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], consultation: str) -> str:
         """総合的なAI分析を生成"""
         try:
-            # 数秘術と西洋占星術の分析を統合
-            numerology_analysis = self.ai_generator.generate_numerology_analysis(numerology_data, consultation)
-            horoscope_analysis = self.ai_generator.generate_horoscope_analysis(horoscope_data, consultation)
+            # 数秘術と西洋占星術の分析は独立しているため並行して生成してから統合
+            stages = self._run_stages(StageGraph('comprehensive_chained')
+                .add('numerology_analysis', lambda: self.ai_generator.generate_numerology_analysis(numerology_data, consultation), pool='io')
+                .add('horoscope_analysis', lambda: self.ai_generator.generate_horoscope_analysis(horoscope_data, consultation), pool='io'))
+            numerology_analysis, horoscope_analysis = stages['numerology_analysis'], stages['horoscope_analysis']
             
-            # 統合された分析を生成
-            prompt = f"""
-あなたは経験豊富な占い師です。以下の数秘術と西洋占星術の分析を統合して、総合的な鑑定文を生成してください。
-
-【数秘術分析】
-{numerology_analysis}
-
-【西洋占星術分析】
-{horoscope_analysis}
-
-【相談内容】
-{consultation if consultation else "一般的な運勢について"}
-
-以下の形式で総合的な鑑定文を生成してください：
+            # 統合された分析を生成（トークン予算を超える場合は各分析を要約・切り詰め）
+            prompt = PromptBuilder().add(
+                'header', "あなたは経験豊富な占い師です。以下の数秘術と西洋占星術の分析を統合して、総合的な鑑定文を生成してください。"
+            ).add(
+                'numerology', f"【数秘術分析】\n{numerology_analysis}", priority=2, min_chars=200,
+                compact=lambda: f"【数秘術分析】\n{first_sentences(numerology_analysis, 400)}"
+            ).add(
+                'horoscope', f"【西洋占星術分析】\n{horoscope_analysis}", priority=2, min_chars=200,
+                compact=lambda: f"【西洋占星術分析】\n{first_sentences(horoscope_analysis, 400)}"
+            ).add(
+                'consultation', f"【相談内容】\n{consultation if consultation else '一般的な運勢について'}", priority=1, min_chars=100
+            ).add('instructions', """以下の形式で総合的な鑑定文を生成してください：
 1. 全体的な性格と特徴（数秘術と西洋占星術の共通点）
 2. 人生の方向性と使命
 3. 恋愛・人間関係
 4. 仕事・キャリア
 5. 今後のアドバイス
 
-温かみがあり、希望を与える内容で、具体的で実用的なアドバイスを含めてください。
-"""
+温かみがあり、希望を与える内容で、具体的で実用的なアドバイスを含めてください。""").build().text
             
-            response = self.ai_generator.model.generate_content(prompt)
-            return response.text
+            result = self.ai_generator._generate_analysis_with_gemini(prompt)
+            if result == self.ai_generator._get_timeout_message():
+                return self.ai_generator.generate_template_comprehensive(numerology_data, horoscope_data, consultation, numerology_data.get('nickname', 'あなた'))
+            return result
         except Exception as e:
             print(f"総合分析生成エラー: {e}")
-            return f"""
-【総合占い結果】
-
-数秘術と西洋占星術の両方から、あなたの人生の可能性を探りました。
-
-数秘術では、ライフパスナンバー{numerology_data['life_path']['number']}が示すように、
-あなたには特別な使命があります。
-
-西洋占星術では、{horoscope_data['sun_sign']}の太陽星座が示すように、
-あなたの基本的な性格は{self._get_sign_meaning(horoscope_data['sun_sign'])}です。
-
-この二つの占術が示す共通点を活かして、充実した人生を送っていきましょう。
-"""
+            return self.ai_generator.generate_template_comprehensive(numerology_data, horoscope_data, consultation, numerology_data.get('nickname', 'あなた'))
     
     def _generate_comprehensive_compatibility_analysis(self, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], consultation: str = "") -> str:
         """総合的な相性分析を生成"""
         try:
-            # 数秘術と西洋占星術の相性分析を統合
-            numerology_analysis = self.ai_generator.generate_compatibility_analysis(numerology_compatibility, 'numerology', consultation)
-            horoscope_analysis = self.ai_generator.generate_compatibility_analysis(horoscope_compatibility, 'horoscope', consultation)
+            # 数秘術と西洋占星術の相性分析は独立しているため並行して生成してから統合
+            stages = self._run_stages(StageGraph('comprehensive_compatibility_chained')
+                .add('numerology_analysis', lambda: self.ai_generator.generate_compatibility_analysis(numerology_compatibility, 'numerology', consultation), pool='io')
+                .add('horoscope_analysis', lambda: self.ai_generator.generate_compatibility_analysis(horoscope_compatibility, 'horoscope', consultation), pool='io'))
+            numerology_analysis, horoscope_analysis = stages['numerology_analysis'], stages['horoscope_analysis']
             
-            # 統合された相性分析を生成
-            prompt = f"""
-あなたは経験豊富な占い師です。以下の数秘術と西洋占星術の相性分析を統合して、総合的な相性鑑定文を生成してください。
-
-【数秘術相性分析】
-{numerology_analysis}
-
-【西洋占星術相性分析】
-{horoscope_analysis}
-
-【相談内容】
-{consultation if consultation else "一般的な相性について"}
-
-以下の形式で総合的な相性鑑定文を生成してください：
+            # 統合された相性分析を生成（トークン予算を超える場合は各分析を要約・切り詰め）
+            prompt = PromptBuilder().add(
+                'header', "あなたは経験豊富な占い師です。以下の数秘術と西洋占星術の相性分析を統合して、総合的な相性鑑定文を生成してください。"
+            ).add(
+                'numerology', f"【数秘術相性分析】\n{numerology_analysis}", priority=2, min_chars=200,
+                compact=lambda: f"【数秘術相性分析】\n{first_sentences(numerology_analysis, 400)}"
+            ).add(
+                'horoscope', f"【西洋占星術相性分析】\n{horoscope_analysis}", priority=2, min_chars=200,
+                compact=lambda: f"【西洋占星術相性分析】\n{first_sentences(horoscope_analysis, 400)}"
+            ).add(
+                'consultation', f"【相談内容】\n{consultation if consultation else '一般的な相性について'}", priority=1, min_chars=100
+            ).add('instructions', """以下の形式で総合的な相性鑑定文を生成してください：
 1. 全体的な相性の評価
 2. お互いの強みと補完関係
 3. 恋愛・結婚における相性
 4. 友情・ビジネスにおける相性
 5. 関係を深めるためのアドバイス
 
-相談内容を踏まえて、温かみがあり、建設的なアドバイスを含めてください。
-"""
+相談内容を踏まえて、温かみがあり、建設的なアドバイスを含めてください。""").build().text
             
-            response = self.ai_generator.model.generate_content(prompt)
-            return response.text
+            result = self.ai_generator._generate_analysis_with_gemini(prompt)
+            if result == self.ai_generator._get_timeout_message():
+                return self.ai_generator.generate_template_comprehensive_compatibility(numerology_compatibility, horoscope_compatibility, consultation)
+            return result
         except Exception as e:
             print(f"総合相性分析生成エラー: {e}")
-            return f"""
-【総合相性分析結果】
-
-数秘術と西洋占星術の両方から、お二人の相性を分析しました。
-
-数秘術では、相性スコア{numerology_compatibility['compatibility_score']}/100で、
-お二人のライフパスナンバーが示す相性があります。
-
-西洋占星術では、相性スコア{horoscope_compatibility['compatibility_score']}/100で、
-お二人の星座の組み合わせが示す相性があります。
-
-この二つの占術が示す相性を活かして、素晴らしい関係を築いていきましょう。
-"""
-    
-    def _get_sign_meaning(self, sign: str) -> str:
-        """星座の意味を取得"""
-        meanings = {
-            'Aries': '情熱的でリーダーシップがある',
-            'Taurus': '安定感があり、実用的',
-            'Gemini': '好奇心旺盛でコミュニケーション能力が高い',
-            'Cancer': '感情的で家族を大切にする',
-            'Leo': '創造的で自信に満ちている',
-            'Virgo': '分析的で完璧主義',
-            'Libra': 'バランス感覚があり、調和を求める',
-            'Scorpio': '神秘的で情熱的',
-            'Sagittarius': '冒険的で哲学的な思考',
-            'Capricorn': '責任感が強く、目標志向',
-            'Aquarius': '革新的で独立心が強い',
-            'Pisces': '直感的で共感力が高い'
-        }
-        return meanings.get(sign, '特別な意味')
+            return self.ai_generator.generate_template_comprehensive_compatibility(numerology_compatibility, horoscope_compatibility, consultation)
     
     def _generate_tarot_visual(self, tarot_data: Dict[str, Any]) -> Dict[str, Any]:
         """タロット占いのビジュアル結果を生成"""
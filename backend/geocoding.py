@@ -10,6 +10,8 @@ from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 import signal
 import time
+# 数秘術計算と同じモジュールのメモを使うため絶対インポート
+from shared_inputs import memoized
 
 load_dotenv(dotenv_path='.env.local')
 
@@ -64,7 +66,10 @@ class GeocodingService:
                 print(f"Google Geocoding API: その他のエラー - {error_msg}")
     
     def geocode_address(self, address: str) -> Dict[str, Any]:
-        """住所を座標に変換（キャッシュ機能付き）"""
+        """住所を座標に変換（キャッシュ機能付き、バッチ処理中は同じ住所の同時問い合わせを1回にまとめる）"""
+        return memoized('geocoding', address, lambda: self._geocode_address(address))
+    
+    def _geocode_address(self, address: str) -> Dict[str, Any]:
         # キャッシュをチェック
         if address in self._cache:
             print(f"Using cached geocoding result for: {address}")
@@ -0,0 +1,91 @@
+"""
+グループ相性（3人以上）のスコア集計
+各メンバーの数秘術・ホロスコープは1回ずつ計算し、全ペアの相性スコアを行列としてまとめて算出する
+"""
+
+import os
+import numpy as np
+from typing import Dict, Any, List, Tuple
+
+from numerology_scoring import numerology_score_table, SCORE_DIMENSIONS
+from horoscope_scoring import sign_score_table
+
+# 1回のグループ占いで扱える人数の上限
+MAX_GROUP_SIZE = int(os.getenv('GROUP_MAX_PROFILES', '12'))
+# 相性の良い・課題のあるペアとして返す組数
+PAIR_HIGHLIGHTS = int(os.getenv('GROUP_PAIR_HIGHLIGHTS', '3'))
+
+
+def _symmetric(matrix: np.ndarray) -> np.ndarray:
+    """上三角（i < j、iの人から見たスコア）を対角の反対側に写して対称行列にする"""
+    upper = np.triu(matrix, 1)
+    return upper + upper.T
+
+
+def _to_rows(matrix: np.ndarray) -> List[List[int | None]]:
+    """JSON用の2次元リスト（自分自身との組み合わせはNone）"""
+    return [[None if i == j else int(value) for j, value in enumerate(row)] for i, row in enumerate(matrix)]
+
+
+def rank_pairs(matrix: np.ndarray, nicknames: List[str], count: int = PAIR_HIGHLIGHTS) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """全ペアをスコア順に並べ、(相性の良いペア, 課題のあるペア) を上位count組ずつ返す"""
+    rows, columns = np.triu_indices(len(nicknames), k=1)
+    scores = matrix[rows, columns]
+
+    def pairs(order: np.ndarray) -> List[Dict[str, Any]]:
+        return [{
+            'person1': nicknames[rows[k]],
+            'person2': nicknames[columns[k]],
+            'person1_index': int(rows[k]),
+            'person2_index': int(columns[k]),
+            'score': int(scores[k])
+        } for k in order[:count]]
+
+    # 同点は入力順（安定ソート）
+    return pairs(np.argsort(-scores, kind='stable')), pairs(np.argsort(scores, kind='stable'))
+
+
+def member_summary(nickname: str, numerology_data: Dict[str, Any] | None, horoscope_data: Dict[str, Any] | None) -> Dict[str, Any]:
+    """鑑定文とレスポンスで使うメンバーごとの要点"""
+    summary: Dict[str, Any] = {'nickname': nickname}
+    if numerology_data is not None:
+        summary.update({key: numerology_data[key]['number'] for key, _ in SCORE_DIMENSIONS})
+    if horoscope_data is not None:
+        summary.update({key: horoscope_data.get(key) for key in ('sun_sign', 'moon_sign', 'rising_sign')})
+    return summary
+
+
+def build_group_data(nicknames: List[str], numerology_readings: List[Dict[str, Any]] | None, horoscopes: List[Dict[str, Any]] | None, consultation: str = "") -> Dict[str, Any]:
+    """
+    グループ相性のスコア行列と注目ペアを算出
+    数秘術・ホロスコープの片方だけ渡せばその占術のスコア、両方渡せば平均を総合スコアとする
+    """
+    components: Dict[str, np.ndarray] = {}
+    if numerology_readings is not None:
+        components['numerology'] = _symmetric(numerology_score_table.matrix(numerology_readings))
+    if horoscopes is not None:
+        components['horoscope'] = _symmetric(sign_score_table.matrix(horoscopes, consultation))
+    if not components:
+        raise ValueError("グループ相性には数秘術かホロスコープの結果が必要です")
+    matrix = np.rint(sum(components.values()) / len(components)).astype(np.int32) if len(components) > 1 else next(iter(components.values()))
+
+    best_pairs, worst_pairs = rank_pairs(matrix, nicknames)
+    rows, columns = np.triu_indices(len(nicknames), k=1)
+    group_data = {
+        'size': len(nicknames),
+        'members': [
+            member_summary(
+                nickname,
+                numerology_readings[index] if numerology_readings is not None else None,
+                horoscopes[index] if horoscopes is not None else None
+            )
+            for index, nickname in enumerate(nicknames)
+        ],
+        'score_matrix': _to_rows(matrix),
+        'average_score': int(round(float(matrix[rows, columns].mean()))) if len(rows) else None,
+        'best_pairs': best_pairs,
+        'worst_pairs': worst_pairs
+    }
+    if len(components) > 1:
+        group_data['component_matrices'] = {name: _to_rows(component) for name, component in components.items()}
+    return group_data
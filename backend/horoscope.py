@@ -11,26 +11,17 @@ import json
 import base64
 import io
 from .geocoding import GeocodingService
+from .horoscope_data import SIGN_MEANINGS, PLANET_MEANINGS, SIGN_COMPATIBILITY, consultation_bonus
+# 数秘術計算と同じモジュールのメモ・利用量の台帳を使うため絶対インポート
+from shared_inputs import memoized, birth_key
+from llm_usage import record_degraded
 
 class HoroscopeCalculator:
     """西洋占星術計算クラス"""
     
     def __init__(self):
         self.geocoding_service = GeocodingService()
-        self.sign_meanings = {
-            'Aries': '牡羊座 - 情熱的でリーダーシップがある',
-            'Taurus': '牡牛座 - 安定感があり、実用的',
-            'Gemini': '双子座 - 好奇心旺盛でコミュニケーション能力が高い',
-            'Cancer': '蟹座 - 感情的で家族を大切にする',
-            'Leo': '獅子座 - 創造的で自信に満ちている',
-            'Virgo': '乙女座 - 分析的で完璧主義',
-            'Libra': '天秤座 - バランス感覚があり、調和を求める',
-            'Scorpio': '蠍座 - 神秘的で情熱的',
-            'Sagittarius': '射手座 - 冒険的で哲学的な思考',
-            'Capricorn': '山羊座 - 責任感が強く、目標志向',
-            'Aquarius': '水瓶座 - 革新的で独立心が強い',
-            'Pisces': '魚座 - 直感的で共感力が高い'
-        }
+        self.sign_meanings = SIGN_MEANINGS
         
         # 星座シンボルマッピング（短縮形も対応）
         self.sign_symbols = {
@@ -48,18 +39,7 @@ class HoroscopeCalculator:
             'Pisces': '♓', 'Pis': '♓'
         }
         
-        self.planet_meanings = {
-            'Sun': '太陽 - 基本的な性格とアイデンティティ',
-            'Moon': '月 - 感情と内面の世界',
-            'Mercury': '水星 - コミュニケーションと思考',
-            'Venus': '金星 - 愛と美、価値観',
-            'Mars': '火星 - 行動力と情熱',
-            'Jupiter': '木星 - 成長と拡張',
-            'Saturn': '土星 - 制限と責任',
-            'Uranus': '天王星 - 変化と革新',
-            'Neptune': '海王星 - 直感とスピリチュアル',
-            'Pluto': '冥王星 - 変容と再生'
-        }
+        self.planet_meanings = PLANET_MEANINGS
     
     def _get_japanese_sign_name(self, english_sign: str) -> str:
         """英語の星座名を日本語に変換"""
@@ -293,7 +273,10 @@ class HoroscopeCalculator:
         )
     
     def calculate_horoscope(self, profile_data: Dict[str, Any], target_date: str = None) -> Dict[str, Any]:
-        """ホロスコープを計算（トランジット法対応）"""
+        """ホロスコープを計算（トランジット法対応、バッチ処理中は同じ出生データの出生図を1回だけ計算する）"""
+        return memoized('natal_chart', birth_key(profile_data, target_date), lambda: self._calculate_horoscope(profile_data, target_date))
+    
+    def _calculate_horoscope(self, profile_data: Dict[str, Any], target_date: str = None) -> Dict[str, Any]:
         try:
             # 生年月日と時刻を取得
             birth_date = profile_data.get('birth_date', '')
@@ -422,6 +405,7 @@ class HoroscopeCalculator:
             
         except Exception as e:
             print(f"ホロスコープ計算エラー: {e}")
+            record_degraded('horoscope_calculation')
             return self._get_default_horoscope()
     
     def _calculate_aspects(self, k: AstrologicalSubject) -> List[Dict[str, Any]]:
@@ -496,7 +480,10 @@ class HoroscopeCalculator:
         }
     
     def calculate_transit_horoscope(self, profile_data: Dict[str, Any], target_date: str) -> Dict[str, Any]:
-        """トランジット法でホロスコープを計算（特定の時点での惑星位置）"""
+        """トランジット法でホロスコープを計算（特定の時点での惑星位置、バッチ処理中は同じ出生データ・対象日時で1回だけ計算する）"""
+        return memoized('transit_chart', birth_key(profile_data, target_date), lambda: self._calculate_transit_horoscope(profile_data, target_date))
+    
+    def _calculate_transit_horoscope(self, profile_data: Dict[str, Any], target_date: str) -> Dict[str, Any]:
         try:
             # 生年月日と時刻を取得
             birth_date = profile_data.get('birth_date', '')
@@ -725,6 +712,7 @@ class HoroscopeCalculator:
             print(f"トランジット計算エラー: {e}")
             import traceback
             traceback.print_exc()
+            record_degraded('transit_calculation')
             return self._get_default_transit_result(profile_data, target_date)
     
     def _calculate_transit_aspects(self, natal_planets: Dict, transit_planets: Dict) -> List[Dict]:
@@ -790,8 +778,8 @@ class HoroscopeCalculator:
             'calculation_type': 'transit'
         }
     
-    def get_compatibility_analysis(self, profile1_data: Dict[str, Any], profile2_data: Dict[str, Any], consultation: str = "") -> Dict[str, Any]:
-        """相性分析を生成"""
+    def get_compatibility_analysis(self, profile1_data: Dict[str, Any], profile2_data: Dict[str, Any], consultation: str = "", include_ai: bool = True) -> Dict[str, Any]:
+        """相性分析を生成（include_ai=Falseの場合はAIを呼ばずにアルゴリズムのスコアと定型文を使用）"""
         horoscope1 = self.calculate_horoscope(profile1_data)
         horoscope2 = self.calculate_horoscope(profile2_data)
         
@@ -804,25 +792,31 @@ class HoroscopeCalculator:
             'consultation': consultation
         }
         
-        try:
-            from ai_analysis import AIAnalysisGenerator
-            ai_generator = AIAnalysisGenerator()
-            compatibility_score = ai_generator.generate_ai_compatibility_score(compatibility_data, 'horoscope')
-        except Exception as e:
-            print(f"AI score generation failed, using fallback: {e}")
-            # フォールバック: 改善されたアルゴリズム
+        if include_ai:
+            try:
+                from ai_analysis import AIAnalysisGenerator
+                ai_generator = AIAnalysisGenerator()
+                compatibility_score = ai_generator.generate_ai_compatibility_score(compatibility_data, 'horoscope')
+            except Exception as e:
+                print(f"AI score generation failed, using fallback: {e}")
+                # フォールバック: 改善されたアルゴリズム
+                compatibility_score = self._calculate_enhanced_compatibility_score(horoscope1, horoscope2, consultation)
+        else:
             compatibility_score = self._calculate_enhanced_compatibility_score(horoscope1, horoscope2, consultation)
         
         # AI分析を生成
         compatibility_data['compatibility_score'] = compatibility_score
         compatibility_data['fortune_type'] = 'horoscope'
         
-        try:
-            from ai_analysis import AIAnalysisGenerator
-            ai_generator = AIAnalysisGenerator()
-            analysis = ai_generator.generate_compatibility_analysis(compatibility_data, 'horoscope', consultation)
-        except Exception as e:
-            print(f"AI analysis failed, using fallback: {e}")
+        analysis = None
+        if include_ai:
+            try:
+                from ai_analysis import AIAnalysisGenerator
+                ai_generator = AIAnalysisGenerator()
+                analysis = ai_generator.generate_compatibility_analysis(compatibility_data, 'horoscope', consultation)
+            except Exception as e:
+                print(f"AI analysis failed, using fallback: {e}")
+        if analysis is None:
             analysis = self._generate_compatibility_text_with_nicknames(horoscope1, horoscope2, compatibility_score, profile1_data.get('nickname', 'あなた'), profile2_data.get('nickname', '相手'), consultation)
         
         # 日本語の星座名を追加
@@ -850,27 +844,12 @@ class HoroscopeCalculator:
         moon_sign1 = self._convert_sign_name(horoscope1.get('moon_sign', 'Cancer'))
         moon_sign2 = self._convert_sign_name(horoscope2.get('moon_sign', 'Cancer'))
         
-        # 星座の相性マトリックス（簡略版）
-        compatibility_matrix = {
-            'Aries': {'Aries': 60, 'Leo': 90, 'Sagittarius': 85, 'Gemini': 70, 'Aquarius': 75, 'Cancer': 40, 'Scorpio': 45, 'Pisces': 50, 'Taurus': 35, 'Virgo': 40, 'Capricorn': 45, 'Libra': 65},
-            'Taurus': {'Taurus': 65, 'Virgo': 90, 'Capricorn': 85, 'Cancer': 70, 'Pisces': 75, 'Aries': 35, 'Leo': 40, 'Sagittarius': 45, 'Gemini': 50, 'Libra': 40, 'Aquarius': 45, 'Scorpio': 60},
-            'Gemini': {'Gemini': 60, 'Libra': 90, 'Aquarius': 85, 'Aries': 70, 'Leo': 75, 'Cancer': 45, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 50, 'Virgo': 45, 'Capricorn': 40, 'Sagittarius': 65},
-            'Cancer': {'Cancer': 65, 'Scorpio': 90, 'Pisces': 85, 'Taurus': 70, 'Virgo': 75, 'Aries': 40, 'Leo': 45, 'Sagittarius': 40, 'Gemini': 45, 'Libra': 50, 'Aquarius': 40, 'Capricorn': 60},
-            'Leo': {'Leo': 60, 'Aries': 90, 'Sagittarius': 85, 'Gemini': 70, 'Libra': 75, 'Cancer': 45, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 40, 'Virgo': 45, 'Capricorn': 40, 'Aquarius': 65},
-            'Virgo': {'Virgo': 65, 'Taurus': 90, 'Capricorn': 85, 'Cancer': 70, 'Scorpio': 75, 'Aries': 40, 'Leo': 45, 'Sagittarius': 40, 'Gemini': 45, 'Libra': 50, 'Aquarius': 40, 'Pisces': 60},
-            'Libra': {'Libra': 60, 'Gemini': 90, 'Aquarius': 85, 'Leo': 70, 'Sagittarius': 75, 'Cancer': 50, 'Scorpio': 45, 'Pisces': 40, 'Taurus': 40, 'Virgo': 50, 'Capricorn': 45, 'Aries': 65},
-            'Scorpio': {'Scorpio': 65, 'Cancer': 90, 'Pisces': 85, 'Virgo': 70, 'Capricorn': 75, 'Aries': 45, 'Leo': 40, 'Sagittarius': 35, 'Gemini': 40, 'Libra': 45, 'Aquarius': 40, 'Taurus': 60},
-            'Sagittarius': {'Sagittarius': 60, 'Aries': 90, 'Leo': 85, 'Libra': 70, 'Aquarius': 75, 'Cancer': 40, 'Scorpio': 35, 'Pisces': 40, 'Taurus': 45, 'Virgo': 40, 'Capricorn': 45, 'Gemini': 65},
-            'Capricorn': {'Capricorn': 65, 'Taurus': 90, 'Virgo': 85, 'Scorpio': 70, 'Pisces': 75, 'Aries': 45, 'Leo': 40, 'Sagittarius': 45, 'Gemini': 40, 'Libra': 45, 'Aquarius': 40, 'Cancer': 60},
-            'Aquarius': {'Aquarius': 60, 'Gemini': 90, 'Libra': 85, 'Sagittarius': 70, 'Aries': 75, 'Cancer': 40, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 45, 'Virgo': 40, 'Capricorn': 40, 'Leo': 65},
-            'Pisces': {'Pisces': 65, 'Cancer': 90, 'Scorpio': 85, 'Capricorn': 70, 'Taurus': 75, 'Aries': 50, 'Leo': 35, 'Sagittarius': 40, 'Gemini': 35, 'Libra': 40, 'Aquarius': 35, 'Virgo': 60}
-        }
         
         # 太陽星座の相性スコア
-        sun_score = compatibility_matrix.get(sun_sign1, {}).get(sun_sign2, 50)
+        sun_score = SIGN_COMPATIBILITY.get(sun_sign1, {}).get(sun_sign2, 50)
         
         # 月星座の相性スコア
-        moon_score = compatibility_matrix.get(moon_sign1, {}).get(moon_sign2, 50)
+        moon_score = SIGN_COMPATIBILITY.get(moon_sign1, {}).get(moon_sign2, 50)
         
         # 太陽星座70%、月星座30%の重みで計算
         final_score = int((sun_score * 0.7) + (moon_score * 0.3))
@@ -970,45 +949,18 @@ class HoroscopeCalculator:
         moon_sign1 = self._convert_sign_name(horoscope1.get('moon_sign', 'Cancer'))
         moon_sign2 = self._convert_sign_name(horoscope2.get('moon_sign', 'Cancer'))
         
-        # 星座の相性マトリックス（拡張版）
-        compatibility_matrix = {
-            'Aries': {'Aries': 60, 'Leo': 90, 'Sagittarius': 85, 'Gemini': 70, 'Aquarius': 75, 'Cancer': 40, 'Scorpio': 45, 'Pisces': 50, 'Taurus': 35, 'Virgo': 40, 'Capricorn': 45, 'Libra': 65},
-            'Taurus': {'Taurus': 65, 'Virgo': 90, 'Capricorn': 85, 'Cancer': 70, 'Pisces': 75, 'Aries': 35, 'Leo': 40, 'Sagittarius': 45, 'Gemini': 50, 'Libra': 40, 'Aquarius': 45, 'Scorpio': 60},
-            'Gemini': {'Gemini': 60, 'Libra': 90, 'Aquarius': 85, 'Aries': 70, 'Leo': 75, 'Cancer': 45, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 50, 'Virgo': 45, 'Capricorn': 40, 'Sagittarius': 65},
-            'Cancer': {'Cancer': 65, 'Scorpio': 90, 'Pisces': 85, 'Taurus': 70, 'Virgo': 75, 'Aries': 40, 'Leo': 45, 'Sagittarius': 40, 'Gemini': 45, 'Libra': 50, 'Aquarius': 40, 'Capricorn': 60},
-            'Leo': {'Leo': 60, 'Aries': 90, 'Sagittarius': 85, 'Gemini': 70, 'Libra': 75, 'Cancer': 45, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 40, 'Virgo': 45, 'Capricorn': 40, 'Aquarius': 65},
-            'Virgo': {'Virgo': 65, 'Taurus': 90, 'Capricorn': 85, 'Cancer': 70, 'Scorpio': 75, 'Aries': 40, 'Leo': 45, 'Sagittarius': 40, 'Gemini': 45, 'Libra': 50, 'Aquarius': 40, 'Pisces': 60},
-            'Libra': {'Libra': 60, 'Gemini': 90, 'Aquarius': 85, 'Leo': 70, 'Sagittarius': 75, 'Cancer': 50, 'Scorpio': 45, 'Pisces': 40, 'Taurus': 40, 'Virgo': 50, 'Capricorn': 45, 'Aries': 65},
-            'Scorpio': {'Scorpio': 65, 'Cancer': 90, 'Pisces': 85, 'Virgo': 70, 'Capricorn': 75, 'Aries': 45, 'Leo': 40, 'Sagittarius': 35, 'Gemini': 40, 'Libra': 45, 'Aquarius': 40, 'Taurus': 60},
-            'Sagittarius': {'Sagittarius': 60, 'Aries': 90, 'Leo': 85, 'Libra': 70, 'Aquarius': 75, 'Cancer': 40, 'Scorpio': 35, 'Pisces': 40, 'Taurus': 45, 'Virgo': 40, 'Capricorn': 45, 'Gemini': 65},
-            'Capricorn': {'Capricorn': 65, 'Taurus': 90, 'Virgo': 85, 'Scorpio': 70, 'Pisces': 75, 'Aries': 45, 'Leo': 40, 'Sagittarius': 45, 'Gemini': 40, 'Libra': 45, 'Aquarius': 40, 'Cancer': 60},
-            'Aquarius': {'Aquarius': 60, 'Gemini': 90, 'Libra': 85, 'Sagittarius': 70, 'Aries': 75, 'Cancer': 40, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 45, 'Virgo': 40, 'Capricorn': 40, 'Leo': 65},
-            'Pisces': {'Pisces': 65, 'Cancer': 90, 'Scorpio': 85, 'Capricorn': 70, 'Taurus': 75, 'Aries': 50, 'Leo': 35, 'Sagittarius': 40, 'Gemini': 35, 'Libra': 40, 'Aquarius': 35, 'Virgo': 60}
-        }
         
         # 太陽星座の相性スコア
-        sun_score = compatibility_matrix.get(sun_sign1, {}).get(sun_sign2, 50)
+        sun_score = SIGN_COMPATIBILITY.get(sun_sign1, {}).get(sun_sign2, 50)
         
         # 月星座の相性スコア
-        moon_score = compatibility_matrix.get(moon_sign1, {}).get(moon_sign2, 50)
+        moon_score = SIGN_COMPATIBILITY.get(moon_sign1, {}).get(moon_sign2, 50)
         
         # 太陽星座70%、月星座30%の重みで計算
         base_score = int((sun_score * 0.7) + (moon_score * 0.3))
         
-        # 相談内容による調整
-        consultation_bonus = 0
-        if consultation and consultation.strip():
-            if "恋愛" in consultation or "恋" in consultation:
-                consultation_bonus = 5  # 恋愛相談は少しボーナス
-            elif "結婚" in consultation or "婚" in consultation:
-                consultation_bonus = 3  # 結婚相談は少しボーナス
-            elif "友情" in consultation or "友" in consultation:
-                consultation_bonus = 2  # 友情相談は少しボーナス
-            elif "仕事" in consultation or "職" in consultation:
-                consultation_bonus = 1  # 仕事相談は少しボーナス
-        
-        # 最終スコアを計算
-        final_score = base_score + consultation_bonus
+        # 相談内容による調整を加えて最終スコアを計算
+        final_score = base_score + consultation_bonus(consultation)
         
         # スコアを20-100の範囲に調整
         return max(20, min(100, final_score))
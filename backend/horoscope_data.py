@@ -0,0 +1,125 @@
+"""
+西洋占星術データ
+星座・惑星の意味テーブル（計算クラス・AI分析・テンプレート鑑定文で共通）
+"""
+
+from typing import Dict, Tuple
+
+# 星座の意味
+SIGN_MEANINGS: Dict[str, str] = {
+    'Aries': '牡羊座 - 情熱的でリーダーシップがある',
+    'Taurus': '牡牛座 - 安定感があり、実用的',
+    'Gemini': '双子座 - 好奇心旺盛でコミュニケーション能力が高い',
+    'Cancer': '蟹座 - 感情的で家族を大切にする',
+    'Leo': '獅子座 - 創造的で自信に満ちている',
+    'Virgo': '乙女座 - 分析的で完璧主義',
+    'Libra': '天秤座 - バランス感覚があり、調和を求める',
+    'Scorpio': '蠍座 - 神秘的で情熱的',
+    'Sagittarius': '射手座 - 冒険的で哲学的な思考',
+    'Capricorn': '山羊座 - 責任感が強く、目標志向',
+    'Aquarius': '水瓶座 - 革新的で独立心が強い',
+    'Pisces': '魚座 - 直感的で共感力が高い'
+}
+
+# 星座ごとの人生の傾向（鑑定文用）
+SIGN_ANALYSES: Dict[str, str] = {
+    'Aries': "情熱的でリーダーシップに満ちた人生が待っています。新しい挑戦を恐れず、積極的に行動していきましょう。",
+    'Taurus': "安定感と実用性を重視する人生です。着実に努力を重ね、美しいものを大切にしていきましょう。",
+    'Gemini': "好奇心旺盛でコミュニケーション能力が高い人生です。新しい知識を学び、多様な人々と交流していきましょう。",
+    'Cancer': "感情的で家族を大切にする人生です。直感を信じ、愛する人々との絆を深めていきましょう。",
+    'Leo': "創造的で自信に満ちた人生が約束されています。自己表現を大切にし、周囲を明るく照らしていきましょう。",
+    'Virgo': "分析的で完璧主義な人生です。細部にこだわり、実用的な解決策を見つけていきましょう。",
+    'Libra': "バランス感覚と調和を求める人生です。美しさと正義を大切にし、平和な関係を築いていきましょう。",
+    'Scorpio': "神秘的で情熱的な人生が待っています。深い洞察力を持ち、真実を追求していきましょう。",
+    'Sagittarius': "冒険的で哲学的な人生です。新しい文化や思想に触れ、人生の意味を探求していきましょう。",
+    'Capricorn': "責任感と目標志向の人生です。長期的な視点を持ち、着実に成功を積み上げていきましょう。",
+    'Aquarius': "革新的で独立心が強い人生です。新しいアイデアを大切にし、社会の進歩に貢献していきましょう。",
+    'Pisces': "直感的で共感力が高い人生です。芸術やスピリチュアルな分野で才能を発揮し、他者を癒していきましょう。"
+}
+
+# 星座の強みとなる性質（鑑定文で「〜を大切に」などと続けられる名詞句）
+SIGN_TRAITS: Dict[str, str] = {
+    'Aries': '情熱と行動力',
+    'Taurus': '安定感と粘り強さ',
+    'Gemini': '好奇心と伝える力',
+    'Cancer': '思いやりと家族への愛情',
+    'Leo': '創造性と自信',
+    'Virgo': '分析力と丁寧さ',
+    'Libra': 'バランス感覚と調和',
+    'Scorpio': '洞察力と一途さ',
+    'Sagittarius': '冒険心と探究心',
+    'Capricorn': '責任感と粘り強い努力',
+    'Aquarius': '独創性と自立心',
+    'Pisces': '直感と共感力'
+}
+
+# 惑星の意味
+PLANET_MEANINGS: Dict[str, str] = {
+    'Sun': '太陽 - 基本的な性格とアイデンティティ',
+    'Moon': '月 - 感情と内面の世界',
+    'Mercury': '水星 - コミュニケーションと思考',
+    'Venus': '金星 - 愛と美、価値観',
+    'Mars': '火星 - 行動力と情熱',
+    'Jupiter': '木星 - 成長と拡張',
+    'Saturn': '土星 - 制限と責任',
+    'Uranus': '天王星 - 変化と革新',
+    'Neptune': '海王星 - 直感とスピリチュアル',
+    'Pluto': '冥王星 - 変容と再生'
+}
+
+# kerykeionの短縮形 → 英語の星座名
+SIGN_ALIASES: Dict[str, str] = {
+    'Ari': 'Aries', 'Tau': 'Taurus', 'Gem': 'Gemini', 'Can': 'Cancer',
+    'Vir': 'Virgo', 'Lib': 'Libra', 'Sco': 'Scorpio', 'Sag': 'Sagittarius',
+    'Cap': 'Capricorn', 'Aqu': 'Aquarius', 'Pis': 'Pisces'
+}
+
+# 星座のエレメント（火・地・風・水）
+SIGN_ELEMENTS: Dict[str, str] = {
+    'Aries': '火', 'Leo': '火', 'Sagittarius': '火',
+    'Taurus': '地', 'Virgo': '地', 'Capricorn': '地',
+    'Gemini': '風', 'Libra': '風', 'Aquarius': '風',
+    'Cancer': '水', 'Scorpio': '水', 'Pisces': '水'
+}
+
+# 星座同士の相性スコア（行: 自分の星座、列: 相手の星座）
+SIGN_COMPATIBILITY: Dict[str, Dict[str, int]] = {
+    'Aries': {'Aries': 60, 'Leo': 90, 'Sagittarius': 85, 'Gemini': 70, 'Aquarius': 75, 'Cancer': 40, 'Scorpio': 45, 'Pisces': 50, 'Taurus': 35, 'Virgo': 40, 'Capricorn': 45, 'Libra': 65},
+    'Taurus': {'Taurus': 65, 'Virgo': 90, 'Capricorn': 85, 'Cancer': 70, 'Pisces': 75, 'Aries': 35, 'Leo': 40, 'Sagittarius': 45, 'Gemini': 50, 'Libra': 40, 'Aquarius': 45, 'Scorpio': 60},
+    'Gemini': {'Gemini': 60, 'Libra': 90, 'Aquarius': 85, 'Aries': 70, 'Leo': 75, 'Cancer': 45, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 50, 'Virgo': 45, 'Capricorn': 40, 'Sagittarius': 65},
+    'Cancer': {'Cancer': 65, 'Scorpio': 90, 'Pisces': 85, 'Taurus': 70, 'Virgo': 75, 'Aries': 40, 'Leo': 45, 'Sagittarius': 40, 'Gemini': 45, 'Libra': 50, 'Aquarius': 40, 'Capricorn': 60},
+    'Leo': {'Leo': 60, 'Aries': 90, 'Sagittarius': 85, 'Gemini': 70, 'Libra': 75, 'Cancer': 45, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 40, 'Virgo': 45, 'Capricorn': 40, 'Aquarius': 65},
+    'Virgo': {'Virgo': 65, 'Taurus': 90, 'Capricorn': 85, 'Cancer': 70, 'Scorpio': 75, 'Aries': 40, 'Leo': 45, 'Sagittarius': 40, 'Gemini': 45, 'Libra': 50, 'Aquarius': 40, 'Pisces': 60},
+    'Libra': {'Libra': 60, 'Gemini': 90, 'Aquarius': 85, 'Leo': 70, 'Sagittarius': 75, 'Cancer': 50, 'Scorpio': 45, 'Pisces': 40, 'Taurus': 40, 'Virgo': 50, 'Capricorn': 45, 'Aries': 65},
+    'Scorpio': {'Scorpio': 65, 'Cancer': 90, 'Pisces': 85, 'Virgo': 70, 'Capricorn': 75, 'Aries': 45, 'Leo': 40, 'Sagittarius': 35, 'Gemini': 40, 'Libra': 45, 'Aquarius': 40, 'Taurus': 60},
+    'Sagittarius': {'Sagittarius': 60, 'Aries': 90, 'Leo': 85, 'Libra': 70, 'Aquarius': 75, 'Cancer': 40, 'Scorpio': 35, 'Pisces': 40, 'Taurus': 45, 'Virgo': 40, 'Capricorn': 45, 'Gemini': 65},
+    'Capricorn': {'Capricorn': 65, 'Taurus': 90, 'Virgo': 85, 'Scorpio': 70, 'Pisces': 75, 'Aries': 45, 'Leo': 40, 'Sagittarius': 45, 'Gemini': 40, 'Libra': 45, 'Aquarius': 40, 'Cancer': 60},
+    'Aquarius': {'Aquarius': 60, 'Gemini': 90, 'Libra': 85, 'Sagittarius': 70, 'Aries': 75, 'Cancer': 40, 'Scorpio': 40, 'Pisces': 35, 'Taurus': 45, 'Virgo': 40, 'Capricorn': 40, 'Leo': 65},
+    'Pisces': {'Pisces': 65, 'Cancer': 90, 'Scorpio': 85, 'Capricorn': 70, 'Taurus': 75, 'Aries': 50, 'Leo': 35, 'Sagittarius': 40, 'Gemini': 35, 'Libra': 40, 'Aquarius': 35, 'Virgo': 60}
+}
+
+# 相談内容のキーワードによる相性スコアの加点（先に一致したものを使う）
+CONSULTATION_BONUSES: Tuple[Tuple[Tuple[str, ...], int], ...] = (
+    (('恋愛', '恋'), 5),  # 恋愛相談は少しボーナス
+    (('結婚', '婚'), 3),  # 結婚相談は少しボーナス
+    (('友情', '友'), 2),  # 友情相談は少しボーナス
+    (('仕事', '職'), 1),  # 仕事相談は少しボーナス
+)
+
+
+def consultation_bonus(consultation: str) -> int:
+    """相談内容による相性スコアの加点"""
+    if not consultation or not consultation.strip():
+        return 0
+    return next((bonus for keywords, bonus in CONSULTATION_BONUSES if any(keyword in consultation for keyword in keywords)), 0)
+
+
+def normalize_sign(sign: str) -> str:
+    """短縮形の星座名を英語の星座名にそろえる"""
+    return SIGN_ALIASES.get(sign, sign)
+
+
+def japanese_sign_name(sign: str) -> str:
+    """星座の日本語名（「牡羊座 - ...」の先頭部分）"""
+    meaning = SIGN_MEANINGS.get(normalize_sign(sign))
+    return meaning.split(' - ')[0] if meaning else sign
@@ -0,0 +1,50 @@
+"""
+西洋占星術の相性スコアテーブル
+星座同士の相性表を12x12の配列として保持し、N人分の太陽・月星座から全ペアのスコアを一度に算出する
+（HoroscopeCalculator._calculate_enhanced_compatibility_score と同じ計算）
+"""
+
+import numpy as np
+from typing import Dict, Any, List, Tuple
+
+from horoscope_data import SIGN_COMPATIBILITY, normalize_sign, consultation_bonus
+
+# 表の行・列の並び
+SIGNS: Tuple[str, ...] = tuple(SIGN_COMPATIBILITY)
+_INDEX = {sign: index for index, sign in enumerate(SIGNS)}
+
+SUN_WEIGHT = 0.7
+MOON_WEIGHT = 0.3
+DEFAULT_PAIR_SCORE = 50  # 表にない組み合わせ
+MIN_SCORE = 20
+MAX_SCORE = 100
+
+
+class SignScoreTable:
+    """星座の相性スコアテーブル（[i, j] は星座iの人から見た星座jの人との相性）"""
+
+    def __init__(self):
+        self.table = np.full((len(SIGNS), len(SIGNS)), DEFAULT_PAIR_SCORE, dtype=np.int16)
+        for sign, row in SIGN_COMPATIBILITY.items():
+            for other, score in row.items():
+                self.table[_INDEX[sign], _INDEX[other]] = score
+        self.table.setflags(write=False)
+
+    @staticmethod
+    def _index(sign: str, default: str) -> int:
+        """星座名（短縮形も可）を表のインデックスへ（不明な星座はHoroscopeCalculatorと同じく牡羊座として扱う）"""
+        return _INDEX.get(normalize_sign(sign or default), _INDEX['Aries'])
+
+    def matrix(self, horoscopes: List[Dict[str, Any]], consultation: str = "") -> np.ndarray:
+        """N人分のホロスコープから、全ペアの相性スコアを (N, N) のint配列として一度に算出"""
+        suns = np.array([self._index(horoscope.get('sun_sign'), 'Aries') for horoscope in horoscopes], dtype=np.intp)
+        moons = np.array([self._index(horoscope.get('moon_sign'), 'Cancer') for horoscope in horoscopes], dtype=np.intp)
+        sun_scores = self.table[suns[:, None], suns[None, :]]
+        moon_scores = self.table[moons[:, None], moons[None, :]]
+        # 太陽星座70%、月星座30%の重みで計算し（小数点以下は切り捨て）、相談内容による加点を加える
+        base = np.floor(sun_scores * SUN_WEIGHT + moon_scores * MOON_WEIGHT).astype(np.int32)
+        return np.clip(base + consultation_bonus(consultation), MIN_SCORE, MAX_SCORE)
+
+
+# 起動時に一度だけ構築する共有テーブル
+sign_score_table = SignScoreTable()
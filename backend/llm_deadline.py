@@ -0,0 +1,85 @@
+"""
+LLM呼び出しの期限管理
+待機側のタイムアウトを期限としてコンテキストに設定し、スレッドプール・ヘッジ・スケジューラーを経由して
+実際のHTTP呼び出しのタイムアウトまで引き継ぐ（期限を過ぎた呼び出しは待ち続けずに中断される）
+ヘッジで負けた呼び出しなど結果が不要になったものは、キャンセルイベントでスケジューラーの待機・HTTP呼び出しの開始前に打ち切る
+"""
+
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# これより短い残り時間ではプロバイダーを呼ばない（短すぎるタイムアウトでの失敗をプロバイダーの不調と誤認しないため）
+MIN_CALL_TIMEOUT = float(os.getenv('LLM_MIN_CALL_TIMEOUT', '1.0'))
+
+# 現在の呼び出しの期限（time.monotonic()基準、スレッドプールへはcopy_contextで引き継ぐ）
+_current_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar('llm_call_deadline', default=None)
+
+# 現在の呼び出しのキャンセルイベント（セットされたら以降のLLM呼び出しを開始しない）
+_current_cancel: contextvars.ContextVar[threading.Event | None] = contextvars.ContextVar('llm_call_cancel', default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """期限までにLLM呼び出しを開始・完了できないことを示す例外"""
+    pass
+
+
+class CallCancelledError(RuntimeError):
+    """呼び出し元が結果を必要としなくなったため、LLM呼び出しを開始せずに打ち切ったことを示す例外"""
+    pass
+
+
+@contextmanager
+def call_deadline(timeout: float):
+    """このコンテキスト内のLLM呼び出しに期限を設定（外側の期限より延ばすことはない）"""
+    deadline = time.monotonic() + timeout
+    outer = _current_deadline.get()
+    token = _current_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+@contextmanager
+def call_cancellation(event: threading.Event):
+    """このコンテキスト内のLLM呼び出しをeventがセットされた時点で打ち切れるようにする"""
+    token = _current_cancel.set(event)
+    try:
+        yield
+    finally:
+        _current_cancel.reset(token)
+
+
+def is_cancelled() -> bool:
+    """現在の呼び出しがキャンセル済みか"""
+    event = _current_cancel.get()
+    return event is not None and event.is_set()
+
+
+def raise_if_cancelled():
+    """キャンセル済みならCallCancelledErrorを送出"""
+    if is_cancelled():
+        raise CallCancelledError("LLM call cancelled before dispatch")
+
+
+def remaining_time(default: float) -> float:
+    """期限までの残り時間（期限がなければdefault、defaultより長くはしない）"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    return min(default, deadline - time.monotonic())
+
+
+def call_timeout(default: float) -> float:
+    """
+    プロバイダー呼び出しに使うHTTPタイムアウト
+    キャンセル済みならCallCancelledError、残り時間が足りなければDeadlineExceededErrorを送出
+    """
+    raise_if_cancelled()
+    timeout = remaining_time(default)
+    if timeout < MIN_CALL_TIMEOUT:
+        raise DeadlineExceededError(f"LLM call deadline exceeded ({max(timeout, 0.0):.2f}s left)")
+    return timeout
@@ -0,0 +1,180 @@
+"""
+LLMプロバイダーのヘルス管理
+サーキットブレーカー（closed / open / half_open）とEWMAによるレイテンシ・エラー率の追跡
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Any, List, Callable
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ProviderUnavailableError(Exception):
+    """サーキットが開いているためプロバイダーを呼び出さなかったことを示す例外"""
+    pass
+
+
+class ProviderHealth:
+    """単一プロバイダーのヘルス状態"""
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float, alpha: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.ewma_latency: float | None = None
+        self.ewma_error_rate = 0.0
+        self.total_calls = 0
+        self.total_failures = 0
+        self._lock = threading.Lock()
+
+    def _update_ewma(self, latency: float, failed: bool):
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+        self.ewma_error_rate = self.alpha * (1.0 if failed else 0.0) + (1 - self.alpha) * self.ewma_error_rate
+
+    def is_available(self) -> bool:
+        """呼び出し可能か（状態を変更しない判定）"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self.probe_in_flight
+
+    def try_acquire(self) -> bool:
+        """呼び出し許可を取得（open状態でクールダウン経過後はhalf_openとして1件のみプローブを許可）"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def release(self):
+        """呼び出さずに終えた場合にプローブの許可を返す（レート制限の待機切れなどはプロバイダーの失敗に数えない）"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.total_calls += 1
+            self._update_ewma(latency, failed=False)
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                print(f"LLMプロバイダー回復: {self.name}（サーキットclosed）")
+            self.state = CLOSED
+            self.probe_in_flight = False
+
+    def record_failure(self, latency: float):
+        with self._lock:
+            self.total_calls += 1
+            self.total_failures += 1
+            self._update_ewma(latency, failed=True)
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"LLMプロバイダー遮断: {self.name}（連続失敗{self.consecutive_failures}回、サーキットopen）")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+
+    def score(self, default_latency: float) -> float:
+        """ルーティング用のスコア（小さいほど健全）"""
+        with self._lock:
+            latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+            return latency * (1.0 + 4.0 * self.ewma_error_rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+                'ewma_error_rate': round(self.ewma_error_rate, 4),
+                'total_calls': self.total_calls,
+                'total_failures': self.total_failures
+            }
+
+
+class ProviderHealthRegistry:
+    """全プロバイダーのヘルス状態を管理し、最も健全なプロバイダーへルーティングする"""
+
+    def __init__(self):
+        self.failure_threshold = int(os.getenv('LLM_BREAKER_FAILURES', '3'))
+        self.cooldown = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+        self.alpha = float(os.getenv('LLM_HEALTH_EWMA_ALPHA', '0.2'))
+        self.default_latency = float(os.getenv('LLM_HEALTH_DEFAULT_LATENCY', '5.0'))
+        self.timeout_multiplier = float(os.getenv('LLM_TIMEOUT_MULTIPLIER', '4.0'))
+        self.timeout_floor = float(os.getenv('LLM_TIMEOUT_FLOOR', '8.0'))
+        self._providers: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> ProviderHealth:
+        with self._lock:
+            if name not in self._providers:
+                self._providers[name] = ProviderHealth(name, self.failure_threshold, self.cooldown, self.alpha)
+            return self._providers[name]
+
+    def rank(self, names: List[str]) -> List[str]:
+        """呼び出し可能なプロバイダーを健全な順に並べる（サーキットが開いているものは除外）"""
+        available = [name for name in names if self.get(name).is_available()]
+        # 同スコアの場合は指定順（優先順）を維持
+        return sorted(available, key=lambda name: self.get(name).score(self.default_latency))
+
+    def admit(self, name: str) -> ProviderHealth:
+        """サーキットブレーカーの呼び出し許可を取得（open・プローブ中ならProviderUnavailableErrorを送出）"""
+        health = self.get(name)
+        if not health.try_acquire():
+            raise ProviderUnavailableError(f"{name} circuit is open")
+        return health
+
+    def call(self, name: str, fn: Callable[[], str]) -> str:
+        """サーキットブレーカーを通してプロバイダーを呼び出す"""
+        return self.call_admitted(self.admit(name), fn)
+
+    def call_admitted(self, health: ProviderHealth, fn: Callable[[], str]) -> str:
+        """admitで許可を得たプロバイダーを呼び出し、結果をヘルス状態に記録する"""
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception:
+            health.record_failure(time.monotonic() - started)
+            raise
+        health.record_success(time.monotonic() - started)
+        return result
+
+    def suggest_timeout(self, names: List[str], default: float) -> float:
+        """健全なプロバイダーのEWMAレイテンシから待機時間を算出（全滅時は0）"""
+        ranked = self.rank(names)
+        if not ranked:
+            return 0.0
+        latency = self.get(ranked[0]).ewma_latency
+        if latency is None:
+            return default
+        return min(default, max(self.timeout_floor, latency * self.timeout_multiplier))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            providers = dict(self._providers)
+        return {name: health.snapshot() for name, health in providers.items()}
+
+
+# プロセス全体で共有するヘルスレジストリ
+provider_health = ProviderHealthRegistry()
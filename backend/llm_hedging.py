@@ -0,0 +1,261 @@
+"""
+LLMヘッジリクエスト機能
+プライマリが一定のパーセンタイル遅延を超えても応答しない場合にセカンダリを並列発行する
+負けた側へはキャンセルイベントを送り、スケジューラーの待機中やHTTP呼び出しの開始前であればそこで打ち切る
+（すでに送信済みのHTTP呼び出しは中断できないため、期限（HTTPタイムアウト）まで実行して結果を破棄する）
+"""
+
+import os
+import threading
+import time
+import contextvars
+import concurrent.futures
+from collections import deque
+from typing import Dict, Any, Callable, Tuple
+from llm_deadline import CallCancelledError, call_cancellation
+
+
+class LatencyWindow:
+    """プロバイダーごとの直近レイテンシを保持するスライディングウィンドウ"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float) -> float | None:
+        """指定パーセンタイルのレイテンシ（秒）を返す。サンプルがなければNone"""
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+
+class HedgePolicy:
+    """ヘッジ発行のタイミングを決めるポリシー（環境変数で調整可能）"""
+
+    def __init__(self):
+        self.percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+        self.min_samples = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+        self.default_delay = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '6.0'))
+        self.min_delay = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+        self.max_delay = float(os.getenv('LLM_HEDGE_MAX_DELAY', '12.0'))
+
+    def hedge_delay(self, window: LatencyWindow) -> float:
+        """プライマリのレイテンシ分布からヘッジまでの待機秒数を算出"""
+        if window.count() < self.min_samples:
+            return self.default_delay
+        delay = window.percentile(self.percentile)
+        return max(self.min_delay, min(self.max_delay, delay))
+
+
+class HedgeStats:
+    """ヘッジ発行率と勝敗の統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.secondary_wins = 0
+        # セカンダリの勝ちのうち、ヘッジ発行（プライマリ応答待ち中の並列発行）によるもの
+        self.hedge_wins = 0
+        self.failures = 0
+        # 負けた側の結末（未開始で取り消し・HTTP呼び出し前に打ち切り・HTTP呼び出しを最後まで実行）
+        self.losers = {'not_started': 0, 'cancelled_before_dispatch': 0, 'ran_to_completion': 0}
+
+    def record(self, hedged: bool, winner: str | None):
+        with self._lock:
+            self.requests += 1
+            if hedged:
+                self.hedged += 1
+            if winner == 'primary':
+                self.primary_wins += 1
+            elif winner == 'secondary':
+                self.secondary_wins += 1
+                if hedged:
+                    self.hedge_wins += 1
+            else:
+                self.failures += 1
+
+    def record_loser(self, outcome: str):
+        with self._lock:
+            self.losers[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.requests
+            return {
+                'requests': requests,
+                'hedged': self.hedged,
+                'hedge_rate': round(self.hedged / requests, 4) if requests else 0.0,
+                'primary_wins': self.primary_wins,
+                'secondary_wins': self.secondary_wins,
+                # プライマリ失敗後の切り替えによる勝ちは含めない
+                'secondary_win_rate': round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0,
+                'failover_wins': self.secondary_wins - self.hedge_wins,
+                'failures': self.failures,
+                'losers': dict(self.losers)
+            }
+
+
+class HedgedExecutor:
+    """ヘッジリクエストの実行エンジン"""
+
+    def __init__(self, max_workers: int = 8):
+        self.policy = HedgePolicy()
+        self.stats = HedgeStats()
+        self._windows: Dict[str, LatencyWindow] = {}
+        self._windows_lock = threading.Lock()
+        # 呼び出し元のスレッドプールとは別にする（同じプール内で待機するとデッドロックするため）
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-hedge')
+
+    def window(self, provider: str) -> LatencyWindow:
+        with self._windows_lock:
+            if provider not in self._windows:
+                self._windows[provider] = LatencyWindow()
+            return self._windows[provider]
+
+    def _timed(self, provider: str, fn: Callable[[], str]) -> Callable[[], str]:
+        """成功時のレイテンシをウィンドウに記録するラッパー"""
+        def run():
+            started = time.monotonic()
+            result = fn()
+            self.window(provider).add(time.monotonic() - started)
+            return result
+        return run
+
+    def _submit(self, provider: str, fn: Callable[[], str], cancel: threading.Event) -> concurrent.futures.Future:
+        """呼び出し元のコンテキスト（優先度・期限など）を引き継ぎ、cancelで打ち切れるようにして実行"""
+        timed = self._timed(provider, fn)
+
+        def leg():
+            with call_cancellation(cancel):
+                return timed()
+        return self._executor.submit(contextvars.copy_context().run, leg)
+
+    def _abandon(self, future: concurrent.futures.Future, cancel: threading.Event):
+        """
+        結果が不要になった呼び出しを打ち切る。
+        未開始なら取り消し、実行中ならキャンセルイベントでスケジューラーの待機・HTTP呼び出しの開始を止める
+        （送信済みのHTTP呼び出しは期限まで実行されるため、結末は完了時に集計する）
+        """
+        cancel.set()
+        if future.cancel():
+            self.stats.record_loser('not_started')
+            return
+
+        def count(done: concurrent.futures.Future):
+            cancelled = isinstance(done.exception(), CallCancelledError)
+            self.stats.record_loser('cancelled_before_dispatch' if cancelled else 'ran_to_completion')
+        future.add_done_callback(count)
+
+    def run(self, primary: Tuple[str, Callable[[], str]], secondary: Tuple[str, Callable[[], str]] | None, timeout: float) -> str:
+        """
+        プライマリを発行し、ヘッジ遅延までに応答がなければセカンダリも発行する。
+        先に成功した方の結果を返し、負けた方は_abandonで打ち切る（送信済みのHTTP呼び出しは期限まで続く）。
+        両方失敗した場合は最後の例外を送出。
+        """
+        primary_name, primary_fn = primary
+        deadline = time.monotonic() + timeout
+        cancels: Dict[concurrent.futures.Future, threading.Event] = {}
+
+        def submit(provider: str, fn: Callable[[], str]) -> concurrent.futures.Future:
+            cancel = threading.Event()
+            future = self._submit(provider, fn, cancel)
+            cancels[future] = cancel
+            return future
+
+        futures = {submit(primary_name, primary_fn): 'primary'}
+
+        if secondary is None:
+            future = next(iter(futures))
+            try:
+                result = future.result(timeout=timeout)
+                self.stats.record(False, 'primary')
+                return result
+            except concurrent.futures.TimeoutError:
+                self._abandon(future, cancels[future])
+                self.stats.record(False, None)
+                raise
+            except Exception:
+                self.stats.record(False, None)
+                raise
+
+        secondary_name, secondary_fn = secondary
+        delay = self.policy.hedge_delay(self.window(primary_name))
+        done, _ = concurrent.futures.wait(futures, timeout=min(delay, timeout))
+
+        hedged = False
+        last_error: BaseException | None = None
+        if done:
+            future = next(iter(done))
+            if future.exception() is None:
+                self.stats.record(False, 'primary')
+                return future.result()
+            last_error = future.exception()
+            print(f"プライマリ({primary_name})失敗、セカンダリへ切り替え: {last_error}")
+            futures = {}
+        else:
+            print(f"プライマリ({primary_name})が{delay:.2f}秒応答なし、セカンダリ({secondary_name})をヘッジ発行")
+            hedged = True
+
+        futures[submit(secondary_name, secondary_fn)] = 'secondary'
+
+        while futures:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = concurrent.futures.wait(futures, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                role = futures.pop(future)
+                if future.exception() is None:
+                    for loser in futures:
+                        self._abandon(loser, cancels[loser])
+                    self.stats.record(hedged, role)
+                    return future.result()
+                last_error = future.exception()
+
+        for future in futures:
+            self._abandon(future, cancels[future])
+        self.stats.record(hedged, None)
+        if last_error is not None:
+            raise last_error
+        raise concurrent.futures.TimeoutError(f"LLM hedged request timed out after {timeout}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヘッジ統計とプロバイダー別レイテンシを返す"""
+        stats = self.stats.snapshot()
+        with self._windows_lock:
+            windows = dict(self._windows)
+        stats['policy'] = {
+            'percentile': self.policy.percentile,
+            'default_delay': self.policy.default_delay,
+            'min_delay': self.policy.min_delay,
+            'max_delay': self.policy.max_delay
+        }
+        stats['latency'] = {
+            name: {
+                'samples': window.count(),
+                'p50': window.percentile(50),
+                'p95': window.percentile(95),
+                'hedge_delay': self.policy.hedge_delay(window)
+            }
+            for name, window in windows.items()
+        }
+        return stats
+
+
+# プロセス全体で共有するヘッジ実行エンジン（AIAnalysisGeneratorはリクエストごとに生成されるため）
+hedged_executor = HedgedExecutor(max_workers=int(os.getenv('LLM_HEDGE_WORKERS', '8')))
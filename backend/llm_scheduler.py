@@ -0,0 +1,182 @@
+"""
+LLMリクエストスケジューラー
+プロバイダーごとのトークンバケット（RPM/TPM）と、プランに応じた優先度付きキューによる流量制御
+"""
+
+import os
+import heapq
+import itertools
+import threading
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any
+from prompt_builder import count_tokens
+from llm_deadline import CallCancelledError, is_cancelled
+
+# プラン種別ごとの優先度（小さいほど優先）
+PLAN_PRIORITIES = {
+    'Premium': 0,
+    'Free': 1,
+}
+DEFAULT_PRIORITY = 1
+BACKGROUND_PRIORITY = 9
+
+# 待機中にキャンセルを確認する間隔（キャンセルイベントは条件変数を起こさないため）
+CANCEL_POLL_INTERVAL = float(os.getenv('LLM_SCHEDULER_CANCEL_POLL', '0.2'))
+
+# 現在のリクエストの優先度（スレッドプールへはcopy_contextで引き継ぐ）
+_current_priority: contextvars.ContextVar[int] = contextvars.ContextVar('llm_request_priority', default=DEFAULT_PRIORITY)
+
+
+class RateLimitedError(Exception):
+    """待機上限内にレート制限の枠を確保できなかったことを示す例外"""
+    pass
+
+
+@contextmanager
+def request_priority(plan_type: str | None):
+    """プラン種別に応じた優先度をこのコンテキスト内のLLM呼び出しに設定"""
+    token = _current_priority.set(PLAN_PRIORITIES.get(plan_type or '', DEFAULT_PRIORITY))
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def background_priority():
+    """バックグラウンド処理（キャッシュ更新など）用の最低優先度を設定"""
+    token = _current_priority.set(BACKGROUND_PRIORITY)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def estimate_tokens(prompt: str, max_tokens: int, provider: str = 'groq') -> int:
+    """プロンプトのトークン数（プロバイダーのトークナイザー近似）+ 出力枠の半分"""
+    return count_tokens(prompt, provider) + max_tokens // 2
+
+
+class TokenBucket:
+    """一定レートで補充されるトークンバケット"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """指定量が消費可能になるまでの秒数"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class ProviderQueue:
+    """プロバイダー単位のRPM/TPMバケットと優先度付き待ち行列"""
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.admitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+
+    def _wait_time(self, tokens: int) -> float:
+        return max(self.requests.time_until(1), self.tokens.time_until(tokens))
+
+
+class LLMScheduler:
+    """全AIAnalysisGeneratorで共有するLLM呼び出しスケジューラー"""
+
+    def __init__(self):
+        self.max_wait = float(os.getenv('LLM_SCHEDULER_MAX_WAIT', '15'))
+        self._queues = {
+            'groq': ProviderQueue('groq', int(os.getenv('GROQ_RPM', '30')), int(os.getenv('GROQ_TPM', '12000'))),
+            'gemini': ProviderQueue('gemini', int(os.getenv('GEMINI_RPM', '15')), int(os.getenv('GEMINI_TPM', '250000'))),
+        }
+        self._sequence = itertools.count()
+
+    def acquire(self, provider: str, tokens: int, timeout: float | None = None):
+        """
+        レート制限の枠を確保するまで優先度順に待機する。
+        待機上限を超えた場合はRateLimitedError、待機中に呼び出しがキャンセルされた場合は
+        枠を消費せずにCallCancelledErrorを送出。
+        """
+        queue = self._queues.get(provider)
+        if queue is None:
+            return
+
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        started = time.monotonic()
+        entry = (_current_priority.get(), next(self._sequence))
+
+        with queue.condition:
+            heapq.heappush(queue.waiting, entry)
+            try:
+                while True:
+                    if is_cancelled():
+                        queue.cancelled += 1
+                        raise CallCancelledError(f"{provider} call cancelled while waiting for capacity")
+                    if queue.waiting[0] == entry:
+                        wait = queue._wait_time(tokens)
+                        if wait <= 0:
+                            queue.requests.consume(1)
+                            queue.tokens.consume(tokens)
+                            queue.admitted += 1
+                            queue.total_wait += time.monotonic() - started
+                            return
+                    else:
+                        wait = None
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        queue.rejected += 1
+                        raise RateLimitedError(f"{provider} rate limit: no capacity within {timeout:.1f}s")
+                    queue.condition.wait(min(remaining if wait is None else min(wait, remaining), CANCEL_POLL_INTERVAL))
+            finally:
+                if entry in queue.waiting:
+                    queue.waiting.remove(entry)
+                    heapq.heapify(queue.waiting)
+                queue.condition.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """プロバイダーごとのキュー長・バケット残量・待機統計"""
+        result = {}
+        for name, queue in self._queues.items():
+            with queue.condition:
+                queue.requests._refill()
+                queue.tokens._refill()
+                result[name] = {
+                    'queue_depth': len(queue.waiting),
+                    'requests_available': round(queue.requests.tokens, 2),
+                    'tokens_available': int(queue.tokens.tokens),
+                    'admitted': queue.admitted,
+                    'rejected': queue.rejected,
+                    'cancelled': queue.cancelled,
+                    'avg_wait': round(queue.total_wait / queue.admitted, 3) if queue.admitted else 0.0
+                }
+        return result
+
+
+# プロセス全体で共有するスケジューラー
+llm_scheduler = LLMScheduler()
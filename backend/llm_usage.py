@@ -0,0 +1,197 @@
+"""
+LLM利用量の計測
+リクエスト（占い結果1件）ごとに、全てのLLM呼び出しのプロバイダー・モデル・トークン数・レイテンシ・キャッシュヒットを記録して集計する。
+あわせてタスク種別（判定・抽出・鑑定文など）ごとのレイテンシをプロセス全体で集計し、モデルの振り分けの効果を確認できるようにする
+"""
+
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Iterable
+from llm_hedging import LatencyWindow
+
+# モデルごとの料金（USD / 100万トークン、入力・出力）
+MODEL_PRICING: Dict[str, Dict[str, float]] = {
+    'llama-3.3-70b-versatile': {'input': 0.59, 'output': 0.79},
+    'llama-3.1-8b-instant': {'input': 0.05, 'output': 0.08},
+    'models/gemini-2.5-flash-lite': {'input': 0.10, 'output': 0.40},
+}
+# 料金表にないモデル（環境変数で上書き可能）
+DEFAULT_PRICING = {
+    'input': float(os.getenv('LLM_DEFAULT_INPUT_PRICE', '0.59')),
+    'output': float(os.getenv('LLM_DEFAULT_OUTPUT_PRICE', '0.79')),
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """トークン数から料金（USD）を算出"""
+    pricing = MODEL_PRICING.get(model, DEFAULT_PRICING)
+    return (prompt_tokens * pricing['input'] + completion_tokens * pricing['output']) / 1_000_000
+
+
+class UsageLedger:
+    """1リクエスト内のLLM呼び出しとキャッシュヒットの記録（スレッドプールからも書き込まれる）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: List[Dict[str, Any]] = []
+        self.cache_hits: Dict[str, int] = {}
+        # LLMの失敗や計算エラーで代替の結果を返した箇所（このリクエストの結果はキャッシュしない）
+        self.degraded: Dict[str, int] = {}
+
+    def add_call(self, provider: str, model: str, prompt_tokens: int, completion_tokens: int, latency: float, estimated: bool = False):
+        with self._lock:
+            self.calls.append({
+                'provider': provider,
+                'model': model,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'latency_ms': round(latency * 1000),
+                'cost_usd': estimate_cost(model, prompt_tokens, completion_tokens),
+                # プロバイダーが使用量を返さなかった場合は概算値
+                'estimated': estimated
+            })
+
+    def add_cache_hit(self, source: str):
+        with self._lock:
+            self.cache_hits[source] = self.cache_hits.get(source, 0) + 1
+
+    def add_degraded(self, source: str):
+        with self._lock:
+            self.degraded[source] = self.degraded.get(source, 0) + 1
+
+    def is_degraded(self) -> bool:
+        with self._lock:
+            return bool(self.degraded)
+
+    def summary(self) -> Dict[str, Any]:
+        """DivinationResultに保存する集計"""
+        with self._lock:
+            calls = list(self.calls)
+            cache_hits = dict(self.cache_hits)
+            degraded = dict(self.degraded)
+        by_provider: Dict[str, Dict[str, Any]] = {}
+        for call in calls:
+            stats = by_provider.setdefault(call['provider'], {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0})
+            stats['calls'] += 1
+            stats['prompt_tokens'] += call['prompt_tokens']
+            stats['completion_tokens'] += call['completion_tokens']
+            stats['cost_usd'] += call['cost_usd']
+        for stats in by_provider.values():
+            stats['cost_usd'] = round(stats['cost_usd'], 6)
+        return {
+            'calls': len(calls),
+            'cache_hits': sum(cache_hits.values()),
+            'cache_hit_sources': cache_hits,
+            'degraded': degraded,
+            'prompt_tokens': sum(call['prompt_tokens'] for call in calls),
+            'completion_tokens': sum(call['completion_tokens'] for call in calls),
+            'latency_ms': sum(call['latency_ms'] for call in calls),
+            'cost_usd': round(sum(call['cost_usd'] for call in calls), 6),
+            'by_provider': by_provider,
+            'details': calls
+        }
+
+
+# 現在のリクエストの記録先（スレッドプールへはcopy_contextで引き継ぐ）
+_current_ledger: contextvars.ContextVar[UsageLedger | None] = contextvars.ContextVar('llm_usage_ledger', default=None)
+
+
+@contextmanager
+def track_usage():
+    """このコンテキスト内のLLM呼び出しを記録する台帳を用意"""
+    ledger = UsageLedger()
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def record_llm_call(provider: str, model: str, prompt_tokens: int, completion_tokens: int, latency: float, estimated: bool = False):
+    """LLM呼び出しを現在のリクエストの台帳に記録（台帳がなければ何もしない）"""
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.add_call(provider, model, prompt_tokens, completion_tokens, latency, estimated)
+
+
+def record_cache_hit(source: str):
+    """LLMを呼ばずにキャッシュなどから返したことを記録"""
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.add_cache_hit(source)
+
+
+def record_degraded(source: str):
+    """LLMの失敗や計算エラーにより、代替の結果（テンプレート鑑定文・既定値など）を返したことを記録"""
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.add_degraded(source)
+
+
+class TaskLatencyStats:
+    """タスク種別・モデルごとのLLM呼び出しレイテンシ（スケジューラーの待ち時間を含む）"""
+
+    def __init__(self, window_size: int = 200):
+        self.window_size = window_size
+        self._lock = threading.Lock()
+        self._stats: Dict[tuple, Dict[str, Any]] = {}
+
+    def record(self, task: str, model: str, latency: float, ok: bool = True):
+        with self._lock:
+            stats = self._stats.setdefault((task, model), {'calls': 0, 'errors': 0, 'total': 0.0, 'window': LatencyWindow(self.window_size)})
+            stats['calls'] += 1
+            if not ok:
+                stats['errors'] += 1
+                return
+            stats['total'] += latency
+        stats['window'].add(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """{タスク: {モデル: 呼び出し数・エラー数・平均/p50/p95（ミリ秒）}}"""
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._stats.items()]
+        result: Dict[str, Dict[str, Any]] = {}
+        for (task, model), stats in items:
+            window = stats['window']
+            succeeded = stats['calls'] - stats['errors']
+            p50, p95 = window.percentile(50), window.percentile(95)
+            result.setdefault(task, {})[model] = {
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'avg_ms': round(stats['total'] / succeeded * 1000) if succeeded else None,
+                'p50_ms': round(p50 * 1000) if p50 is not None else None,
+                'p95_ms': round(p95 * 1000) if p95 is not None else None,
+            }
+        return result
+
+
+# プロセス全体で共有するタスク別レイテンシ
+task_latency_stats = TaskLatencyStats()
+
+
+def summarize_results(rows: Iterable[tuple]) -> Dict[str, Any]:
+    """(占術タイプ, 利用量の集計) の列から、占術タイプ別・プラン別のコストを集計"""
+    def empty() -> Dict[str, Any]:
+        return {'results': 0, 'llm_calls': 0, 'cache_hits': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0}
+
+    by_type: Dict[str, Dict[str, Any]] = {}
+    by_plan: Dict[str, Dict[str, Any]] = {}
+    total = empty()
+    for fortune_type, usage in rows:
+        if not usage:
+            continue
+        for stats in (by_type.setdefault(fortune_type or 'unknown', empty()), by_plan.setdefault(usage.get('plan_type') or 'unknown', empty()), total):
+            stats['results'] += 1
+            stats['llm_calls'] += usage.get('calls', 0)
+            stats['cache_hits'] += usage.get('cache_hits', 0)
+            stats['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            stats['completion_tokens'] += usage.get('completion_tokens', 0)
+            stats['cost_usd'] += usage.get('cost_usd', 0.0)
+
+    for stats in [*by_type.values(), *by_plan.values(), total]:
+        stats['avg_cost_usd'] = round(stats['cost_usd'] / stats['results'], 6) if stats['results'] else 0.0
+        stats['avg_llm_calls'] = round(stats['llm_calls'] / stats['results'], 2) if stats['results'] else 0.0
+        stats['cost_usd'] = round(stats['cost_usd'], 6)
+    return {'total': total, 'by_fortune_type': by_type, 'by_plan': by_plan}
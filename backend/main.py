@@ -3,22 +3,44 @@ from dotenv import load_dotenv
 # .env.localファイルを明示的に読み込む
 load_dotenv(dotenv_path='.env.local')
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Header, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional
+import os
 import json
+import queue
 
 from .database import SessionLocal, User, Profile, DivinationResult, Favorite
 from .auth import get_current_user_id
 from .divination_service import DivinationService
+from .service_executor import QueueFullError, service_executor
+from .divination_jobs import DivinationJobWorker, TERMINAL_STATUSES
+from .llm_usage import summarize_results
+from .cache_warmup import CacheWarmup
 
 app = FastAPI(title="uranAI Backend", version="1.0.0")
 
 # 占いサービスを初期化
 divination_service = DivinationService()
 
+# デプロイ直後のコールドスタートを避けるため、保存済みの鑑定文でAIキャッシュを事前に埋める
+cache_warmup = CacheWarmup(divination_service.ai_generator)
+
+# 占い結果生成のジョブを処理するワーカープール（結果は同期APIと同じくDivinationResultに保存）
+job_worker = DivinationJobWorker(
+    divination_service,
+    lambda db, user_id, result_data, divination_result: _save_divination_result(db, user_id, result_data, divination_result, commit=False)
+)
+
+# ジョブ状態のストリーミングでデータベースを確認する間隔（秒）
+JOB_STREAM_INTERVAL = float(os.getenv('DIVINATION_JOB_STREAM_INTERVAL', '1.0'))
+
+# 管理者のユーザーID（カンマ区切り、利用量の集計などの閲覧に必要）
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
 # CORS設定
 app.add_middleware(
     CORSMiddleware,
@@ -40,10 +62,80 @@ def get_db():
     finally:
         db.close()
 
+def require_admin(current_user_id: str = Depends(get_current_user_id)) -> str:
+    """管理者のみ利用できるAPIの依存関係（管理者でなければ403）"""
+    if current_user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="管理者のみ閲覧できます")
+    return current_user_id
+
+@app.on_event("startup")
+def start_cache_warmup():
+    """起動時にAIキャッシュのウォームアップをバックグラウンドで開始"""
+    cache_warmup.start()
+
+@app.on_event("startup")
+def start_job_worker():
+    """占い結果生成ジョブのワーカーを起動"""
+    job_worker.start()
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    job_worker.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to uranAI backend!"}
 
+@app.get("/health/live")
+async def health_live():
+    """プロセスの生存確認"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """トラフィックを受けられるか（AIキャッシュのウォームアップ完了まで503）"""
+    warmup = cache_warmup.status()
+    if not cache_warmup.is_ready():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail={"status": "warming_up", "cache_warmup": warmup})
+    return {"status": "ready", "cache_warmup": warmup}
+
+@app.get("/metrics/ai", response_model=dict)
+async def get_ai_metrics(admin_user_id: str = Depends(require_admin)):
+    """AI呼び出しの統計情報（ヘッジ率・勝率・レイテンシ・キャッシュヒット率）を取得（管理者のみ）"""
+    return divination_service.ai_generator.get_ai_stats()
+
+@app.get("/metrics/executor", response_model=dict)
+async def get_executor_metrics(admin_user_id: str = Depends(require_admin)):
+    """占い結果生成の共有プール（CPU・I/O）の待ち行列・実行中の件数を取得（管理者のみ）"""
+    return dict(divination_service.get_executor_stats(), jobs=job_worker.stats())
+
+@app.get("/metrics/result-cache", response_model=dict)
+async def get_result_cache_metrics(admin_user_id: str = Depends(require_admin)):
+    """占い結果キャッシュのヒット率・件数を取得（管理者のみ）"""
+    return divination_service.get_result_cache_stats()
+
+def _busy_exception(e: QueueFullError) -> HTTPException:
+    """共有プールが満杯のときの503（Retry-Afterで再試行までの秒数を伝える）"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail={"status": "busy", "pool": e.pool, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+@app.get("/llm-usage/summary", response_model=dict)
+def get_llm_usage_summary(
+    days: Optional[int] = None,
+    admin_user_id: str = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """保存済みの占い結果から、占術タイプ別・プラン別のLLMトークン数とコストを集計（管理者のみ）"""
+    query = db.query(DivinationResult.fortune_type, DivinationResult.llm_usage).filter(DivinationResult.llm_usage.isnot(None))
+    if days is not None:
+        query = query.filter(DivinationResult.created_at >= datetime.utcnow() - timedelta(days=days))
+    summary = summarize_results(query.yield_per(1000))
+    summary['days'] = days
+    return summary
+
 # ユーザー管理API
 @app.post("/users/", response_model=dict)
 async def create_user(
@@ -230,6 +322,8 @@ async def update_profile(
                 setattr(profile, key, value)
         profile.updated_at = datetime.utcnow()
         db.commit()
+        # 変更前の内容で生成した占い結果を返さないようにする
+        divination_service.invalidate_profile(profile_id)
         
         return {"message": "Profile updated successfully", "profile_id": profile_id}
         
@@ -255,6 +349,7 @@ async def delete_profile(
     try:
         db.delete(profile)
         db.commit()
+        divination_service.invalidate_profile(profile_id)
         return {"message": "Profile deleted successfully"}
         
     except Exception as e:
@@ -263,7 +358,7 @@ async def delete_profile(
 
 # 占い結果管理API
 @app.post("/divination-results/", response_model=dict)
-async def create_divination_result(
+def create_divination_result(
     result_data: dict,
     current_user_id: str = Depends(get_current_user_id),
     db: Session = Depends(get_db)
@@ -272,20 +367,12 @@ async def create_divination_result(
     try:
         # 占い結果を生成
         request_data = result_data.get("request_data", {})
-        divination_result = divination_service.generate_divination_result(request_data)
+        user = db.query(User).filter(User.user_id == current_user_id).first()
+        plan_type = user.plan_type if user else "Free"
+        divination_result = divination_service.generate_divination_result(request_data, plan_type=plan_type)
         
         # データベースに保存
-        new_result = DivinationResult(
-            user_id=current_user_id,
-            fortune_type=result_data.get("fortune_type"),
-            request_data=request_data,
-            visual_result=divination_result.get("visual_result", {}),
-            ai_text=divination_result.get("ai_analysis", ""),
-            created_at=datetime.utcnow()
-        )
-        db.add(new_result)
-        db.commit()
-        db.refresh(new_result)
+        new_result = _save_divination_result(db, current_user_id, result_data, divination_result)
         
         return {
             "message": "Divination result created successfully",
@@ -293,6 +380,9 @@ async def create_divination_result(
             "divination_result": divination_result
         }
         
+    except QueueFullError as e:
+        print(f"占い結果作成を見送りました（混雑中）: {e}")
+        raise _busy_exception(e)
     except Exception as e:
         db.rollback()
         print(f"占い結果作成エラー: {e}")
@@ -300,6 +390,204 @@ async def create_divination_result(
         print(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/divination-results/batch", response_model=dict)
+def create_divination_results_batch(
+    batch_data: dict,
+    current_user_id: str = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    複数の占い結果をまとめて作成（itemsの各要素は POST /divination-results/ と同じボディ）
+    同じプロフィールのローマ字変換・ジオコーディング・出生図は1回だけ計算し、占いは並行して生成する
+    結果は入力順に返し、失敗した占いはerrorを含めて返す（成功した分は保存する）
+    """
+    items = batch_data.get("items") or []
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="items must be a list")
+    # 形式の誤った要素は生成を始める前にバッチごと断る（生成時の失敗のみ要素ごとのerrorで返す）
+    invalid = [index for index, item in enumerate(items) if not isinstance(item, dict)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"items must be objects (invalid indexes: {invalid})")
+    user = db.query(User).filter(User.user_id == current_user_id).first()
+    plan_type = user.plan_type if user else "Free"
+    try:
+        batch = divination_service.generate_divination_batch(
+            [item.get("request_data", {}) for item in items],
+            plan_type=plan_type
+        )
+    except QueueFullError as e:
+        print(f"占い結果のバッチ作成を見送りました（混雑中）: {e}")
+        raise _busy_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # 成功した占いを1つのトランザクションで保存
+        saved = {}
+        for index, (item, outcome) in enumerate(zip(items, batch["items"])):
+            if "result" in outcome:
+                saved[index] = _save_divination_result(db, current_user_id, item, outcome["result"], commit=False)
+        db.flush()
+        result_ids = {index: result.id for index, result in saved.items()}
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"占い結果のバッチ保存エラー: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    results = []
+    for index, outcome in enumerate(batch["items"]):
+        if index in saved:
+            results.append({"index": index, "status": "succeeded", "result_id": result_ids[index], "divination_result": outcome["result"]})
+        else:
+            results.append(dict(outcome, index=index, status="failed"))
+    return {
+        "message": "Divination results batch processed",
+        "succeeded": len(saved),
+        "failed": len(results) - len(saved),
+        "results": results,
+        "shared_inputs": batch["shared_inputs"]
+    }
+
+@app.post("/divination-results/stream")
+def stream_divination_result(
+    result_data: dict,
+    current_user_id: str = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    占い結果を作成し、NDJSONでストリーミング返却
+    総合占いはセクションが完了するたびに {"event": "section", ...} を送り、最後に {"event": "result", ...} を送る
+    """
+    request_data = result_data.get("request_data", {})
+    user = db.query(User).filter(User.user_id == current_user_id).first()
+    plan_type = user.plan_type if user else "Free"
+    events: "queue.Queue[dict | None]" = queue.Queue()
+    
+    def on_section(index: int, key: str, title: str, text: str):
+        events.put({"event": "section", "index": index, "key": key, "title": title, "text": text})
+    
+    def generate():
+        # レスポンス送信中も使えるよう、依存関係とは別のセッションで保存する
+        stream_db = SessionLocal()
+        try:
+            divination_result = divination_service.generate_divination_result(request_data, plan_type=plan_type, on_section=on_section)
+            new_result = _save_divination_result(stream_db, current_user_id, result_data, divination_result)
+            events.put({"event": "result", "result_id": new_result.id, "divination_result": divination_result})
+        except QueueFullError as e:
+            print(f"占い結果ストリーミングを見送りました（混雑中）: {e}")
+            events.put({"event": "error", "detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            stream_db.rollback()
+            print(f"占い結果ストリーミングエラー: {e}")
+            events.put({"event": "error", "detail": str(e)})
+        finally:
+            stream_db.close()
+            events.put(None)
+    
+    # 生成は共有プールで実行し、混雑中はストリームを開始せずに503で返す
+    try:
+        divination_service.check_capacity()
+        service_executor.submit_io(generate)
+    except QueueFullError as e:
+        print(f"占い結果ストリーミングを見送りました（混雑中）: {e}")
+        raise _busy_exception(e)
+    
+    def stream():
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _save_divination_result(db: Session, user_id: str, result_data: dict, divination_result: dict, commit: bool = True) -> DivinationResult:
+    """生成した占い結果をデータベースに保存（commit=Falseなら追加のみ行い、コミットは呼び出し側に任せる）"""
+    new_result = DivinationResult(
+        user_id=user_id,
+        fortune_type=result_data.get("fortune_type"),
+        request_data=result_data.get("request_data", {}),
+        visual_result=divination_result.get("visual_result", {}),
+        ai_text=divination_result.get("ai_analysis", ""),
+        # 利用量はレスポンスには含めず保存のみ
+        llm_usage=divination_result.pop("llm_usage", None),
+        created_at=datetime.utcnow()
+    )
+    db.add(new_result)
+    if not commit:
+        return new_result
+    db.commit()
+    db.refresh(new_result)
+    return new_result
+
+# 占い結果生成ジョブAPI
+@app.post("/divination-jobs/", response_model=dict, status_code=status.HTTP_202_ACCEPTED)
+def create_divination_job(
+    result_data: dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user_id: str = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    占い結果の生成をジョブとして登録し、すぐにジョブIDを返す（ボディは POST /divination-results/ と同じ）
+    完了は GET /divination-jobs/{job_id} のポーリングか /events の購読で確認する
+    """
+    user = db.query(User).filter(User.user_id == current_user_id).first()
+    plan_type = user.plan_type if user else "Free"
+    job, created = job_worker.enqueue(db, current_user_id, result_data, plan_type, idempotency_key)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "created": created,
+        "status_url": f"/divination-jobs/{job.id}",
+        "events_url": f"/divination-jobs/{job.id}/events"
+    }
+
+@app.get("/divination-jobs/{job_id}", response_model=dict)
+def get_divination_job(
+    job_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """ジョブの状態を取得（完了していれば占い結果を含む）"""
+    job = job_worker.get(db, current_user_id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Divination job not found")
+    return job_worker.describe(db, job)
+
+@app.get("/divination-jobs/{job_id}/events")
+def stream_divination_job(
+    job_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """ジョブの状態が変わるたびにServer-Sent Eventsで通知し、完了または失敗で終了する"""
+    if not job_worker.get(db, current_user_id, job_id):
+        raise HTTPException(status_code=404, detail="Divination job not found")
+    
+    def events():
+        last = None
+        while True:
+            # レスポンス送信中も使えるよう、依存関係とは別のセッションで確認する
+            events_db = SessionLocal()
+            try:
+                job = job_worker.get(events_db, current_user_id, job_id)
+                payload = job_worker.describe(events_db, job) if job else None
+            finally:
+                events_db.close()
+            if payload is None:
+                break
+            if payload["status"] != last:
+                last = payload["status"]
+                yield f"event: status\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+            if payload["status"] in TERMINAL_STATUSES:
+                break
+            # 同じプロセスのワーカーが状態を更新したらすぐに、そうでなければ一定間隔で確認する
+            job_worker.wait_for_change(JOB_STREAM_INTERVAL)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/divination-results/", response_model=List[dict])
 async def get_divination_results(
     current_user_id: str = Depends(get_current_user_id),
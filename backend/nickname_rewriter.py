@@ -0,0 +1,140 @@
+"""
+ニックネーム置換
+LLMの出力に残った「人物1」「あなた」「相手」などの呼び方を、1回の走査でニックネームに置き換える。
+ストリーミング出力にも使えるよう、チャンク単位で受け取りパターンの途中になりうる末尾だけを保留する
+"""
+
+import re
+from typing import Dict, List
+
+# 置換対象の呼び方 → 何人目のニックネームにするか
+# 同じ位置から始まる候補は長いものを優先する（「人物1さんさん」→「人物1さん」→「人物1」）
+NICKNAME_PATTERNS: Dict[str, int] = {
+    '人物1さんさん': 1,
+    '人物2さんさん': 2,
+    '人物1さん': 1,
+    '人物2さん': 2,
+    '人物1': 1,
+    '人物2': 2,
+    'あなたさん': 1,
+    '相手さん': 2,
+    'あなた': 1,
+    '相手': 2,
+}
+
+# 他のパターンを接頭辞に持たない語幹（「人物1」「あなた」など）
+_STEMS = tuple(word for word in NICKNAME_PATTERNS if not any(other != word and word.startswith(other) for other in NICKNAME_PATTERNS))
+
+
+def _compile_pattern() -> re.Pattern:
+    """語幹ごとにまとめた1つの正規表現（例: 人物1(?:さんさん|さん)?）。語幹の先頭文字で高速に読み飛ばせる"""
+    branches = []
+    for stem in _STEMS:
+        suffixes = sorted((word[len(stem):] for word in NICKNAME_PATTERNS if word != stem and word.startswith(stem)), key=len, reverse=True)
+        branch = re.escape(stem)
+        if suffixes:
+            branch += '(?:' + '|'.join(re.escape(suffix) for suffix in suffixes) + ')?'
+        branches.append(branch)
+    return re.compile('(' + '|'.join(branches) + ')')
+
+
+_PATTERN = _compile_pattern()
+
+# 後続の文字次第でより長いパターンになりうる文字列（パターンの真の接頭辞）
+_PREFIXES = frozenset(word[:end] for word in NICKNAME_PATTERNS for end in range(1, len(word)))
+_MAX_PREFIX = max(len(prefix) for prefix in _PREFIXES)
+
+
+class NicknameRewriter:
+    """呼び方をニックネームに置き換える（全文の一括置換とチャンク単位のストリーミング置換）"""
+
+    def __init__(self, person1_nickname: str, person2_nickname: str):
+        nicknames = {1: f'{person1_nickname}さん', 2: f'{person2_nickname}さん'}
+        self._replacements = {word: nicknames[person] for word, person in NICKNAME_PATTERNS.items()}
+        self._buffer = ''
+
+    def rewrite(self, text: str) -> str:
+        """全文を1回の走査で置換"""
+        # LLMが指示どおりニックネームを使っていれば置換対象はなく、部分文字列の検索だけで済む
+        if not any(stem in text for stem in _STEMS):
+            return text
+        # splitは一致部分を奇数番目に返すため、一致ごとに呼び出されるコールバックより速い
+        parts = _PATTERN.split(text)
+        parts[1::2] = [self._replacements[word] for word in parts[1::2]]
+        return ''.join(parts)
+
+    def _holdback(self, text: str, start: int) -> int:
+        """末尾のうち、続きの文字でパターンになりうる部分の開始位置（なければ末尾）"""
+        for position in range(max(start, len(text) - _MAX_PREFIX), len(text)):
+            if text[position:] in _PREFIXES:
+                return position
+        return len(text)
+
+    def feed(self, chunk: str) -> str:
+        """
+        ストリーミングのチャンクを受け取り、確定した部分を置換して返す。
+        パターンの途中で切れている可能性がある末尾（最大でパターン長-1文字）だけを次のチャンクまで保留する
+        """
+        text = self._buffer + chunk
+        parts: List[str] = []
+        position = 0
+        hold = self._holdback(text, 0)
+        for match in _PATTERN.finditer(text):
+            # 保留位置以降から始まる一致は、続きの文字でより長いパターンになりうる
+            if match.start() >= hold:
+                break
+            parts.append(text[position:match.start()])
+            parts.append(self._replacements[match.group()])
+            position = match.end()
+            # 一致が保留位置をまたいだ場合は、その後ろから保留位置を求め直す
+            if position > hold:
+                hold = self._holdback(text, position)
+        parts.append(text[position:hold])
+        self._buffer = text[hold:]
+        return ''.join(parts)
+
+    def flush(self) -> str:
+        """保留中の末尾を置換して返す（ストリームの終了時に呼ぶ）"""
+        text, self._buffer = self._buffer, ''
+        return self.rewrite(text)
+
+
+def rewrite_nicknames(text: str, person1_nickname: str, person2_nickname: str) -> str:
+    """呼び方をニックネームに置換"""
+    return NicknameRewriter(person1_nickname, person2_nickname).rewrite(text)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    def sequential(text: str, person1: str, person2: str) -> str:
+        """従来の10回のre.subによる置換"""
+        for word in NICKNAME_PATTERNS:
+            text = re.sub(word, f'{person1 if NICKNAME_PATTERNS[word] == 1 else person2}さん', text)
+        return text
+
+    sample = "人物1さんと人物2さんは、あなたさんと相手さんのように支え合えます。あなたは相手の気持ちを大切にし、人物1さんさんは人物2の夢を応援しましょう。"
+    body = "今日は穏やかな一日になりそうです。星の配置はコバトンさんに新しい出会いを示しています。仕事面では周囲との協力が鍵になり、丁寧な対話が成果につながります。" * 3
+    long_texts = {'置換なし': body * 500, '疎': (body + "相手の気持ちを尊重しましょう。") * 500, '密': sample * 2000}
+
+    # ストリーミングの結果が一括置換と一致することを、ランダムなチャンク分割で確認
+    rng = random.Random(0)
+    for _ in range(200):
+        rewriter = NicknameRewriter('コバトン', 'ハナコ')
+        output, position = [], 0
+        while position < len(sample):
+            size = rng.randint(1, 6)
+            output.append(rewriter.feed(sample[position:position + size]))
+            position += size
+        output.append(rewriter.flush())
+        assert ''.join(output) == rewrite_nicknames(sample, 'コバトン', 'ハナコ')
+    assert rewrite_nicknames(sample, 'コバトン', 'ハナコ') == sequential(sample, 'コバトン', 'ハナコ')
+    print("ストリーミング置換と一括置換の結果が一致しました")
+
+    for label, long_text in long_texts.items():
+        for name, fn in [('sequential re.sub x10', sequential), ('single pass', rewrite_nicknames)]:
+            started = time.perf_counter()
+            for _ in range(20):
+                fn(long_text, 'コバトン', 'ハナコ')
+            print(f"{label:<6}{name:<24}{(time.perf_counter() - started) / 20 * 1000:.2f} ms / {len(long_text)}文字")
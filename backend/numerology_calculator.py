@@ -12,6 +12,10 @@ import pykakasi
 import re
 from datetime import datetime, date
 from typing import Dict, Any, List
+from numerology_scoring import numerology_score_table
+from numerology_data import NUMBER_MEANINGS
+from shared_inputs import memoized
+from llm_usage import record_degraded
 
 
 class ModernNumerologyCalculator:
@@ -304,21 +308,7 @@ class NumerologyCalculator:
     
     def __init__(self):
         """Initialize the calculator with number meanings"""
-        self.number_meanings = {
-            1: 'リーダーシップ、独立、創造性',
-            2: '協調性、バランス、直感',
-            3: '表現力、創造性、コミュニケーション',
-            4: '安定、実用性、組織力',
-            5: '自由、変化、冒険',
-            6: '責任、愛情、調和',
-            7: '精神性、分析、内省',
-            8: '成功、権力、物質的達成',
-            9: '完成、智慧、奉仕',
-            11: '直感、啓示、スピリチュアル',
-            22: '最高の職人、実現力、大いなる目的',
-            33: 'マスター教師、癒し、奉仕',
-            44: '実用的な理想主義、建設的な変化'
-        }
+        self.number_meanings = NUMBER_MEANINGS
     
     def _convert_japanese_name_to_romanization(self, name_hiragana: str) -> str:
         """
@@ -330,6 +320,11 @@ class NumerologyCalculator:
         Returns:
             Romanized name in uppercase (e.g., "KOBAYASHI YOSHITAKA")
         """
+        # バッチ処理中は同じ名前の変換を1回にまとめる
+        return memoized('romanization', name_hiragana, lambda: self._romanize(name_hiragana))
+    
+    def _romanize(self, name_hiragana: str) -> str:
+        """pykakasiでヘボン式ローマ字に変換"""
         # Split name by space
         name_parts = name_hiragana.split()
         if len(name_parts) < 2:
@@ -414,6 +409,7 @@ class NumerologyCalculator:
             print(f"Numerology calculation failed: {e}")
             import traceback
             traceback.print_exc()
+            record_degraded('numerology_calculation')
             # Return error result
             return {
                 'nickname': profile_data.get('nickname', 'あなた'),
@@ -426,7 +422,7 @@ class NumerologyCalculator:
                 'maturity': {'number': 0, 'meaning': '計算エラー'}
             }
     
-    def get_compatibility_analysis(self, profile1: Dict[str, Any], profile2: Dict[str, Any], consultation: str = "") -> Dict[str, Any]:
+    def get_compatibility_analysis(self, profile1: Dict[str, Any], profile2: Dict[str, Any], consultation: str = "", include_ai: bool = True) -> Dict[str, Any]:
         """
         Get compatibility analysis between two profiles
         
@@ -434,6 +430,7 @@ class NumerologyCalculator:
             profile1: First profile data
             profile2: Second profile data
             consultation: Consultation content for AI analysis
+            include_ai: Whether to generate the analysis text with AI (False uses the fallback text)
             
         Returns:
             Dictionary with compatibility analysis
@@ -443,7 +440,6 @@ class NumerologyCalculator:
             reading1 = self.get_numerology_reading(profile1)
             reading2 = self.get_numerology_reading(profile2)
             
-            # AIを使用してスコアを生成
             compatibility_data = {
                 'person1': reading1,
                 'person2': reading2,
@@ -452,12 +448,11 @@ class NumerologyCalculator:
                 'consultation': consultation
             }
             
+            # 事前計算済みの相性スコアテーブルから取得
             try:
-                from ai_analysis import AIAnalysisGenerator
-                ai_generator = AIAnalysisGenerator()
-                compatibility_score = ai_generator.generate_ai_compatibility_score(compatibility_data, 'numerology')
+                compatibility_score = numerology_score_table.score(reading1, reading2)
             except Exception as e:
-                print(f"AI score generation failed, using fallback: {e}")
+                print(f"Score table lookup failed, using fallback: {e}")
                 # フォールバック: 従来のアルゴリズム
                 life_path_diff = abs(reading1['life_path']['number'] - reading2['life_path']['number'])
                 destiny_diff = abs(reading1['destiny']['number'] - reading2['destiny']['number'])
@@ -475,12 +470,15 @@ class NumerologyCalculator:
             compatibility_data['analysis'] = ''  # Will be filled by AI
             
             # Generate AI analysis using the same system as other divination types
-            try:
-                from ai_analysis import AIAnalysisGenerator
-                ai_generator = AIAnalysisGenerator()
-                analysis = ai_generator.generate_compatibility_analysis(compatibility_data, 'numerology', consultation)
-            except Exception as ai_error:
-                print(f"AI analysis failed, using fallback: {ai_error}")
+            analysis = None
+            if include_ai:
+                try:
+                    from ai_analysis import AIAnalysisGenerator
+                    ai_generator = AIAnalysisGenerator()
+                    analysis = ai_generator.generate_compatibility_analysis(compatibility_data, 'numerology', consultation)
+                except Exception as ai_error:
+                    print(f"AI analysis failed, using fallback: {ai_error}")
+            if analysis is None:
                 # Enhanced fallback analysis with nicknames and consultation context
                 analysis = self._get_enhanced_fallback_analysis(profile1, profile2, compatibility_score, consultation)
             
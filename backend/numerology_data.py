@@ -0,0 +1,39 @@
+"""
+数秘術データ
+ナンバーの意味テーブル（計算クラス・AI分析・テンプレート鑑定文で共通）
+"""
+
+from typing import Dict
+
+# ナンバーの意味
+NUMBER_MEANINGS: Dict[int, str] = {
+    1: 'リーダーシップ、独立、創造性',
+    2: '協調性、バランス、直感',
+    3: '表現力、創造性、コミュニケーション',
+    4: '安定、実用性、組織力',
+    5: '自由、変化、冒険',
+    6: '責任、愛情、調和',
+    7: '精神性、分析、内省',
+    8: '成功、権力、物質的達成',
+    9: '完成、智慧、奉仕',
+    11: '直感、啓示、スピリチュアル',
+    22: '最高の職人、実現力、大いなる目的',
+    33: 'マスター教師、癒し、奉仕',
+    44: '実用的な理想主義、建設的な変化'
+}
+
+# ナンバーごとの人生の傾向（鑑定文用）
+NUMBER_ANALYSES: Dict[int, str] = {
+    1: "リーダーシップと創造性に満ちた人生が待っています。独立心を大切にし、新しい道を切り開いていきましょう。",
+    2: "協調性とバランス感覚があなたの強みです。周囲との調和を大切にし、平和な関係を築いていきましょう。",
+    3: "表現力と創造性が豊かな人生が約束されています。芸術やコミュニケーションの分野で才能を発揮できるでしょう。",
+    4: "安定と実用性を重視する人生です。着実に努力を重ね、長期的な目標に向かって進んでいきましょう。",
+    5: "自由と変化に満ちた人生が待っています。新しい経験を恐れず、冒険心を持って挑戦していきましょう。",
+    6: "責任感と愛情深さがあなたの特徴です。家族や周囲の人々を大切にし、調和の取れた関係を築いていきましょう。",
+    7: "精神性と内省的な人生が約束されています。深い思考と直感を大切にし、内面の成長を目指していきましょう。",
+    8: "成功と物質的達成があなたの目標です。リーダーシップを発揮し、大きな成果を上げることができるでしょう。",
+    9: "完成と智慧に満ちた人生です。奉仕の精神を持ち、他者のために行動することで、真の幸せを見つけられるでしょう。",
+    11: "直感と啓示に満ちた特別な人生です。スピリチュアルな成長を目指し、高い意識レベルを追求していきましょう。",
+    22: "マスタービルダーとしての使命があります。大きな夢を実現し、社会に貢献する人生が待っています。",
+    33: "マスターティーチャーとしての特別な使命があります。他者を癒し、導くことで、真の幸せを見つけられるでしょう。"
+}
@@ -0,0 +1,131 @@
+"""
+数秘術の相性スコアテーブル
+取り得る全ナンバーの組み合わせについて相性スコアを起動時に事前計算し、O(1)で参照する
+"""
+
+import numpy as np
+from typing import Dict, Any, List, Tuple
+
+# 数秘術で扱うナンバー（1-9とマスターナンバー）
+NUMEROLOGY_NUMBERS: Tuple[int, ...] = (1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33, 44)
+_INDEX = {number: index for index, number in enumerate(NUMEROLOGY_NUMBERS)}
+
+# 相性スコアに使うナンバーと重み（ライフパスを最重視）
+SCORE_DIMENSIONS: Tuple[Tuple[str, float], ...] = (
+    ('life_path', 0.4),
+    ('destiny', 0.25),
+    ('soul', 0.25),
+    ('personal', 0.1),
+)
+
+# 同じ性質を持つナンバーのグループ（精神型・実務型・表現型）
+_NUMBER_GROUPS = ({1, 5, 7}, {2, 4, 8}, {3, 6, 9})
+
+# グループをまたいで調和しやすい組み合わせ
+_FRIENDLY_PAIRS = {
+    frozenset(pair) for pair in [(1, 3), (1, 9), (2, 6), (2, 9), (3, 5), (4, 6), (4, 7), (5, 9), (6, 8), (7, 9)]
+}
+
+# 価値観がぶつかりやすい組み合わせ
+_CHALLENGING_PAIRS = {
+    frozenset(pair) for pair in [(1, 8), (1, 4), (3, 4), (4, 5), (5, 6), (7, 8), (2, 5), (3, 7)]
+}
+
+SAME_GROUP_SCORE = 90
+SAME_NUMBER_SCORE = 82
+FRIENDLY_SCORE = 76
+NEUTRAL_SCORE = 60
+CHALLENGING_SCORE = 42
+MASTER_BONUS = 3  # マスターナンバー1つにつき加点
+
+MIN_SCORE = 20
+
+
+def _root(number: int) -> int:
+    """マスターナンバーを1桁に還元（11→2, 22→4, 33→6, 44→8）"""
+    while number > 9:
+        number = sum(int(digit) for digit in str(number))
+    return number
+
+
+def pair_score(a: int, b: int) -> int:
+    """2つのナンバーの相性スコア（0-100）"""
+    root_a, root_b = _root(a), _root(b)
+    if root_a == root_b:
+        score = SAME_NUMBER_SCORE
+    elif any(root_a in group and root_b in group for group in _NUMBER_GROUPS):
+        score = SAME_GROUP_SCORE
+    elif frozenset((root_a, root_b)) in _FRIENDLY_PAIRS:
+        score = FRIENDLY_SCORE
+    elif frozenset((root_a, root_b)) in _CHALLENGING_PAIRS:
+        score = CHALLENGING_SCORE
+    else:
+        score = NEUTRAL_SCORE
+    score += MASTER_BONUS * ((a > 9) + (b > 9))
+    return max(0, min(100, score))
+
+
+def build_pair_table() -> np.ndarray:
+    """13x13の対称な相性スコア表（uint8）を生成"""
+    size = len(NUMEROLOGY_NUMBERS)
+    table = np.zeros((size, size), dtype=np.uint8)
+    for i, a in enumerate(NUMEROLOGY_NUMBERS):
+        for j in range(i, size):
+            table[i, j] = table[j, i] = pair_score(a, NUMEROLOGY_NUMBERS[j])
+    return table
+
+
+class NumerologyScoreTable:
+    """
+    数秘術の相性スコアテーブル
+    4次元（LP/D/S/P）それぞれの13x13ペア表を (4, 13, 13) のuint8配列として保持し、
+    二人分のナンバーから重み付き合計をO(1)で算出する
+    """
+
+    def __init__(self):
+        pair_table = build_pair_table()
+        # 次元ごとに個別調整できるよう、ナンバーの種類ごとに表を持つ
+        self.tables = np.stack([pair_table] * len(SCORE_DIMENSIONS))
+        self.tables.setflags(write=False)
+        self.weights = np.array([weight for _, weight in SCORE_DIMENSIONS], dtype=np.float32)
+
+    @staticmethod
+    def _numbers(reading: Dict[str, Any]) -> Tuple[int, ...]:
+        return tuple(int(reading[key]['number']) for key, _ in SCORE_DIMENSIONS)
+
+    def lookup(self, numbers1: Tuple[int, ...], numbers2: Tuple[int, ...]) -> int:
+        """ナンバーの組（LP, D, S, P）同士のスコア。未知のナンバーはKeyErrorを送出"""
+        score = 0.0
+        for dimension, (a, b) in enumerate(zip(numbers1, numbers2)):
+            score += self.weights[dimension] * self.tables[dimension, _INDEX[a], _INDEX[b]]
+        return max(MIN_SCORE, int(round(score)))
+
+    def score(self, reading1: Dict[str, Any], reading2: Dict[str, Any]) -> int:
+        """get_numerology_readingの結果2つから相性スコア（0-100）を返す"""
+        return self.lookup(self._numbers(reading1), self._numbers(reading2))
+
+    def matrix(self, readings: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        N人分のget_numerology_readingの結果から、全ペアの相性スコアを (N, N) のint配列として一度に算出
+        （[i, j] はlookup(i, j)と同じ値、未知のナンバーはKeyErrorを送出）
+        """
+        # (N, 4) のテーブル上のインデックス
+        indices = np.array([[_INDEX[number] for number in self._numbers(reading)] for reading in readings], dtype=np.intp).reshape(len(readings), len(SCORE_DIMENSIONS))
+        dimensions = np.arange(len(SCORE_DIMENSIONS))
+        # (4, N, N): 次元ごとに全ペアのスコアを引き、重み付きで合計
+        pair_scores = self.tables[dimensions[:, None, None], indices.T[:, :, None], indices.T[:, None, :]]
+        weighted = np.tensordot(self.weights, pair_scores.astype(np.float32), axes=1)
+        return np.maximum(MIN_SCORE, np.rint(weighted)).astype(np.int32)
+
+
+# 起動時に一度だけ構築する共有テーブル（約700バイト）
+numerology_score_table = NumerologyScoreTable()
+
+
+if __name__ == "__main__":
+    print("数秘術相性ペア表（行・列: ナンバー）")
+    print("    " + ''.join(f"{number:>4}" for number in NUMEROLOGY_NUMBERS))
+    for number, row in zip(NUMEROLOGY_NUMBERS, numerology_score_table.tables[0]):
+        print(f"{number:>4}" + ''.join(f"{value:>4}" for value in row))
+    print(f"\nテーブルサイズ: {numerology_score_table.tables.nbytes}バイト")
+    print(f"例: (LP1, D5, S7, P3) × (LP11, D4, S2, P6) = {numerology_score_table.lookup((1, 5, 7, 3), (11, 4, 2, 6))}")
@@ -0,0 +1,187 @@
+"""
+プロンプト構築とトークン予算管理
+プロバイダーごとのトークン数を概算し、入力予算を超える場合は優先度の低いセクションから圧縮・切り詰める
+"""
+
+import os
+import re
+import threading
+from typing import Dict, Any, List, Callable, Tuple
+
+# プロバイダーごとの1文字あたりのトークン数（トークナイザーの概算）
+# Llama 3（Groq）は日本語がほぼ1文字1トークン、Gemini（SentencePiece）は日本語の分割が粗い
+_TOKEN_RATES: Dict[str, Dict[str, float]] = {
+    'groq': {'cjk': 1.0, 'ascii': 0.25, 'other': 0.5},
+    'gemini': {'cjk': 0.6, 'ascii': 0.25, 'other': 0.4},
+}
+_DEFAULT_RATES = _TOKEN_RATES['groq']
+
+# プロバイダーごとの入力トークン予算
+DEFAULT_BUDGETS = {
+    'groq': int(os.getenv('PROMPT_BUDGET_GROQ', '1500')),
+    'gemini': int(os.getenv('PROMPT_BUDGET_GEMINI', '1500')),
+}
+
+TRUNCATION_MARK = '…'
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿＀-￯　-〿]+')
+_SENTENCE_END = re.compile(r'(?<=[。！？!?\n])')
+
+
+def count_tokens(text: str, provider: str = 'groq') -> int:
+    """プロバイダーのトークナイザーを近似したトークン数"""
+    if not text:
+        return 0
+    rates = _TOKEN_RATES.get(provider, _DEFAULT_RATES)
+    cjk = len(text) - len(_CJK_PATTERN.sub('', text))
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    other = len(text) - cjk - ascii_chars
+    return int(round(cjk * rates['cjk'] + ascii_chars * rates['ascii'] + other * rates['other'])) + 1
+
+
+def first_sentences(text: str, max_chars: int) -> str:
+    """文の区切りを保ったまま先頭からmax_chars以内に収める"""
+    text = (text or '').strip()
+    if len(text) <= max_chars:
+        return text
+    result = ''
+    for sentence in _SENTENCE_END.split(text):
+        if len(result) + len(sentence) > max_chars:
+            break
+        result += sentence
+    return result.strip() or text[:max_chars - 1] + TRUNCATION_MARK
+
+
+class PromptSection:
+    """プロンプトの1セクション（priorityが大きいほど先に圧縮・削除される。0は必須）"""
+
+    def __init__(self, name: str, text: str, priority: int = 0, compact: str | Callable[[], str] | None = None, min_chars: int = 0):
+        self.name = name
+        self.text = text or ''
+        self.priority = priority
+        self.compact = compact
+        self.min_chars = min_chars
+
+    def compacted(self) -> str | None:
+        if self.compact is None:
+            return None
+        return self.compact() if callable(self.compact) else self.compact
+
+
+class BuiltPrompt:
+    """構築済みプロンプトとトークン数"""
+
+    def __init__(self, text: str, tokens: Dict[str, int], adjustments: List[str]):
+        self.text = text
+        self.tokens = tokens
+        self.adjustments = adjustments  # 圧縮・切り詰めを行ったセクション
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class PromptBuilder:
+    """
+    セクション単位でプロンプトを組み立て、全プロバイダーの入力予算に収まるよう調整する。
+    調整は priority の大きいセクションから「圧縮版への置換 → 末尾の切り詰め → 削除」の段階順に行う。
+    """
+
+    def __init__(self, providers: Tuple[str, ...] = ('gemini', 'groq'), budgets: Dict[str, int] | None = None):
+        self.providers = providers
+        self.budgets = {name: (budgets or DEFAULT_BUDGETS).get(name, DEFAULT_BUDGETS['groq']) for name in providers}
+        self.sections: List[PromptSection] = []
+
+    def add(self, name: str, text: str, priority: int = 0, compact: str | Callable[[], str] | None = None, min_chars: int = 0) -> 'PromptBuilder':
+        self.sections.append(PromptSection(name, text, priority, compact, min_chars))
+        return self
+
+    def _render(self) -> str:
+        return "\n\n".join(section.text.strip('\n') for section in self.sections if section.text.strip())
+
+    def _overflow(self, text: str) -> int:
+        """予算超過量（全プロバイダー中の最大、超過なしなら0以下）"""
+        return max(count_tokens(text, name) - budget for name, budget in self.budgets.items())
+
+    def _truncate(self, section: PromptSection) -> bool:
+        """予算に収まる最長の長さまでセクション末尾を切り詰める（収まらない場合はmin_charsまで削ってFalse）"""
+        original = section.text
+        low, high = min(section.min_chars, len(original)), len(original)
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            section.text = original[:middle].rstrip() + TRUNCATION_MARK
+            if self._overflow(self._render()) <= 0:
+                best = section.text
+                low = middle + 1
+            else:
+                high = middle - 1
+        if best is None:
+            section.text = original[:section.min_chars].rstrip() + TRUNCATION_MARK if section.min_chars < len(original) else original
+            return False
+        section.text = best
+        return True
+
+    def build(self) -> BuiltPrompt:
+        adjustments = []
+        # 同じ優先度では長いセクションから調整する
+        candidates = sorted((s for s in self.sections if s.priority > 0), key=lambda s: (-s.priority, -len(s.text)))
+
+        # 1. 圧縮版に置き換える
+        for section in candidates:
+            if self._overflow(self._render()) <= 0:
+                break
+            compacted = section.compacted()
+            if compacted is not None and len(compacted) < len(section.text):
+                section.text = compacted
+                adjustments.append(f"{section.name}:compact")
+
+        # 2. 末尾を切り詰める
+        for section in candidates:
+            if self._overflow(self._render()) <= 0:
+                break
+            before = section.text
+            fitted = self._truncate(section)
+            if section.text != before:
+                adjustments.append(f"{section.name}:truncate")
+            if fitted:
+                break
+
+        # 3. それでも収まらない場合はセクションごと削除
+        for section in candidates:
+            if self._overflow(self._render()) <= 0:
+                break
+            section.text = ''
+            adjustments.append(f"{section.name}:drop")
+
+        text = self._render()
+        tokens = {name: count_tokens(text, name) for name in self.providers}
+        if adjustments:
+            print(f"プロンプトを予算内に調整: {', '.join(adjustments)} → {tokens}")
+        return BuiltPrompt(text, tokens, adjustments)
+
+
+class PromptTokenStats:
+    """プロバイダーごとの呼び出し単位の入力トークン数の統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, provider: str, tokens: int):
+        with self._lock:
+            stats = self._stats.setdefault(provider, {'calls': 0, 'total_tokens': 0, 'max_tokens': 0, 'last_tokens': 0})
+            stats['calls'] += 1
+            stats['total_tokens'] += tokens
+            stats['max_tokens'] = max(stats['max_tokens'], tokens)
+            stats['last_tokens'] = tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                provider: dict(stats, avg_tokens=round(stats['total_tokens'] / stats['calls'], 1) if stats['calls'] else 0.0, budget=DEFAULT_BUDGETS.get(provider))
+                for provider, stats in self._stats.items()
+            }
+
+
+# プロセス全体で共有するトークン統計
+prompt_token_stats = PromptTokenStats()
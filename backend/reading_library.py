@@ -0,0 +1,165 @@
+"""
+事前生成した鑑定文ライブラリ
+相談内容のない（または一般的な）鑑定はチャートのシグネチャだけで決まるため、
+バッチで生成した基本鑑定文をローカルのSQLiteに保存しておき、LLMを呼ばずに返す
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Tuple
+
+from consultation_similarity import normalize_consultation
+
+# プロンプトを変更したら上げる（古いバージョンの鑑定文は返さない）
+READING_LIBRARY_VERSION = int(os.getenv('READING_LIBRARY_VERSION', '1'))
+
+DEFAULT_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'reading_library.sqlite')
+
+# バッチ生成時にニックネームの代わりに使う名前と、保存時のプレースホルダー
+GENERATION_NICKNAME = '〇〇'
+NICKNAME_PLACEHOLDER = '{nickname}'
+
+# 星座（日本語名、ai_analysisの_convert_sign_to_japaneseと同じ表記）
+SIGN_NAMES: Tuple[str, ...] = (
+    '牡羊座', '牡牛座', '双子座', '蟹座', '獅子座', '乙女座',
+    '天秤座', '蠍座', '射手座', '山羊座', '水瓶座', '魚座'
+)
+
+# 一般的な運勢の相談（正規化後に完全一致するもの）
+_GENERIC_PATTERN = re.compile(
+    r'^(?:今日|きょう|本日)?(?:の)?(?:私|わたし|自分)?(?:の)?'
+    r'(?:運勢|運気|全体運|総合運|性格|基本的な性格|一般的な運勢)?'
+    r'(?:について|を|が|は)?(?:教えて(?:ください|下さい)?|知りたい(?:です)?|占って(?:ください|下さい)?|見て(?:ください|下さい)?)?$'
+)
+
+
+def is_generic_consultation(consultation: str) -> bool:
+    """相談内容が空、または個別の質問を含まない一般的な運勢の相談か"""
+    normalized = normalize_consultation(consultation or '')
+    return bool(_GENERIC_PATTERN.match(normalized))
+
+
+def numerology_signature(numerology_data: Dict[str, Any]) -> str:
+    """数秘術のシグネチャ（6つの数）"""
+    keys = ('life_path', 'destiny', 'soul', 'personal', 'birthday', 'maturity')
+    return "numerology_" + "_".join(str(numerology_data[key]['number']) for key in keys)
+
+
+def horoscope_signature(sun_sign: str, moon_sign: str, rising_sign: str) -> str:
+    """西洋占星術のシグネチャ（日本語の星座名）"""
+    return f"horoscope_{sun_sign}_{moon_sign}_{rising_sign}"
+
+
+def horoscope_signatures() -> Iterator[Tuple[str, str, str]]:
+    """太陽・月・上昇星座の全組み合わせ（1,728通り）"""
+    for sun in SIGN_NAMES:
+        for moon in SIGN_NAMES:
+            for rising in SIGN_NAMES:
+                yield sun, moon, rising
+
+
+def to_template(text: str, nickname: str = GENERATION_NICKNAME) -> str:
+    """生成時の仮のニックネームをプレースホルダーに置き換える"""
+    return text.replace(nickname, NICKNAME_PLACEHOLDER)
+
+
+class ReadingLibrary:
+    """シグネチャ → 基本鑑定文（バージョン付き）のSQLiteストア"""
+
+    def __init__(self, path: str | None = None, version: int = READING_LIBRARY_VERSION):
+        self.path = path or os.getenv('READING_LIBRARY_PATH', DEFAULT_LIBRARY_PATH)
+        self.version = version
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._disabled = False
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def _connection(self) -> sqlite3.Connection | None:
+        if self._conn is None and not self._disabled:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS readings (
+                        signature TEXT NOT NULL,
+                        version INTEGER NOT NULL,
+                        text TEXT NOT NULL,
+                        created_at TEXT NOT NULL,
+                        PRIMARY KEY (signature, version)
+                    )
+                """)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # ライブラリが使えなくても鑑定はLLMで継続する
+                print(f"鑑定文ライブラリを開けません（{self.path}）: {e}")
+                self._disabled = True
+                self._conn = None
+        return self._conn
+
+    def get(self, signature: str, nickname: str = 'あなた') -> str | None:
+        """現在のバージョンの鑑定文をニックネームを埋め込んで返す（未生成ならNone）"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT text FROM readings WHERE signature = ? AND version = ?", (signature, self.version)
+            ).fetchone()
+            self._stats['hits' if row else 'misses'] += 1
+        if row is None:
+            return None
+        return row[0].replace(NICKNAME_PLACEHOLDER, nickname)
+
+    def put(self, signature: str, text: str):
+        """鑑定文（プレースホルダー入り）を現在のバージョンで保存"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO readings (signature, version, text, created_at) VALUES (?, ?, ?, ?)",
+                (signature, self.version, text, datetime.utcnow().isoformat())
+            )
+            conn.commit()
+
+    def existing(self, signatures: List[str]) -> set:
+        """現在のバージョンで生成済みのシグネチャ"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return set()
+            found = set()
+            for start in range(0, len(signatures), 500):
+                chunk = signatures[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT signature FROM readings WHERE version = ? AND signature IN ({','.join('?' * len(chunk))})",
+                    (self.version, *chunk)
+                ).fetchall()
+                found.update(row[0] for row in rows)
+            return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            conn = self._connection()
+            if conn is not None:
+                counts = dict(conn.execute(
+                    "SELECT substr(signature, 1, instr(signature, '_') - 1), COUNT(*) FROM readings WHERE version = ? GROUP BY 1",
+                    (self.version,)
+                ).fetchall())
+            else:
+                counts = {}
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'version': self.version,
+            'entries': counts,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0
+        })
+        return stats
+
+
+# プロセス全体で共有する鑑定文ライブラリ
+reading_library = ReadingLibrary()
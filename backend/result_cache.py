@@ -0,0 +1,140 @@
+"""
+占い結果キャッシュ
+数秘術・ホロスコープ（とその総合・グループ占い）は、占術・プロフィールの出生データと名前・相談内容・対象日が同じなら結果も同じになるため、
+入力を正規化したハッシュと計算エンジンのバージョンをキーに、生成した結果全体（チャートSVGを含む）を保存して再利用する
+タロットは毎回カードを引き直すため、シードを指定した場合のみキャッシュする
+"""
+
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Any, Set
+
+# 計算ロジック・鑑定文の生成方法を変えたら上げる（キーに含まれるため、古い結果はすべてミスになる）
+ENGINE_VERSION = os.getenv('DIVINATION_ENGINE_VERSION', '2026.10')
+
+# キーに含めるプロフィールの項目（鑑定文・チャートに表れるもの）
+PROFILE_FIELDS = ('nickname', 'name_hiragana', 'birth_date', 'birth_time', 'birth_location_json')
+
+# 同じ入力なら同じ結果になる占術（タロットはシード指定時のみ）
+DETERMINISTIC_TYPES = ('numerology', 'horoscope', 'comprehensive')
+
+
+def result_cache_key(request_data: Dict[str, Any], quick: bool, comprehensive_mode: str, today: date | None = None) -> str | None:
+    """
+    リクエストの正規化ハッシュ（キャッシュできないリクエストはNone）
+    今日の運勢や「来週」などの相談内容は日付で変わるため、生成日もキーに含める
+    """
+    fortune_type = request_data.get('type')
+    profiles = request_data.get('profiles') or []
+    seed = request_data.get('tarot_seed')
+    if not profiles:
+        return None
+    if fortune_type == 'tarot':
+        if seed is None:
+            return None
+    elif fortune_type not in DETERMINISTIC_TYPES:
+        return None
+    canonical = {
+        'engine': ENGINE_VERSION,
+        'type': fortune_type,
+        'profiles': [{field: profile.get(field) for field in PROFILE_FIELDS} for profile in profiles],
+        'consultation': (request_data.get('consultation') or '').strip(),
+        'date': (today or date.today()).isoformat(),
+        # クイック鑑定（テンプレート）とLLMの鑑定文、総合占いの生成方式では結果が異なる
+        'quick': quick,
+        'comprehensive_mode': comprehensive_mode if fortune_type == 'comprehensive' else None,
+        'tarot_seed': seed if fortune_type == 'tarot' else None
+    }
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """占い結果のLRUキャッシュ（プロフィールIDから該当エントリを引けるようにし、プロフィール変更時に削除する）"""
+
+    def __init__(self, size_limit: int = 500, ttl: float = 24 * 3600):
+        self.size_limit = size_limit
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._profile_keys: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+    @staticmethod
+    def _profile_ids(request_data: Dict[str, Any]) -> Set[str]:
+        return {str(profile['profile_id']) for profile in request_data.get('profiles') or [] if profile.get('profile_id') is not None}
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        """保存済みの結果の複製を返す（呼び出し側で書き換えても影響しない）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry['created_at'] > self.ttl:
+                self._remove(key)
+                self._stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            result = entry['result']
+        return copy.deepcopy(result)
+
+    def set(self, key: str, request_data: Dict[str, Any], result: Dict[str, Any]):
+        """結果を保存（リクエスト単位の利用量・計測は除く）"""
+        stored = copy.deepcopy({name: value for name, value in result.items() if name not in ('llm_usage', 'stage_trace')})
+        profile_ids = self._profile_ids(request_data)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {'result': stored, 'profile_ids': profile_ids, 'created_at': time.time()}
+            for profile_id in profile_ids:
+                self._profile_keys.setdefault(profile_id, set()).add(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.size_limit:
+                self._remove(next(iter(self._entries)))
+                self._stats['evicted'] += 1
+
+    def _remove(self, key: str):
+        """エントリとプロフィールの索引を削除（ロック取得済みで呼ぶ）"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for profile_id in entry['profile_ids']:
+            keys = self._profile_keys.get(profile_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._profile_keys[profile_id]
+
+    def invalidate_profile(self, profile_id) -> int:
+        """プロフィールを含む結果をすべて削除し、削除件数を返す"""
+        with self._lock:
+            keys = list(self._profile_keys.get(str(profile_id), ()))
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidated'] += len(keys)
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                size=len(self._entries),
+                size_limit=self.size_limit,
+                hit_rate=round(self._stats['hits'] / lookups, 3) if lookups else None,
+                engine_version=ENGINE_VERSION
+            )
+
+
+# プロセス全体で共有する占い結果キャッシュ
+result_cache = ResultCache(
+    size_limit=int(os.getenv('DIVINATION_RESULT_CACHE_SIZE', '500')),
+    ttl=float(os.getenv('DIVINATION_RESULT_CACHE_TTL', str(24 * 3600)))
+)
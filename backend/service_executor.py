@@ -0,0 +1,152 @@
+"""
+占い結果生成サービスの共有実行スケジューラー
+リクエストごとにスレッドプールを作り直さず、CPU処理（数秘術・ホロスコープ計算）とI/O処理（LLM呼び出し）を
+プロセス全体で共有する上限付きのプールで実行し、待ち行列が埋まったら新しい処理を受け付けずに503で返す
+"""
+
+import os
+import math
+import threading
+import time
+import contextvars
+import concurrent.futures
+from typing import Dict, Any, Callable
+
+
+class QueueFullError(RuntimeError):
+    """共有プールの待ち行列が上限に達し、処理を受け付けられないことを示す例外（APIでは503 + Retry-Afterに変換）"""
+
+    def __init__(self, pool: str, retry_after: int):
+        super().__init__(f"{pool}プールの待ち行列が上限に達しています（{retry_after}秒後に再試行してください）")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class BoundedPool:
+    """同時実行数と待ち行列の長さに上限を持つスレッドプール（実行中・待機中の件数をゲージとして公開）"""
+
+    def __init__(self, name: str, workers: int, queue_limit: int, retry_after_min: int = 1):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_limit = max(0, queue_limit)
+        self.retry_after_min = retry_after_min
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'divination-{name}')
+        self._lock = threading.Lock()
+        # このプールのワーカースレッドで実行中か（タスク内からの投入を見分ける）
+        self._local = threading.local()
+        self._queued = 0
+        self._active = 0
+        # 1件あたりの処理時間の指数移動平均（Retry-Afterの見積もりに使う）
+        self._avg_duration: float | None = None
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'peak_queued': 0, 'caller_runs': 0}
+
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        """
+        呼び出し元のコンテキスト（LLM優先度・利用量の記録先など）を引き継いで実行（満杯ならQueueFullErrorを送出）
+        このプールのタスク内からの投入（セクションの並列生成など）で空きワーカーがなければ、
+        ワーカー同士の待ち合わせでプールが詰まらないよう呼び出し元のスレッドで実行する
+        """
+        with self._lock:
+            if getattr(self._local, 'inside', False) and self._active + self._queued >= self.workers:
+                self._stats['caller_runs'] += 1
+                caller_runs = True
+            else:
+                caller_runs = False
+        if caller_runs:
+            return self._run_in_caller(fn, args)
+        with self._lock:
+            if self._queued >= self.queue_limit and self._active >= self.workers:
+                self._stats['rejected'] += 1
+                raise QueueFullError(self.name, self._retry_after())
+            self._queued += 1
+            self._stats['submitted'] += 1
+            self._stats['peak_queued'] = max(self._stats['peak_queued'], self._queued)
+        return self._executor.submit(self._run, contextvars.copy_context(), fn, args)
+
+    @staticmethod
+    def _run_in_caller(fn: Callable, args: tuple) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _run(self, context: contextvars.Context, fn: Callable, args: tuple):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        self._local.inside = True
+        started = time.perf_counter()
+        failed = False
+        try:
+            return context.run(fn, *args)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._local.inside = False
+            duration = time.perf_counter() - started
+            with self._lock:
+                self._active -= 1
+                self._stats['failed' if failed else 'completed'] += 1
+                self._avg_duration = duration if self._avg_duration is None else 0.8 * self._avg_duration + 0.2 * duration
+
+    def has_capacity(self) -> bool:
+        with self._lock:
+            return self._queued < self.queue_limit or self._active < self.workers
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self) -> int:
+        """待ち行列がはけるまでのおおよその秒数（ロック取得済みで呼ぶ）"""
+        average = self._avg_duration or 1.0
+        return max(self.retry_after_min, math.ceil(average * (self._queued + 1) / self.workers))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self._stats,
+                queued=self._queued,
+                active=self._active,
+                workers=self.workers,
+                queue_limit=self.queue_limit,
+                avg_duration=round(self._avg_duration, 3) if self._avg_duration is not None else None
+            )
+
+
+class ServiceExecutor:
+    """CPU処理用とI/O処理用の共有プール"""
+
+    def __init__(self, cpu_workers: int, io_workers: int, cpu_queue: int, io_queue: int, retry_after_min: int = 1):
+        self.cpu = BoundedPool('cpu', cpu_workers, cpu_queue, retry_after_min)
+        self.io = BoundedPool('io', io_workers, io_queue, retry_after_min)
+
+    def submit_cpu(self, fn: Callable, *args) -> concurrent.futures.Future:
+        """数秘術・ホロスコープなどの計算処理を実行"""
+        return self.cpu.submit(fn, *args)
+
+    def submit_io(self, fn: Callable, *args) -> concurrent.futures.Future:
+        """LLM呼び出しなどの待ち時間が主な処理を実行"""
+        return self.io.submit(fn, *args)
+
+    def check_capacity(self):
+        """どちらかのプールが満杯ならQueueFullErrorを送出（処理を始める前の受付判定用）"""
+        for pool in (self.cpu, self.io):
+            if not pool.has_capacity():
+                raise QueueFullError(pool.name, pool.retry_after())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'cpu': self.cpu.snapshot(), 'io': self.io.snapshot()}
+
+
+# プロセス全体で共有する実行スケジューラー
+service_executor = ServiceExecutor(
+    cpu_workers=int(os.getenv('SERVICE_CPU_WORKERS', str(os.cpu_count() or 2))),
+    io_workers=int(os.getenv('SERVICE_IO_WORKERS', '16')),
+    cpu_queue=int(os.getenv('SERVICE_CPU_QUEUE', '32')),
+    io_queue=int(os.getenv('SERVICE_IO_QUEUE', '64')),
+    retry_after_min=int(os.getenv('SERVICE_RETRY_AFTER', '2'))
+)
@@ -0,0 +1,77 @@
+"""
+複数の占いで共有する入力の計算結果（ローマ字変換・ジオコーディング・出生図）
+バッチ処理の間だけ有効なメモを用意し、同じプロフィールの入力は1回だけ計算して各占いで使い回す
+並行して同じ入力を求められた場合は、先に始めた計算の完了を待って結果を共有する
+"""
+
+import copy
+import json
+import threading
+import contextvars
+import concurrent.futures
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Hashable, Tuple
+
+# 実行中のバッチのメモ（バッチ外では何も共有せず毎回計算する）
+_current: contextvars.ContextVar['SharedInputs | None'] = contextvars.ContextVar('shared_inputs', default=None)
+
+
+class SharedInputs:
+    """種類・キーごとに計算結果を保持するメモ（値は呼び出し側が書き換えても影響しないよう複製して返す）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, Hashable], concurrent.futures.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def get_or_compute(self, kind: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            stats = self._stats.setdefault(kind, {'computed': 0, 'shared': 0})
+            future = self._values.get((kind, key))
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._values[(kind, key)] = future
+                stats['computed'] += 1
+            else:
+                stats['shared'] += 1
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                future.set_exception(e)
+        return copy.deepcopy(future.result())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {kind: dict(counts) for kind, counts in self._stats.items()}
+
+
+@contextmanager
+def shared_inputs():
+    """このコンテキスト内（共有プールへ引き継がれた処理を含む）で共有入力のメモを有効にする"""
+    memo = SharedInputs()
+    token = _current.set(memo)
+    try:
+        yield memo
+    finally:
+        _current.reset(token)
+
+
+def memoized(kind: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+    """バッチ内なら共有メモから、バッチ外ならその場で計算して返す"""
+    memo = _current.get()
+    if memo is None:
+        return compute()
+    return memo.get_or_compute(kind, key, compute)
+
+
+def birth_key(profile_data: Dict[str, Any], *extra: Hashable) -> Tuple[Hashable, ...]:
+    """出生図の計算に使う項目（ニックネームはチャートの表示名に使う）からメモのキーを作る"""
+    location = json.dumps(profile_data.get('birth_location_json') or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return (
+        profile_data.get('nickname'),
+        profile_data.get('birth_date'),
+        profile_data.get('birth_time'),
+        location
+    ) + extra
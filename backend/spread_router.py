@@ -0,0 +1,351 @@
+"""
+タロットスプレッドのローカル選択
+キーワード重みと文字n-gramモデルで相談内容からスプレッドを判定し、確信度が低い場合のみLLMに委ねる
+判定はすべて判定ログに残し、有効にすれば一定割合を確信度に関係なくバックグラウンドでLLMに判定させて学習・評価用の正解ラベルにする
+相談内容はそのまま保存せず、鍵付きハッシュにした文字n-gramとキーワードスコアだけを記録する
+"""
+
+import os
+import json
+import math
+import atexit
+import random
+import hashlib
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Callable
+
+SPREAD_IDS = ('threeCards', 'celticCross', 'horseshoe')
+
+PERSONAL = 'personal'
+COMPATIBILITY = 'compatibility'
+
+# 確信度（上位スプレッドのソフトマックス確率）がこの値未満の場合はLLMを補助判定に使う
+DEFAULT_CONFIDENCE_THRESHOLD = 0.5
+
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'spread_decisions.jsonl')
+
+# n-gramのハッシュ鍵（変えると既存の判定ログのn-gramとは一致しなくなる）
+_HASH_KEY = os.getenv('TAROT_SPREAD_HASH_KEY', '').encode('utf-8')[:64]
+
+# 占い種別ごとの事前スコア（従来のフォールバックと同じく個人は3枚、相性はケルト十字を優先）
+_PRIORS: Dict[str, Dict[str, float]] = {
+    PERSONAL: {'threeCards': 0.5, 'celticCross': 0.0, 'horseshoe': 0.0},
+    COMPATIBILITY: {'threeCards': 0.0, 'celticCross': 0.5, 'horseshoe': 0.0},
+}
+
+# キーワードとスプレッドごとの重み
+_KEYWORD_WEIGHTS: Dict[str, Dict[str, Dict[str, float]]] = {
+    PERSONAL: {
+        'horseshoe': {
+            '未来': 1.5, '将来': 1.5, 'これから': 1.2, '今後': 1.2, '流れ': 1.2, '方向': 1.0,
+            '行方': 1.2, '展望': 1.0, '見通し': 1.0, '進むべき': 1.0, 'この先': 1.2,
+        },
+        'celticCross': {
+            '詳細': 1.5, '詳しく': 1.5, '分析': 1.2, '複雑': 1.5, '深く': 1.2, '原因': 1.0,
+            '根本': 1.2, '総合': 1.0, '全体': 0.8, '迷って': 1.0, '悩み': 0.8, '問題': 0.8, 'どうすれば': 0.8,
+        },
+        'threeCards': {
+            '今日': 1.2, '明日': 1.0, '今週': 1.0, '簡単': 1.2, 'ざっくり': 1.2, '一言': 1.2,
+            '気軽': 1.0, 'ちょっと': 0.8, '過去': 0.8, '現在': 0.6, '運勢': 0.6,
+        },
+    },
+    COMPATIBILITY: {
+        'horseshoe': {
+            '今後': 1.5, 'これから': 1.5, '将来': 1.5, '未来': 1.5, '進展': 1.2, '行方': 1.2,
+            '流れ': 1.2, '発展': 1.0, '結婚': 1.0, '付き合え': 1.0, 'この先': 1.2,
+        },
+        'celticCross': {
+            '詳しく': 1.5, '詳細': 1.5, '複雑': 1.5, '本音': 1.2, '本心': 1.2, '気持ち': 1.0,
+            '問題': 1.0, '悩み': 1.0, '喧嘩': 1.0, '復縁': 1.0, '三角': 1.2, '関係': 0.6,
+        },
+        'threeCards': {
+            '簡単': 1.2, 'ざっくり': 1.2, '気軽': 1.0, '一般': 1.0, '友達': 0.6, '今日': 1.0,
+        },
+    },
+}
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角を統一し小文字化"""
+    return unicodedata.normalize('NFKC', text or '').lower().strip()
+
+
+def char_ngrams(text: str, n: int = 2) -> List[str]:
+    """文字n-gram（1文字以下の場合はそのまま）"""
+    if len(text) <= n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def hashed_ngrams(text: str, n: int = 2) -> List[str]:
+    """正規化した相談内容の文字n-gramを鍵付きハッシュにしたもの（判定ログに相談内容を残さないため）"""
+    return [
+        hashlib.blake2b(gram.encode('utf-8'), digest_size=8, key=_HASH_KEY).hexdigest()
+        for gram in char_ngrams(normalize_text(text), n)
+    ]
+
+
+class SpreadDecision:
+    """スプレッド選択結果"""
+
+    def __init__(self, spread_id: str, confidence: float, source: str, scores: Dict[str, float]):
+        self.spread_id = spread_id
+        self.confidence = confidence
+        self.source = source  # 'local' または 'llm'
+        self.scores = scores
+
+    def __repr__(self) -> str:
+        return f"SpreadDecision(spread_id={self.spread_id}, confidence={self.confidence:.3f}, source={self.source})"
+
+
+class NgramSpreadModel:
+    """判定ログから学習する文字n-gram（ハッシュ済み）の多項ナイーブベイズ"""
+
+    def __init__(self, n: int = 2):
+        self.n = n
+        self.samples = 0
+        self._label_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._gram_counts: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+        self._gram_totals: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._vocab: Dict[str, set] = defaultdict(set)
+
+    def fit(self, samples: List[Tuple[List[str], str, str]]):
+        """(hashed_ngramsのn-gram, 占い種別, スプレッドID) のリストで学習"""
+        for grams, mode, label in samples:
+            if label not in SPREAD_IDS:
+                continue
+            self._label_counts[mode][label] += 1
+            for gram in grams:
+                self._gram_counts[mode][label][gram] += 1
+                self._gram_totals[mode][label] += 1
+                self._vocab[mode].add(gram)
+            self.samples += 1
+        return self
+
+    def mode_samples(self, mode: str) -> int:
+        return sum(self._label_counts[mode].values())
+
+    def predict_proba(self, grams: List[str], mode: str) -> Dict[str, float]:
+        """hashed_ngramsのn-gramからスプレッドごとの事後確率を求める（学習データがない場合は空）"""
+        total = self.mode_samples(mode)
+        if total == 0:
+            return {}
+        vocab_size = len(self._vocab[mode]) + 1
+        log_scores = {}
+        for spread_id in SPREAD_IDS:
+            count = self._label_counts[mode].get(spread_id, 0)
+            log_score = math.log((count + 1) / (total + len(SPREAD_IDS)))
+            gram_total = self._gram_totals[mode].get(spread_id, 0)
+            gram_counts = self._gram_counts[mode].get(spread_id, {})
+            for gram in grams:
+                log_score += math.log((gram_counts.get(gram, 0) + 1) / (gram_total + vocab_size))
+            log_scores[spread_id] = log_score
+        return _softmax(log_scores)
+
+
+def _softmax(scores: Dict[str, float]) -> Dict[str, float]:
+    peak = max(scores.values())
+    exps = {key: math.exp(value - peak) for key, value in scores.items()}
+    total = sum(exps.values())
+    return {key: value / total for key, value in exps.items()}
+
+
+def _log_files(path: str) -> List[str]:
+    """判定ログと、サイズ上限でローテーションした1世代前のログ（古い順）"""
+    return [candidate for candidate in (f"{path}.1", path) if os.path.exists(candidate)]
+
+
+def load_decisions(path: str, sources: Tuple[str, ...] = ('llm',), sampled_only: bool = False) -> List[Dict[str, Any]]:
+    """
+    判定ログ（JSONL）を読み込む。既定ではLLMの判定のみを教師データとして返す。
+    sampled_onlyなら確信度に関係なく抽出してLLMで判定したもの（補助判定の偏りがないもの）に限る
+    """
+    if not path:
+        return []
+    decisions = []
+    for log_file in _log_files(path):
+        with open(log_file, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('spread_id') not in SPREAD_IDS or entry.get('source') not in sources:
+                    continue
+                if sampled_only and not entry.get('sampled'):
+                    continue
+                decisions.append(entry)
+    return decisions
+
+
+class SpreadRouter:
+    """キーワード重み + n-gramモデルによるスプレッド選択（LLMは確信度が低い場合の補助）"""
+
+    def __init__(self, log_path: str | None = None, train: bool = True):
+        self.confidence_threshold = float(os.getenv('TAROT_SPREAD_CONFIDENCE', str(DEFAULT_CONFIDENCE_THRESHOLD)))
+        self.llm_tiebreak = os.getenv('TAROT_SPREAD_LLM_TIEBREAK', 'false').lower() == 'true'
+        self.ngram_weight = float(os.getenv('TAROT_SPREAD_NGRAM_WEIGHT', '2.0'))
+        self.min_training_samples = int(os.getenv('TAROT_SPREAD_MIN_SAMPLES', '30'))
+        # 確信度に関係なくLLMで判定して正解ラベルを作る割合（補助判定だけでは確信度の低い相談に偏るため、既定は無効）
+        # 判定はリクエストとは別にバックグラウンドで最低優先度で行い、1分あたりの件数にも上限を設ける
+        self.label_rate = float(os.getenv('TAROT_SPREAD_LABEL_RATE', '0'))
+        self.label_per_minute = float(os.getenv('TAROT_SPREAD_LABEL_PER_MINUTE', '2'))
+        self._labeler = None
+        # 相談内容そのものを判定ログに残すか（--labelでの再判定・目視確認用、既定では残さない）
+        self.log_text = os.getenv('TAROT_SPREAD_LOG_TEXT', 'false').lower() == 'true'
+        self.log_path = os.getenv('TAROT_SPREAD_LOG', DEFAULT_LOG_PATH) if log_path is None else log_path
+        # 判定ログはまとめて書き込み、上限サイズを超えたら1世代だけ残してローテーションする
+        self.log_buffer_size = int(os.getenv('TAROT_SPREAD_LOG_BUFFER', '50'))
+        self.log_max_bytes = int(os.getenv('TAROT_SPREAD_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+        self.model = NgramSpreadModel()
+        self._log_lock = threading.Lock()
+        self._log_buffer: List[str] = []
+        atexit.register(self.flush)
+        if train:
+            self.train(self.log_path)
+
+    def train(self, path: str) -> int:
+        """判定ログのLLM判定からn-gramモデルを学習し、学習件数を返す"""
+        decisions = load_decisions(path)
+        self.model = NgramSpreadModel().fit([(self.entry_features(d)[1], d.get('mode', PERSONAL), d['spread_id']) for d in decisions])
+        if decisions:
+            print(f"スプレッド選択モデル学習: {len(decisions)}件")
+        return len(decisions)
+
+    def keyword_scores(self, text: str, mode: str) -> Dict[str, float]:
+        """事前スコア + 含まれるキーワードの重み"""
+        normalized = normalize_text(text)
+        scores = dict(_PRIORS.get(mode, _PRIORS[PERSONAL]))
+        for spread_id, keywords in _KEYWORD_WEIGHTS.get(mode, _KEYWORD_WEIGHTS[PERSONAL]).items():
+            for keyword, weight in keywords.items():
+                if keyword in normalized:
+                    scores[spread_id] += weight
+        return scores
+
+    def entry_features(self, entry: Dict[str, Any]) -> Tuple[Dict[str, float], List[str]]:
+        """判定ログの1件からキーワードスコアとn-gramを取り出す（相談内容を残した古いログは再計算する）"""
+        mode = entry.get('mode', PERSONAL)
+        text = entry.get('text') or ''
+        keyword_scores = entry.get('keyword_scores') or self.keyword_scores(text, mode)
+        grams = entry.get('grams')
+        if grams is None:
+            grams = hashed_ngrams(text, self.model.n)
+        return keyword_scores, grams
+
+    def classify(self, text: str, mode: str = PERSONAL) -> SpreadDecision:
+        """ローカルのみでスプレッドを判定"""
+        return self.classify_features(self.keyword_scores(text, mode), hashed_ngrams(text, self.model.n), mode)
+
+    def classify_features(self, keyword_scores: Dict[str, float], grams: List[str], mode: str = PERSONAL) -> SpreadDecision:
+        """キーワードスコアとn-gramから判定（判定ログからの評価にも使う）"""
+        scores = dict(keyword_scores)
+        if self.model.mode_samples(mode) >= self.min_training_samples:
+            for spread_id, probability in self.model.predict_proba(grams, mode).items():
+                scores[spread_id] += self.ngram_weight * probability
+        probabilities = _softmax(scores)
+        spread_id = max(SPREAD_IDS, key=lambda key: probabilities[key])
+        return SpreadDecision(spread_id, probabilities[spread_id], 'local', scores)
+
+    def route(self, text: str, mode: str = PERSONAL, tiebreaker: Callable[[str], str | None] | None = None) -> SpreadDecision:
+        """
+        スプレッドを選択し、判定ログへ追記する。
+        確信度が閾値未満かつLLM補助が有効な場合はtiebreakerの判定を使う。
+        それ以外でもlabel_rateの割合で抽出した相談は、バックグラウンドでtiebreakerに判定させて正解ラベルとして記録する
+        """
+        decision = self.classify(text, mode)
+        if tiebreaker is None:
+            self.record(text, mode, decision)
+            return decision
+
+        if decision.confidence < self.confidence_threshold and self.llm_tiebreak:
+            try:
+                spread_id = tiebreaker(text)
+            except Exception as e:
+                print(f"LLMスプレッド補助判定エラー: {e}")
+                spread_id = None
+            if spread_id in SPREAD_IDS:
+                llm_decision = SpreadDecision(spread_id, decision.confidence, 'llm', decision.scores)
+                self.record(text, mode, llm_decision, local_spread_id=decision.spread_id)
+                return llm_decision
+        elif self._should_sample():
+            self._label_in_background(text, mode, decision, tiebreaker)
+
+        self.record(text, mode, decision)
+        return decision
+
+    def _should_sample(self) -> bool:
+        """正解ラベル用に抽出するか（クイック鑑定ではLLMを使わないため抽出しない）"""
+        if self.label_rate <= 0 or random.random() >= self.label_rate:
+            return False
+        # ai_analysisと同じく絶対インポート（クイック鑑定の状態を共有するため）
+        from template_reading import template_tier_active
+        return not template_tier_active()
+
+    def _label_in_background(self, text: str, mode: str, decision: SpreadDecision, tiebreaker: Callable[[str], str | None]):
+        """tiebreakerの判定をバックグラウンドで最低優先度で行い、抽出した正解ラベルとして記録する（上限を超えた分は見送る）"""
+        if self._labeler is None:
+            from ai_cache import BackgroundRefresher
+            self._labeler = BackgroundRefresher(workers=1, per_minute=self.label_per_minute)
+
+        def job():
+            spread_id = tiebreaker(text)
+            if spread_id in SPREAD_IDS:
+                label = SpreadDecision(spread_id, decision.confidence, 'llm', decision.scores)
+                self.record(text, mode, label, local_spread_id=decision.spread_id, sampled=True)
+        # 同じ相談の判定が重ならないよう、相談内容の鍵付きハッシュをキーにする
+        digest = hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=8, key=_HASH_KEY).hexdigest()
+        self._labeler.schedule(f"spread-label-{mode}-{digest}", job)
+
+    def record(self, text: str, mode: str, decision: SpreadDecision, local_spread_id: str | None = None, sampled: bool = False):
+        """判定ログ（JSONL）に追記（相談内容はTAROT_SPREAD_LOG_TEXTが有効な場合のみ残す）"""
+        if not self.log_path:
+            return
+        entry = {
+            'grams': sorted(hashed_ngrams(text, self.model.n)),
+            'keyword_scores': {spread_id: round(score, 4) for spread_id, score in self.keyword_scores(text, mode).items()},
+            'mode': mode,
+            'spread_id': decision.spread_id,
+            'source': decision.source,
+            'local_spread_id': local_spread_id,
+            'sampled': sampled,
+            'confidence': round(decision.confidence, 4),
+            'timestamp': datetime.now().isoformat()
+        }
+        if self.log_text:
+            entry['text'] = text
+        with self._log_lock:
+            self._log_buffer.append(json.dumps(entry, ensure_ascii=False) + '\n')
+            if len(self._log_buffer) < self.log_buffer_size:
+                return
+        self.flush()
+
+    def flush(self):
+        """バッファした判定ログを書き込む（上限サイズを超えていれば先にローテーションする）"""
+        with self._log_lock:
+            lines, self._log_buffer = self._log_buffer, []
+            if not lines or not self.log_path:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.log_max_bytes:
+                    os.replace(self.log_path, f"{self.log_path}.1")
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+            except OSError as e:
+                print(f"スプレッド判定ログ書き込みエラー: {e}")
+
+
+def extract_spread_id(response_text: str) -> str | None:
+    """LLMの応答から最初に現れるスプレッドIDを取り出す"""
+    positions = [(response_text.find(spread_id), spread_id) for spread_id in SPREAD_IDS if spread_id in response_text]
+    return min(positions)[1] if positions else None
+
+
+# プロセス全体で共有するスプレッドルーター
+spread_router = SpreadRouter()
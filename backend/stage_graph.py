@@ -0,0 +1,162 @@
+"""
+占い結果生成のステージ依存グラフ
+占術ごとに処理ステージと依存関係を宣言し、依存が揃ったステージから共有プールで並行実行する
+デバッグ時はステージごとの待機・実行時間を記録する
+"""
+
+import time
+import contextvars
+import concurrent.futures
+from contextlib import contextmanager
+from typing import Dict, Any, List, Callable, Tuple
+
+# ステージを実行するプール（cpu / io は共有プール、inline は呼び出し元のスレッドで実行する軽い処理）
+INLINE = 'inline'
+
+# 実行中のリクエストのステージ計測（デバッグ時のみ有効）
+_current_trace: contextvars.ContextVar[List[Dict[str, Any]] | None] = contextvars.ContextVar('stage_trace', default=None)
+
+
+@contextmanager
+def stage_trace(enabled: bool = True):
+    """このコンテキスト内で実行したステージの計測結果を集める（enabled=Falseなら何もしない）"""
+    if not enabled:
+        yield None
+        return
+    trace: List[Dict[str, Any]] = []
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class Stage:
+    """処理ステージ（依存するステージの結果を順に引数として受け取る）"""
+
+    def __init__(self, name: str, fn: Callable[..., Any], deps: Tuple[str, ...] = (), pool: str = INLINE):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.pool = pool
+
+
+class StageGraph:
+    """ステージの依存グラフ"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], deps: Tuple[str, ...] = (), pool: str = INLINE) -> 'StageGraph':
+        if name in self.stages:
+            raise ValueError(f"ステージ名が重複しています: {name}")
+        self.stages[name] = Stage(name, fn, deps, pool)
+        return self
+
+    def _validate(self):
+        """未定義の依存と循環を検出"""
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"ステージ {stage.name} の依存 {dep} が定義されていません")
+        visited: Dict[str, bool] = {}
+
+        def visit(name: str):
+            if visited.get(name) is False:
+                raise ValueError(f"ステージの依存が循環しています: {name}")
+            if name in visited:
+                return
+            visited[name] = False
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visited[name] = True
+
+        for name in self.stages:
+            visit(name)
+
+    def run(self, pools: Dict[str, Callable[..., concurrent.futures.Future]]) -> Dict[str, Any]:
+        """
+        依存が揃ったステージから実行し、ステージ名 -> 結果 の辞書を返す
+        poolsはプール名 -> submit関数（呼び出し元のコンテキストを引き継ぐもの）。いずれかのステージが失敗したら例外を送出する
+        """
+        self._validate()
+        trace = _current_trace.get()
+        started = time.perf_counter()
+        results: Dict[str, Any] = {}
+        waiting = dict(self.stages)
+        running: Dict[concurrent.futures.Future, Stage] = {}
+
+        def timed(stage: Stage, queued_at: float, args: list) -> Tuple[Any, float, float, float]:
+            begin = time.perf_counter()
+            value = stage.fn(*args)
+            return value, queued_at, begin, time.perf_counter()
+
+        def record(stage: Stage, queued_at: float, begin: float, end: float):
+            if trace is None:
+                return
+            trace.append({
+                'graph': self.name,
+                'stage': stage.name,
+                'pool': stage.pool,
+                'deps': list(stage.deps),
+                'start_ms': round((begin - started) * 1000, 1),
+                'end_ms': round((end - started) * 1000, 1),
+                'queue_ms': round((begin - queued_at) * 1000, 1),
+                'duration_ms': round((end - begin) * 1000, 1)
+            })
+
+        try:
+            while waiting or running:
+                ready = [stage for stage in waiting.values() if all(dep in results for dep in stage.deps)]
+                # 共有プールのステージを先に投入してから、軽いステージをこのスレッドで実行する
+                for stage in sorted(ready, key=lambda stage: stage.pool == INLINE):
+                    del waiting[stage.name]
+                    args = [results[dep] for dep in stage.deps]
+                    queued_at = time.perf_counter()
+                    if stage.pool == INLINE:
+                        value, _, begin, end = timed(stage, queued_at, args)
+                        results[stage.name] = value
+                        record(stage, queued_at, begin, end)
+                    else:
+                        running[pools[stage.pool](timed, stage, queued_at, args)] = stage
+                if any(all(dep in results for dep in stage.deps) for stage in waiting.values()):
+                    # インライン実行で新たに依存が揃ったステージがある
+                    continue
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    value, queued_at, begin, end = future.result()
+                    results[stage.name] = value
+                    record(stage, queued_at, begin, end)
+        finally:
+            # 失敗時はまだ始まっていないステージを取り消す
+            for future in running:
+                future.cancel()
+        return results
+
+
+if __name__ == "__main__":
+    # 独立した2つの枝が並行して実行されることを確認
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    def slow(label: str, seconds: float):
+        def run(*_):
+            time.sleep(seconds)
+            return label
+        return run
+
+    graph = (StageGraph('demo')
+             .add('numerology', slow('numerology', 0.1), pool='cpu')
+             .add('horoscope', slow('horoscope', 0.2), pool='cpu')
+             .add('numerology_analysis', slow('numerology_analysis', 0.3), ('numerology',), pool='io')
+             .add('horoscope_analysis', slow('horoscope_analysis', 0.3), ('horoscope',), pool='io')
+             .add('analysis', lambda a, b: f"{a}+{b}", ('numerology_analysis', 'horoscope_analysis')))
+    with stage_trace() as trace:
+        begin = time.perf_counter()
+        results = graph.run({'cpu': executor.submit, 'io': executor.submit})
+        print(f"{results['analysis']} in {time.perf_counter() - begin:.2f}s (sequential: 1.20s)")
+    for row in trace:
+        print(row)
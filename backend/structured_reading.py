@@ -0,0 +1,117 @@
+"""
+総合鑑定の構造化出力
+1回のLLM呼び出しで全セクションとスコアをJSONで受け取り、スキーマ検証して鑑定文に整形する
+"""
+
+import json
+import re
+from typing import Dict, List, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, Field, ValidationError
+
+# 総合鑑定（個人）のセクション（キー, 見出し）
+COMPREHENSIVE_SECTIONS: List[Tuple[str, str]] = [
+    ('personality', '全体的な性格と特徴'),
+    ('mission', '人生の方向性と使命'),
+    ('love', '恋愛・人間関係'),
+    ('work', '仕事・キャリア'),
+    ('advice', '今後のアドバイス'),
+]
+
+# 総合鑑定（相性）のセクション（キー, 見出し）
+COMPATIBILITY_SECTIONS: List[Tuple[str, str]] = [
+    ('overall', '全体的な相性の評価'),
+    ('strengths', 'お互いの強みと補完関係'),
+    ('love', '恋愛・結婚における相性'),
+    ('partnership', '友情・ビジネスにおける相性'),
+    ('advice', '関係を深めるためのアドバイス'),
+]
+
+MIN_SECTION_CHARS = 20
+
+
+class ComprehensiveSections(BaseModel):
+    personality: str = Field(min_length=MIN_SECTION_CHARS)
+    mission: str = Field(min_length=MIN_SECTION_CHARS)
+    love: str = Field(min_length=MIN_SECTION_CHARS)
+    work: str = Field(min_length=MIN_SECTION_CHARS)
+    advice: str = Field(min_length=MIN_SECTION_CHARS)
+
+
+class CompatibilitySections(BaseModel):
+    overall: str = Field(min_length=MIN_SECTION_CHARS)
+    strengths: str = Field(min_length=MIN_SECTION_CHARS)
+    love: str = Field(min_length=MIN_SECTION_CHARS)
+    partnership: str = Field(min_length=MIN_SECTION_CHARS)
+    advice: str = Field(min_length=MIN_SECTION_CHARS)
+
+
+class ComprehensiveReading(BaseModel):
+    """総合鑑定（個人）のLLM出力"""
+    sections: ComprehensiveSections
+
+    def render(self) -> str:
+        return render_sections(self.sections, COMPREHENSIVE_SECTIONS)
+
+
+class ComprehensiveCompatibilityReading(BaseModel):
+    """総合鑑定（相性）のLLM出力"""
+    overall_score: int = Field(ge=0, le=100)
+    horoscope_score: int = Field(ge=0, le=100)
+    sections: CompatibilitySections
+
+    def render(self) -> str:
+        return render_sections(self.sections, COMPATIBILITY_SECTIONS)
+
+
+def render_sections(sections: BaseModel, layout: List[Tuple[str, str]]) -> str:
+    """セクションを見出し付きの鑑定文に整形"""
+    return render_section_texts({key: getattr(sections, key) for key, _ in layout}, layout)
+
+
+def render_section_texts(texts: Dict[str, str], layout: List[Tuple[str, str]]) -> str:
+    """セクションごとの本文をレイアウト順に見出し付きで連結（欠けたセクションは詰めて番号を振る）"""
+    present = [(key, title) for key, title in layout if texts.get(key)]
+    return "\n\n".join(
+        f"{index}. {title}\n{texts[key].strip()}" for index, (key, title) in enumerate(present, start=1)
+    )
+
+
+_HEADING = re.compile(r'^\s*(?:#+\s*|\*\*|【)?\s*(?:\d+[.．、]\s*)?')
+
+
+def clean_section_text(text: str, title: str) -> str:
+    """セクション単位の応答から、モデルが付け足した見出し行を取り除く"""
+    lines = (text or '').strip().splitlines()
+    # 本文が見出しで始まる場合と区別するため、見出しだけの短い行に限って除去する
+    if len(lines) > 1 and title in lines[0] and len(_HEADING.sub('', lines[0])) <= len(title) + 4:
+        lines = lines[1:]
+    return "\n".join(lines).strip()
+
+
+def schema_example(layout: List[Tuple[str, str]], scores: Tuple[str, ...] = ()) -> str:
+    """プロンプトに埋め込むJSONの例"""
+    example = {score: 0 for score in scores}
+    example['sections'] = {key: f"{title}（100-200文字）" for key, title in layout}
+    return json.dumps(example, ensure_ascii=False, indent=2)
+
+
+_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$', re.MULTILINE)
+
+ReadingModel = TypeVar('ReadingModel', bound=BaseModel)
+
+
+def parse_reading(text: str, model: Type[ReadingModel]) -> ReadingModel | None:
+    """LLMの応答からJSONを取り出してスキーマ検証（失敗時はNone）"""
+    if not text:
+        return None
+    cleaned = _FENCE.sub('', text.strip())
+    start, end = cleaned.find('{'), cleaned.rfind('}')
+    if start < 0 or end <= start:
+        print("構造化出力にJSONが含まれていません")
+        return None
+    try:
+        return model.model_validate_json(cleaned[start:end + 1])
+    except ValidationError as e:
+        print(f"構造化出力のスキーマ検証エラー: {e.error_count()}件 {e.errors()[0].get('loc')}")
+        return None
@@ -6,8 +6,8 @@ JavaScript版を参考にしたPython実装（78枚デッキ対応）
 from typing import Dict, Any, List, Optional
 import random
 import json
-import concurrent.futures
 from datetime import datetime
+from .spread_router import spread_router, extract_spread_id, PERSONAL, COMPATIBILITY
 from .tarot_data import get_full_tarot_deck, TarotCard, get_card_meaning, get_card_keywords, get_card_image_path, get_reversed_meaning
 
 class TarotPosition:
@@ -91,15 +91,16 @@ class TarotCalculator:
             )
         }
     
-    def shuffle_and_draw(self, count: int) -> List[Dict[str, Any]]:
-        """カードをシャッフルして指定された枚数を引く"""
+    def shuffle_and_draw(self, count: int, seed: int | str | None = None) -> List[Dict[str, Any]]:
+        """カードをシャッフルして指定された枚数を引く（seedを指定すると同じカードと正逆になる）"""
+        rng = random.Random(seed) if seed is not None else random
         shuffled = self.tarot_deck.copy()
-        random.shuffle(shuffled)
+        rng.shuffle(shuffled)
         
         drawn_cards = []
         for i in range(count):
             card = shuffled[i]
-            is_reversed = random.random() < 0.5
+            is_reversed = rng.random() < 0.5
             drawn_cards.append({
                 'card': card,
                 'is_reversed': is_reversed
@@ -108,19 +109,20 @@ class TarotCalculator:
         return drawn_cards
     
     def select_optimal_spread(self, question: str) -> str:
-        """質問に基づいて最適なスプレッドを選択（AI使用）"""
-        try:
-            from ai_analysis import AIAnalysisGenerator
-            ai_generator = AIAnalysisGenerator()
-            
-            # 利用可能なスプレッドの説明
-            spreads_info = {
-                'threeCards': '3枚スプレッド - 過去・現在・未来を表す基本的なスプレッド',
-                'celticCross': 'ケルト十字 - 10枚のカードで詳細な分析を行う伝統的なスプレッド',
-                'horseshoe': 'ホースシュー - 7枚のカードで未来の流れを読み解くスプレッド'
-            }
-            
-            prompt = f"""あなたは経験豊富なタロット占い師です。以下の質問に対して最適なスプレッドを選択してください。
+        """質問に基づいて最適なスプレッドを選択（ローカル判定、確信度が低い場合のみAI補助）"""
+        decision = spread_router.route(question, PERSONAL, tiebreaker=self._select_spread_with_ai)
+        print(f"スプレッド選択: {decision}")
+        return decision.spread_id
+    
+    def _select_spread_with_ai(self, question: str) -> str | None:
+        """AIによるスプレッド選択（ローカル判定の補助）"""
+        from ai_analysis import AIAnalysisGenerator
+        ai_generator = AIAnalysisGenerator()
+        # クイック鑑定・過負荷時はLLMを使わずローカル判定のままにする
+        if ai_generator.use_template_tier():
+            return None
+        
+        prompt = f"""あなたは経験豊富なタロット占い師です。以下の質問に対して最適なスプレッドを選択してください。
 
 質問: {question}
 
@@ -137,42 +139,23 @@ class TarotCalculator:
 - 複雑な問題や詳細な分析が必要 → celticCross
 - 未来の流れや方向性を知りたい → horseshoe"""
 
-            response_text = ai_generator._generate_with_groq(prompt, max_tokens=200)
-            
-            # レスポンスからスプレッドIDを抽出
-            if 'threeCards' in response_text:
-                return 'threeCards'
-            elif 'celticCross' in response_text:
-                return 'celticCross'
-            elif 'horseshoe' in response_text:
-                return 'horseshoe'
-            else:
-                # フォールバック: キーワードベースの選択
-                return self._select_spread_by_keywords(question)
-                
-        except Exception as e:
-            print(f"AI spread selection error: {e}")
-            # フォールバック: キーワードベースの選択
-            return self._select_spread_by_keywords(question)
-    
-    def _select_spread_by_keywords(self, question: str) -> str:
-        """キーワードベースのスプレッド選択（フォールバック）"""
-        question_lower = question.lower()
-        
-        if any(keyword in question_lower for keyword in ['未来', '将来', 'これから', '流れ', '方向']):
-            return 'horseshoe'
-        elif any(keyword in question_lower for keyword in ['詳細', '詳しく', '分析', '複雑', '深く']):
-            return 'celticCross'
-        else:
-            return 'threeCards'  # デフォルト
+        return extract_spread_id(ai_generator._generate_with_groq(prompt, max_tokens=200, task='spread_selection'))
     
     def select_compatibility_spread(self, consultation: str) -> str:
-        """相性占い用のスプレッドを選択（AI使用）"""
-        try:
-            from ai_analysis import AIAnalysisGenerator
-            ai_generator = AIAnalysisGenerator()
-            
-            prompt = f"""あなたは経験豊富なタロット占い師です。以下の相性占いの相談に対して最適なスプレッドを選択してください。
+        """相性占い用のスプレッドを選択（ローカル判定、確信度が低い場合のみAI補助）"""
+        decision = spread_router.route(consultation or '', COMPATIBILITY, tiebreaker=self._select_compatibility_spread_with_ai)
+        print(f"相性スプレッド選択: {decision}")
+        return decision.spread_id
+    
+    def _select_compatibility_spread_with_ai(self, consultation: str) -> str | None:
+        """AIによる相性占い用スプレッド選択（ローカル判定の補助）"""
+        from ai_analysis import AIAnalysisGenerator
+        ai_generator = AIAnalysisGenerator()
+        # クイック鑑定・過負荷時はLLMを使わずローカル判定のままにする
+        if ai_generator.use_template_tier():
+            return None
+        
+        prompt = f"""あなたは経験豊富なタロット占い師です。以下の相性占いの相談に対して最適なスプレッドを選択してください。
 
 相談内容: {consultation if consultation else "一般的な相性について"}
 
@@ -189,33 +172,17 @@ class TarotCalculator:
 - 複雑な関係や詳細な相性分析が必要 → celticCross
 - 関係の流れや方向性を知りたい → horseshoe"""
 
-            response_text = ai_generator._generate_with_groq(prompt, max_tokens=200)
-            
-            # レスポンスからスプレッドIDを抽出
-            if 'threeCards' in response_text:
-                return 'threeCards'
-            elif 'celticCross' in response_text:
-                return 'celticCross'
-            elif 'horseshoe' in response_text:
-                return 'horseshoe'
-            else:
-                # フォールバック: 相性占いでは詳細分析を優先
-                return 'celticCross'
-                
-        except Exception as e:
-            print(f"AI compatibility spread selection error: {e}")
-            # フォールバック: 相性占いでは詳細分析を優先
-            return 'celticCross'
+        return extract_spread_id(ai_generator._generate_with_groq(prompt, max_tokens=200, task='spread_selection'))
     
-    def perform_tarot_reading(self, question: str, nickname: str = "あなた") -> Dict[str, Any]:
-        """タロット占いを実行"""
+    def perform_tarot_reading(self, question: str, nickname: str = "あなた", seed: int | str | None = None) -> Dict[str, Any]:
+        """タロット占いを実行（seedを指定するとカードの引き方を固定する）"""
         try:
             # 最適なスプレッドを選択
             spread_id = self.select_optimal_spread(question)
             spread = self.tarot_spreads[spread_id]
             
             # カードを引く
-            drawn_raw_cards = self.shuffle_and_draw(spread.card_count)
+            drawn_raw_cards = self.shuffle_and_draw(spread.card_count, seed)
             
             # 位置情報を付与
             drawn_cards = []
@@ -231,17 +198,17 @@ class TarotCalculator:
             result = {
                 'question': question,
                 'nickname': nickname,
+                'spread_id': spread.id,
                 'spread_name': spread.name,
                 'spread_description': spread.description,
                 'drawn_cards': [],
                 'timestamp': datetime.now().isoformat()
             }
             
-            # 引かれたカードの情報を並列で構築
-            import concurrent.futures
-            
+            # 引かれたカードの情報を構築
             def build_card_info(drawn_card):
                 return {
+                    'card_id': drawn_card.card.id,
                     'card_name': drawn_card.card.name,
                     'card_description': get_card_meaning(drawn_card.card, drawn_card.is_reversed),
                     'card_keywords': get_card_keywords(drawn_card.card, drawn_card.is_reversed),
@@ -255,10 +222,8 @@ class TarotCalculator:
                     'position_meaning': drawn_card.position.meaning
                 }
             
-            # カード情報を並列で構築
-            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(drawn_cards), 4)) as executor:
-                card_futures = [executor.submit(build_card_info, drawn_card) for drawn_card in drawn_cards]
-                result['drawn_cards'] = [future.result() for future in card_futures]
+            # カード情報は辞書の参照だけなので、リクエストごとにスレッドを立てずにその場で構築する
+            result['drawn_cards'] = [build_card_info(drawn_card) for drawn_card in drawn_cards]
             
             return result
             
@@ -319,15 +284,15 @@ class TarotCalculator:
             'timestamp': datetime.now().isoformat()
         }
     
-    def get_compatibility_analysis(self, profile1_data: Dict[str, Any], profile2_data: Dict[str, Any], consultation: str = "") -> Dict[str, Any]:
-        """相性タロット占いを実行"""
+    def get_compatibility_analysis(self, profile1_data: Dict[str, Any], profile2_data: Dict[str, Any], consultation: str = "", seed: int | str | None = None) -> Dict[str, Any]:
+        """相性タロット占いを実行（seedを指定するとカードの引き方を固定する）"""
         try:
             # 相性占い用のスプレッドをAIで選択
             spread_id = self.select_compatibility_spread(consultation)
             spread = self.tarot_spreads[spread_id]
             
             # カードを引く
-            drawn_raw_cards = self.shuffle_and_draw(spread.card_count)
+            drawn_raw_cards = self.shuffle_and_draw(spread.card_count, seed)
             
             # 位置情報を付与
             drawn_cards = []
@@ -347,15 +312,17 @@ class TarotCalculator:
                 'person1_nickname': profile1_data.get('nickname', 'あなた'),
                 'person2_nickname': profile2_data.get('nickname', '相手'),
                 'consultation': consultation,
+                'spread_id': spread.id,
                 'spread_name': spread.name,
                 'compatibility_score': compatibility_score,
                 'drawn_cards': [],
                 'timestamp': datetime.now().isoformat()
             }
             
-            # 引かれたカードの情報を並列で構築
+            # 引かれたカードの情報を構築
             def build_compatibility_card_info(drawn_card):
                 return {
+                    'card_id': drawn_card.card.id,
                     'card_name': drawn_card.card.name,
                     'card_description': get_card_meaning(drawn_card.card, drawn_card.is_reversed),
                     'card_keywords': get_card_keywords(drawn_card.card, drawn_card.is_reversed),
@@ -369,10 +336,7 @@ class TarotCalculator:
                     'position_meaning': drawn_card.position.meaning
                 }
             
-            # カード情報を並列で構築
-            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(drawn_cards), 4)) as executor:
-                card_futures = [executor.submit(build_compatibility_card_info, drawn_card) for drawn_card in drawn_cards]
-                result['drawn_cards'] = [future.result() for future in card_futures]
+            result['drawn_cards'] = [build_compatibility_card_info(drawn_card) for drawn_card in drawn_cards]
             
             return result
             
@@ -0,0 +1,461 @@
+"""
+テンプレート鑑定文
+数秘術・星座・惑星・タロットの意味テーブルとフレーズテンプレートから、LLMを使わずに400〜500文字の鑑定文を組み立てる。
+言い回しは入力から決定的に選ぶため同じ入力には同じ文面を返し、1ミリ秒未満で生成できる。
+LLMの過負荷・タイムアウト時の既定の鑑定文や、クイック鑑定（無料プランなど）に使う
+"""
+
+import os
+import zlib
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple
+
+from numerology_data import NUMBER_MEANINGS, NUMBER_ANALYSES
+from horoscope_data import SIGN_MEANINGS, SIGN_ANALYSES, SIGN_TRAITS, PLANET_MEANINGS, SIGN_ELEMENTS, normalize_sign, japanese_sign_name
+from prompt_builder import first_sentences
+
+# 鑑定文の目標文字数
+MIN_CHARS = int(os.getenv('TEMPLATE_READING_MIN_CHARS', '400'))
+MAX_CHARS = int(os.getenv('TEMPLATE_READING_MAX_CHARS', '500'))
+
+# テンプレート鑑定文を既定とするプラン（カンマ区切り、例: "Free"）
+TEMPLATE_TIER_PLANS = frozenset(plan.strip() for plan in os.getenv('TEMPLATE_TIER_PLANS', '').split(',') if plan.strip())
+
+# 相談内容のテーマ判定に使うキーワード
+TOPIC_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    'love': ('恋', '愛', '結婚', '彼氏', '彼女', '片思い', '復縁', 'パートナー', '出会い'),
+    'work': ('仕事', '転職', '職場', 'キャリア', '就職', '上司', '昇進', '起業'),
+    'money': ('お金', '金運', '収入', '貯金', '投資', '財'),
+    'health': ('健康', '体調', '病', '睡眠', 'ストレス'),
+    'relationships': ('人間関係', '友人', '友達', '家族', '同僚', '親'),
+}
+
+# テーマ別のアドバイス（{trait}は強みとなる性質）
+TOPIC_ADVICE: Dict[str, Tuple[str, ...]] = {
+    'love': (
+        "恋愛では、{trait}という持ち味が魅力として伝わりやすい時期です。気持ちは言葉にして届けるほど相手の心に残ります。焦らず、自然体の笑顔を大切にしてください。",
+        "恋愛面では、{trait}を素直に表すことが良いご縁を引き寄せます。相手の話にじっくり耳を傾けると、二人の距離は少しずつ縮まっていくでしょう。",
+        "ご縁を育てる鍵は{trait}です。小さな約束を守り、感謝を伝える積み重ねが、信頼に満ちた温かな関係へとつながっていきます。",
+    ),
+    'work': (
+        "仕事では、{trait}を活かせる役割に目を向けてみてください。一度に全てを抱えず、優先順位を決めて一歩ずつ進めることで、着実な成果につながります。",
+        "キャリアの面では、{trait}が評価される流れが来ています。学びを続け、周囲と知恵を分かち合うことで、新しいチャンスが開けていくでしょう。",
+        "仕事運を高める鍵は{trait}です。迷ったときは原点に立ち返り、自分が本当に大切にしたい働き方を書き出してみると道が見えてきます。",
+    ),
+    'money': (
+        "金運では、{trait}を意識した堅実な計画が実を結びます。衝動的な出費を控え、自分を本当に豊かにするものにお金を使うよう心がけてください。",
+        "お金の流れを整えるには、{trait}を活かすことが近道です。収支を見直す小さな習慣が、将来の安心と新しい選択肢を生み出してくれるでしょう。",
+        "金運の鍵は{trait}です。目先の損得よりも長い目で価値を見極めることで、豊かさが自然と巡ってくるはずです。",
+    ),
+    'health': (
+        "健康面では、{trait}を保つためにも心と体の休息を大切にしてください。規則正しい睡眠と軽い運動が、毎日の活力を支えてくれます。",
+        "心身のバランスを整えるには、{trait}を無理なく発揮できるペースを守ることが大切です。疲れを感じたら早めに立ち止まりましょう。",
+        "健康運の鍵は{trait}です。好きな音楽や散歩など、心がほどける時間を意識して取り入れると、体も自然と軽くなっていきます。",
+    ),
+    'relationships': (
+        "人間関係では、{trait}があなたの信頼を支えています。相手の立場を想像しながら言葉を選ぶことで、周囲との絆はいっそう深まるでしょう。",
+        "周りの人との関係では、{trait}を素直に表すことが大切です。無理に合わせすぎず、心地よい距離感を見つけることで関係が安定します。",
+        "人とのつながりを育てる鍵は{trait}です。感謝の気持ちを小まめに伝えることで、あなたを支えてくれる輪が広がっていきます。",
+    ),
+    'general': (
+        "毎日の過ごし方では、{trait}を意識して行動することで運気の流れに乗りやすくなります。小さな目標を一つずつ達成し、自分を認めてあげてください。",
+        "これからの日々は、{trait}を大切にするほど良い出来事が重なっていきます。朝の数分で今日の目標を決める習慣が、運気の追い風になるでしょう。",
+        "運気を高める鍵は{trait}です。新しいことに少しだけ挑戦し、出会った人やできごとに感謝することで、毎日がより輝いていきます。",
+    ),
+}
+
+OPENINGS = (
+    "{nickname}さん、こんにちは。{art}で{nickname}さんの運勢を読み解きました。",
+    "{nickname}さん、{art}の鑑定結果をお届けします。",
+    "{nickname}さん、ようこそ。{art}が示すメッセージをお伝えします。",
+)
+
+CLOSINGS = (
+    "{nickname}さんの歩む道が、穏やかな光に満ちたものになるよう心から応援しています。",
+    "自分らしさを信じて進めば、きっと素敵な未来が待っています。{nickname}さんの毎日を応援しています。",
+    "焦らず一歩ずつ進んでいきましょう。{nickname}さんの可能性は、これからもっと大きく広がっていきます。",
+)
+
+# 目標文字数に届かない場合に補う文
+FILLERS = (
+    "迷ったときは深呼吸をして、心が本当に望んでいることに耳を傾けてみてください。",
+    "身近な人への感謝の気持ちが、思いがけない幸運を運んでくれるでしょう。",
+    "完璧を目指すよりも、今日できることを一つ積み重ねることが大切です。",
+)
+
+# 相性スコア帯ごとの総評（{pair}は「AさんとBさん」）
+COMPATIBILITY_BANDS: Tuple[Tuple[int, Tuple[str, ...]], ...] = (
+    (80, (
+        "{pair}は、お互いを自然に高め合える非常に良い相性です。",
+        "{pair}の相性はとても良好で、一緒にいるだけで心が満たされる関係です。",
+    )),
+    (60, (
+        "{pair}は、安定した信頼関係を築ける良い相性です。",
+        "{pair}の相性は良好で、違いを理解し合うほど絆が深まっていきます。",
+    )),
+    (40, (
+        "{pair}は、お互いの努力次第で大きく育っていく相性です。",
+        "{pair}の相性は標準的で、歩み寄りが関係を豊かにしてくれます。",
+    )),
+    (0, (
+        "{pair}の相性にはいくつかの課題がありますが、違いは成長のきっかけにもなります。",
+        "{pair}は価値観の違いを感じやすい組み合わせですが、時間をかけるほど理解が深まります。",
+    )),
+)
+
+COMPATIBILITY_CLOSINGS = (
+    "{pair}がお互いを思いやり、素敵な時間を重ねていけるよう心から応援しています。",
+    "違いを楽しみながら歩んでいけば、{pair}の関係はきっとかけがえのないものになるでしょう。",
+)
+
+# グループ相性の占術名
+GROUP_ARTS = {'numerology': '数秘術', 'horoscope': '西洋占星術', 'comprehensive': '数秘術と西洋占星術'}
+
+# エレメントの組み合わせごとの相性の傾向
+ELEMENT_HARMONY = {
+    frozenset({'火'}): "同じ火のエレメント同士で、情熱とエネルギーを分かち合えます。",
+    frozenset({'地'}): "同じ地のエレメント同士で、現実的な価値観がよく合います。",
+    frozenset({'風'}): "同じ風のエレメント同士で、会話が弾み刺激を与え合えます。",
+    frozenset({'水'}): "同じ水のエレメント同士で、言葉にしなくても気持ちが通じ合います。",
+    frozenset({'火', '風'}): "火と風のエレメントは、お互いの情熱とアイデアを大きく膨らませます。",
+    frozenset({'地', '水'}): "地と水のエレメントは、安心感と思いやりで互いを育て合います。",
+    frozenset({'火', '地'}): "火と地のエレメントは、行動力と堅実さを補い合える組み合わせです。",
+    frozenset({'火', '水'}): "火と水のエレメントは、情熱と感受性の違いを尊重することが鍵になります。",
+    frozenset({'風', '地'}): "風と地のエレメントは、発想と実行力を組み合わせることで力を発揮します。",
+    frozenset({'風', '水'}): "風と水のエレメントは、理性と感情のバランスを取り合うことで深まります。",
+}
+
+# テンプレート鑑定文を使うかどうか（スレッドプールへはcopy_contextで引き継ぐ）
+_template_tier: contextvars.ContextVar[bool] = contextvars.ContextVar('template_reading_tier', default=False)
+
+
+@contextmanager
+def template_tier(enabled: bool = True):
+    """このコンテキスト内の鑑定文をLLMを呼ばずにテンプレートで生成する"""
+    token = _template_tier.set(enabled)
+    try:
+        yield
+    finally:
+        _template_tier.reset(token)
+
+
+def template_tier_active() -> bool:
+    return _template_tier.get()
+
+
+def uses_template_tier(request_data: Dict[str, Any], plan_type: str | None) -> bool:
+    """クイック鑑定の指定、またはテンプレートを既定とするプランか"""
+    return bool(request_data.get('quick')) or (plan_type or 'Free') in TEMPLATE_TIER_PLANS
+
+
+def detect_topic(consultation: str) -> str:
+    """相談内容のテーマ（該当なしは'general'）"""
+    for topic, keywords in TOPIC_KEYWORDS.items():
+        if any(keyword in consultation for keyword in keywords):
+            return topic
+    return 'general'
+
+
+def _pick(options: Tuple[str, ...], seed: str, slot: str) -> str:
+    """入力から決定的に言い回しを選ぶ（スロットごとに独立して選ぶ）"""
+    return options[zlib.crc32(f"{seed}|{slot}".encode('utf-8')) % len(options)]
+
+
+def _trait(meaning: str) -> str:
+    """「リーダーシップ、独立、創造性」→「リーダーシップ」"""
+    return meaning.split('、')[0]
+
+
+def _number(data: Dict[str, Any], key: str) -> int | None:
+    value = data.get(key)
+    if isinstance(value, dict):
+        value = value.get('number')
+    return value if isinstance(value, int) else None
+
+
+class TemplateReadingGenerator:
+    """意味テーブルとフレーズテンプレートによる鑑定文生成"""
+
+    def __init__(self, min_chars: int = MIN_CHARS, max_chars: int = MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+
+    def _compose(self, paragraphs: List[str], optional: List[str], closing: str, seed: str, insert_at: int | None = None) -> str:
+        """
+        必須の段落に、上限に収まる範囲で任意の段落（insert_atの位置、省略時は末尾）を加え、
+        下限に届かなければ補足文を1段落にまとめて足し、締めの段落で終える
+        """
+        body = list(paragraphs)
+        position = len(body) if insert_at is None else insert_at
+        length = sum(len(p) for p in body) + len(closing) + 2 * len(body)
+        for paragraph in optional:
+            if length + len(paragraph) + 2 <= self.max_chars:
+                body.insert(position, paragraph)
+                position += 1
+                length += len(paragraph) + 2
+        fillers = ''
+        start = zlib.crc32(seed.encode('utf-8'))
+        for index in range(len(FILLERS)):
+            if length + len(fillers) + 2 * bool(fillers) >= self.min_chars:
+                break
+            filler = FILLERS[(start + index) % len(FILLERS)]
+            if length + len(fillers) + len(filler) + 2 > self.max_chars:
+                break
+            fillers += filler
+        if fillers:
+            body.append(fillers)
+        return "\n\n".join(body + [closing])
+
+    def _advice(self, consultation: str, trait: str, seed: str) -> str:
+        return _pick(TOPIC_ADVICE[detect_topic(consultation)], seed, 'advice').format(trait=trait)
+
+    def numerology(self, numerology_data: Dict[str, Any], consultation: str = "", nickname: str | None = None) -> str:
+        """数秘術の鑑定文"""
+        nickname = nickname or numerology_data.get('nickname', 'あなた')
+        numbers = {key: _number(numerology_data, key) for key in ('life_path', 'destiny', 'soul', 'personal', 'birthday', 'maturity')}
+        life_path = numbers['life_path'] or 1
+        seed = f"numerology|{'-'.join(str(n) for n in numbers.values())}|{consultation}|{nickname}"
+
+        paragraphs = [
+            _pick(OPENINGS, seed, 'opening').format(nickname=nickname, art='数秘術'),
+            f"ライフパスナンバー{life_path}は「{NUMBER_MEANINGS.get(life_path, '特別な可能性')}」を象徴する数字です。"
+            f"{NUMBER_ANALYSES.get(life_path, '特別な意味を持つ数字です。')}",
+        ]
+        inner = []
+        if numbers['destiny']:
+            inner.append(f"ディスティニーナンバー{numbers['destiny']}は社会での役割として「{NUMBER_MEANINGS.get(numbers['destiny'], '')}」を")
+        if numbers['soul']:
+            inner.append(f"ソウルナンバー{numbers['soul']}は心の奥の願いとして「{NUMBER_MEANINGS.get(numbers['soul'], '')}」を")
+        if inner:
+            paragraphs.append('、'.join(inner) + "示しています。")
+        paragraphs.append(self._advice(consultation, _trait(NUMBER_MEANINGS.get(life_path, '自分らしさ')), seed))
+
+        optional = []
+        if numbers['personal']:
+            optional.append(f"パーソナルナンバー{numbers['personal']}が表す「{_trait(NUMBER_MEANINGS.get(numbers['personal'], '個性'))}」は、周囲の人があなたに感じる第一印象です。")
+        if numbers['maturity']:
+            optional.append(f"成熟数{numbers['maturity']}は、人生の後半に「{_trait(NUMBER_MEANINGS.get(numbers['maturity'], '実り'))}」の力が花開くことを告げています。")
+        closing = _pick(CLOSINGS, seed, 'closing').format(nickname=nickname)
+        return self._compose(paragraphs, optional, closing, seed)
+
+    def horoscope(self, horoscope_data: Dict[str, Any], consultation: str = "", nickname: str | None = None) -> str:
+        """西洋占星術の鑑定文"""
+        nickname = nickname or horoscope_data.get('nickname', 'あなた')
+        sun = normalize_sign(horoscope_data.get('sun_sign', 'Aries'))
+        moon = normalize_sign(horoscope_data.get('moon_sign', 'Cancer'))
+        rising = normalize_sign(horoscope_data.get('rising_sign', 'Leo'))
+        seed = f"horoscope|{sun}|{moon}|{rising}|{consultation}|{nickname}"
+
+        paragraphs = [
+            _pick(OPENINGS, seed, 'opening').format(nickname=nickname, art='西洋占星術'),
+            f"{PLANET_MEANINGS['Sun'].split(' - ')[1]}を表す太陽は{japanese_sign_name(sun)}にあります。"
+            f"{SIGN_ANALYSES.get(sun, '特別な意味を持つ星座です。')}",
+            f"{PLANET_MEANINGS['Moon'].split(' - ')[1]}を映す月は{japanese_sign_name(moon)}にあり、心の奥では{SIGN_TRAITS.get(moon, '繊細さ')}を大切にしています。"
+            f"上昇星座の{japanese_sign_name(rising)}は、周囲に{SIGN_TRAITS.get(rising, '個性')}を感じさせる第一印象を与えます。",
+            self._advice(consultation, SIGN_TRAITS.get(sun, '自分らしさ'), seed),
+        ]
+        elements = [SIGN_ELEMENTS.get(sign) for sign in (sun, moon, rising)]
+        optional = []
+        dominant = max(set(elements), key=elements.count) if all(elements) else None
+        if dominant and elements.count(dominant) >= 2:
+            optional.append(f"ホロスコープでは{dominant}のエレメントが強く、その性質が運勢の流れを後押ししています。")
+        optional.append(f"月の{japanese_sign_name(moon)}の感受性を大切にすると、心のバランスが保たれるでしょう。")
+        closing = _pick(CLOSINGS, seed, 'closing').format(nickname=nickname)
+        return self._compose(paragraphs, optional, closing, seed)
+
+    def _card_line(self, card: Dict[str, Any], max_chars: int) -> str:
+        name = card.get('card_name', '')
+        position = card.get('position_name', '')
+        if card.get('is_reversed') and card.get('reversed_meaning'):
+            label, meaning = f"{name}（逆位置）", card['reversed_meaning']
+        else:
+            label, meaning = name, card.get('card_description', '')
+        meaning = first_sentences(meaning, max_chars).rstrip('。')
+        prefix = f"「{position}」の{label}" if position else label
+        return f"{prefix}が伝えるのは「{meaning}」というメッセージです。"
+
+    def _card_paragraphs(self, drawn_cards: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+        """先頭の3枚は必須、残りは文字数に収まる範囲で加える"""
+        # カードが多いスプレッドでは1枚あたりの説明を短くする
+        per_card = 60 if len(drawn_cards) <= 3 else 30
+        lines = [self._card_line(card, per_card) for card in drawn_cards]
+        return lines[:3], lines[3:]
+
+    def tarot(self, tarot_data: Dict[str, Any], consultation: str = "", nickname: str | None = None) -> str:
+        """タロットの鑑定文"""
+        nickname = nickname or tarot_data.get('nickname', 'あなた')
+        drawn_cards = tarot_data.get('drawn_cards', [])
+        spread_name = tarot_data.get('spread_name', 'タロットスプレッド')
+        card_key = '-'.join(f"{card.get('card_name', '')}{'R' if card.get('is_reversed') else ''}" for card in drawn_cards)
+        seed = f"tarot|{spread_name}|{card_key}|{consultation}|{nickname}"
+
+        required, optional = self._card_paragraphs(drawn_cards)
+        reversed_count = sum(1 for card in drawn_cards if card.get('is_reversed'))
+        if reversed_count:
+            summary = f"逆位置のカードが{reversed_count}枚あり、見直しや休息が必要なテーマが含まれています。焦らず立ち止まることで、流れは良い方向へ変わっていきます。"
+        else:
+            summary = "全てのカードが正位置で現れ、物事が素直に前へ進みやすい流れを示しています。"
+        paragraphs = [
+            _pick(OPENINGS, seed, 'opening').format(nickname=nickname, art=f"{spread_name}のタロット"),
+            *required,
+            summary,
+        ]
+        keywords = [keyword for card in drawn_cards[:1] for keyword in (card.get('card_keywords') or [])]
+        trait = keywords[0].replace('（課題）', '') if keywords else '心の声'
+        paragraphs.append(self._advice(consultation, trait, seed))
+        closing = _pick(CLOSINGS, seed, 'closing').format(nickname=nickname)
+        # 4枚目以降のカードは3枚目の直後に入れる
+        return self._compose(paragraphs, optional, closing, seed, insert_at=1 + len(required))
+
+    def compatibility(self, data: Dict[str, Any], fortune_type: str, consultation: str = "") -> str:
+        """相性の鑑定文（数秘術・西洋占星術・タロット）"""
+        person1_nickname = data.get('person1_nickname', '人物1')
+        person2_nickname = data.get('person2_nickname', '人物2')
+        score = data.get('compatibility_score', 50)
+        pair = f"{person1_nickname}さんと{person2_nickname}さん"
+        seed = f"compatibility|{fortune_type}|{score}|{pair}|{consultation}"
+
+        band = next(options for threshold, options in COMPATIBILITY_BANDS if score >= threshold)
+        paragraphs = [f"{_pick(band, seed, 'band').format(pair=pair)}相性スコアは{score}/100です。"]
+        optional: List[str] = []
+        person1, person2 = data.get('person1') or {}, data.get('person2') or {}
+        trait = '思いやり'
+
+        if fortune_type == 'numerology':
+            life_path1, life_path2 = _number(person1, 'life_path'), _number(person2, 'life_path')
+            if life_path1 and life_path2:
+                paragraphs.append(
+                    f"{person1_nickname}さんのライフパスナンバー{life_path1}は「{NUMBER_MEANINGS.get(life_path1, '')}」、"
+                    f"{person2_nickname}さんの{life_path2}は「{NUMBER_MEANINGS.get(life_path2, '')}」を表します。"
+                    + ("同じ数字を持つお二人は、価値観を深く共有できます。" if life_path1 == life_path2 else "異なる数字の持ち味を補い合うことで、関係に広がりが生まれます。")
+                )
+                trait = _trait(NUMBER_MEANINGS.get(life_path1, '思いやり'))
+            destiny1, destiny2 = _number(person1, 'destiny'), _number(person2, 'destiny')
+            if destiny1 and destiny2:
+                optional.append(f"ディスティニーナンバー{destiny1}と{destiny2}の組み合わせは、二人で目標に向かうときの役割分担のヒントになります。")
+        elif fortune_type == 'horoscope':
+            sun1, sun2 = normalize_sign(person1.get('sun_sign', '')), normalize_sign(person2.get('sun_sign', ''))
+            if sun1 in SIGN_MEANINGS and sun2 in SIGN_MEANINGS:
+                paragraphs.append(
+                    f"{person1_nickname}さんの太陽星座は{japanese_sign_name(sun1)}、{person2_nickname}さんは{japanese_sign_name(sun2)}です。"
+                    + ELEMENT_HARMONY.get(frozenset({SIGN_ELEMENTS[sun1], SIGN_ELEMENTS[sun2]}), '')
+                )
+                trait = SIGN_TRAITS[sun1]
+            moon1, moon2 = normalize_sign(person1.get('moon_sign', '')), normalize_sign(person2.get('moon_sign', ''))
+            if moon1 in SIGN_MEANINGS and moon2 in SIGN_MEANINGS:
+                optional.append(f"月星座の{japanese_sign_name(moon1)}と{japanese_sign_name(moon2)}は、日常の中で感じる安心感のかたちを示しています。")
+            if sun1 in SIGN_TRAITS and sun2 in SIGN_TRAITS:
+                optional.append(f"{person1_nickname}さんの{SIGN_TRAITS[sun1]}と、{person2_nickname}さんの{SIGN_TRAITS[sun2]}を認め合うことが、二人の関係を支える力になります。")
+        elif fortune_type == 'tarot':
+            required, extra = self._card_paragraphs(data.get('drawn_cards', []))
+            paragraphs.extend(required)
+            optional.extend(extra)
+
+        # 補足の段落は占術ごとの説明の直後（アドバイスの前）に入れる
+        insert_at = len(paragraphs)
+        paragraphs.append(self._advice(consultation, trait, seed))
+        closing = _pick(COMPATIBILITY_CLOSINGS, seed, 'closing').format(pair=pair)
+        return self._compose(paragraphs, optional, closing, seed, insert_at=insert_at)
+
+    def comprehensive(self, numerology_data: Dict[str, Any], horoscope_data: Dict[str, Any], consultation: str = "", nickname: str = "あなた") -> str:
+        """総合鑑定（数秘術 + 西洋占星術）の鑑定文"""
+        life_path = _number(numerology_data, 'life_path') or 1
+        sun = normalize_sign(horoscope_data.get('sun_sign', 'Aries'))
+        moon = normalize_sign(horoscope_data.get('moon_sign', 'Cancer'))
+        seed = f"comprehensive|{life_path}|{sun}|{moon}|{consultation}|{nickname}"
+
+        paragraphs = [
+            _pick(OPENINGS, seed, 'opening').format(nickname=nickname, art='数秘術と西洋占星術'),
+            f"ライフパスナンバー{life_path}は「{NUMBER_MEANINGS.get(life_path, '特別な可能性')}」を、"
+            f"太陽星座の{japanese_sign_name(sun)}は{SIGN_TRAITS.get(sun, '個性')}を示しています。"
+            f"{NUMBER_ANALYSES.get(life_path, '')}",
+            f"月星座の{japanese_sign_name(moon)}が表すように、心の奥では{SIGN_TRAITS.get(moon, '繊細さ')}も大切にしています。",
+            self._advice(consultation, _trait(NUMBER_MEANINGS.get(life_path, '自分らしさ')), seed),
+        ]
+        optional = [SIGN_ANALYSES.get(sun, '')]
+        closing = _pick(CLOSINGS, seed, 'closing').format(nickname=nickname)
+        return self._compose(paragraphs, [p for p in optional if p], closing, seed)
+
+    def comprehensive_compatibility(self, numerology_compatibility: Dict[str, Any], horoscope_compatibility: Dict[str, Any], consultation: str = "") -> str:
+        """総合相性（数秘術 + 西洋占星術）の鑑定文"""
+        numerology_score = numerology_compatibility.get('compatibility_score', 50)
+        horoscope_score = horoscope_compatibility.get('compatibility_score', 50)
+        data = dict(horoscope_compatibility, compatibility_score=round((numerology_score + horoscope_score) / 2))
+        data.setdefault('person1_nickname', numerology_compatibility.get('person1_nickname', '人物1'))
+        data.setdefault('person2_nickname', numerology_compatibility.get('person2_nickname', '人物2'))
+        reading = self.compatibility(data, 'horoscope', consultation)
+        detail = f"数秘術の相性スコアは{numerology_score}/100、西洋占星術の相性スコアは{horoscope_score}/100です。"
+        head, _, rest = reading.partition("\n\n")
+        return f"{head}\n\n{detail}\n\n{rest}" if len(reading) + len(detail) + 2 <= self.max_chars else reading
+
+    def group(self, group_data: Dict[str, Any], fortune_type: str, consultation: str = "") -> str:
+        """グループ相性（3人以上）の鑑定文"""
+        nicknames = [member.get('nickname', '') for member in group_data.get('members', [])]
+        average = group_data.get('average_score') or 50
+        seed = f"group|{fortune_type}|{'|'.join(nicknames)}|{average}|{consultation}"
+
+        band = next(options for threshold, options in COMPATIBILITY_BANDS if average >= threshold)
+        paragraphs = [
+            f"{'、'.join(f'{nickname}さん' for nickname in nicknames)}の{len(nicknames)}人の相性を、{GROUP_ARTS.get(fortune_type, '占術')}で読み解きました。"
+            f"{_pick(band, seed, 'band').format(pair='皆さん')}グループ全体の平均スコアは{average}/100です。"
+        ]
+        optional: List[str] = []
+        best_pairs, worst_pairs = group_data.get('best_pairs') or [], group_data.get('worst_pairs') or []
+        if best_pairs:
+            best = best_pairs[0]
+            paragraphs.append(f"特に相性が良いのは{best['person1']}さんと{best['person2']}さん（{best['score']}/100）で、グループの雰囲気を明るく支える組み合わせです。")
+            optional.extend(f"{pair['person1']}さんと{pair['person2']}さん（{pair['score']}/100）も、自然に協力し合える良い組み合わせです。" for pair in best_pairs[1:2])
+        if worst_pairs and worst_pairs[0] != (best_pairs[0] if best_pairs else None):
+            worst = worst_pairs[0]
+            paragraphs.append(f"一方、{worst['person1']}さんと{worst['person2']}さん（{worst['score']}/100）は価値観の違いを感じやすい組み合わせです。間に入る人がいると、お互いの良さが伝わりやすくなります。")
+
+        # 補足の段落はペアの説明の直後（アドバイスの前）に入れる
+        insert_at = len(paragraphs)
+        paragraphs.append(self._advice(consultation, '支え合う力', seed))
+        closing = _pick(COMPATIBILITY_CLOSINGS, seed, 'closing').format(pair='皆さん')
+        return self._compose(paragraphs, optional, closing, seed, insert_at=insert_at)
+
+
+# プロセス全体で共有するテンプレート鑑定文の生成器
+template_reader = TemplateReadingGenerator()
+
+
+if __name__ == "__main__":
+    import time
+    from horoscope_data import SIGN_ELEMENTS as _SIGNS
+
+    consultations = ['', '転職するべきか迷っています', '片思いの彼との今後', 'お金が貯まりません']
+    samples: List[Tuple[str, str]] = []
+    for number in NUMBER_MEANINGS:
+        for consultation in consultations:
+            data = {key: {'number': number} for key in ('life_path', 'destiny', 'soul', 'personal', 'birthday', 'maturity')}
+            samples.append(('numerology', template_reader.numerology(dict(data, nickname='コバトン'), consultation)))
+    for sun in _SIGNS:
+        for consultation in consultations:
+            horoscope = {'sun_sign': sun, 'moon_sign': 'Pis', 'rising_sign': 'Leo', 'nickname': 'コバトン'}
+            samples.append(('horoscope', template_reader.horoscope(horoscope, consultation)))
+    for score in (90, 70, 50, 20):
+        pair = {'person1_nickname': 'コバトン', 'person2_nickname': 'ハナコ', 'compatibility_score': score,
+                'person1': {'life_path': {'number': 3}, 'destiny': {'number': 5}, 'sun_sign': 'Aries', 'moon_sign': 'Leo'},
+                'person2': {'life_path': {'number': 8}, 'destiny': {'number': 2}, 'sun_sign': 'Cancer', 'moon_sign': 'Virgo'}}
+        samples.append(('numerology compatibility', template_reader.compatibility(pair, 'numerology', '結婚について')))
+        samples.append(('horoscope compatibility', template_reader.compatibility(pair, 'horoscope', '')))
+    for average in (85, 65, 45):
+        members = [{'nickname': nickname} for nickname in ('コバトン', 'ハナコ', 'タロウ', 'ミドリ')]
+        group = {'members': members, 'average_score': average,
+                 'best_pairs': [{'person1': 'コバトン', 'person2': 'ハナコ', 'score': 90}, {'person1': 'タロウ', 'person2': 'ミドリ', 'score': 82}],
+                 'worst_pairs': [{'person1': 'ハナコ', 'person2': 'タロウ', 'score': 42}]}
+        samples.append(('group', template_reader.group(group, 'comprehensive', '家族の関係について')))
+
+    lengths = [len(text) for _, text in samples]
+    print(f"{len(samples)}件: 文字数 最小{min(lengths)} / 最大{max(lengths)}")
+    for kind, text in samples:
+        if not MIN_CHARS <= len(text) <= MAX_CHARS:
+            print(f"目標文字数外（{kind}, {len(text)}文字）:\n{text}\n")
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        template_reader.numerology({'life_path': {'number': 7}, 'destiny': {'number': 3}, 'soul': {'number': 5}, 'nickname': 'コバトン'}, '仕事について')
+    print(f"数秘術の鑑定文: {(time.perf_counter() - started) / 1000 * 1000:.3f} ms / 件")
+    print(samples[0][1])
@@ -0,0 +1,365 @@
+"""
+日本語の時間表現パーサー
+相談内容からトランジット法の要否と対象日時をローカルで判定する（LLM呼び出しの代替）
+"""
+
+import re
+import unicodedata
+from datetime import datetime, date, timedelta
+from typing import Callable, List, Tuple
+
+# 信頼度がこの値未満の場合は呼び出し側でLLMに判断を委ねる
+DEFAULT_CONFIDENCE_THRESHOLD = 0.6
+
+DEFAULT_HOUR = 12
+
+
+class TemporalParseResult:
+    """時間表現の解析結果"""
+
+    def __init__(self, use_transit: bool, target_date: str | None, confidence: float, matched: str | None = None):
+        self.use_transit = use_transit
+        self.target_date = target_date  # 'YYYY-MM-DD HH:MM' 形式
+        self.confidence = confidence
+        self.matched = matched
+
+    def __repr__(self) -> str:
+        return f"TemporalParseResult(use_transit={self.use_transit}, target_date={self.target_date}, confidence={self.confidence}, matched={self.matched})"
+
+
+def _format(target: date, hour: int = DEFAULT_HOUR) -> str:
+    return f"{target.strftime('%Y-%m-%d')} {hour:02d}:00"
+
+
+def _safe_date(year: int, month: int, day: int) -> date | None:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _next_occurrence(today: date, month: int, day: int) -> date | None:
+    """今日以降で最も近い月日（過ぎていれば翌年）"""
+    target = _safe_date(today.year, month, day)
+    if target is None:
+        return None
+    if target < today:
+        target = _safe_date(today.year + 1, month, day)
+    return target
+
+
+def _add_months(today: date, months: int, day: int = 15) -> date:
+    month_index = today.month - 1 + months
+    return date(today.year + month_index // 12, month_index % 12 + 1, day)
+
+
+# ---- 絶対日付 ----
+
+_ABSOLUTE_PATTERNS: List[Tuple[re.Pattern, str, float]] = [
+    (re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日'), 'ymd', 0.95),
+    (re.compile(r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})'), 'ymd', 0.95),
+    (re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})'), 'mdy', 0.9),
+    (re.compile(r'(\d{1,2})月(\d{1,2})日'), 'md', 0.9),
+    (re.compile(r'(?<![\d/])(\d{1,2})/(\d{1,2})(?![\d/])'), 'md', 0.8),
+    (re.compile(r'(\d{4})年(\d{1,2})月'), 'ym', 0.85),
+    (re.compile(r'(?<!\d)(\d{1,2})月(?!\d)'), 'm', 0.8),
+    # 「15日」だけでは日付か日数か判別しにくいため、LLMに判断を委ねる信頼度にする
+    (re.compile(r'(?<![\d月])(\d{1,2})日(?![後間前])'), 'd', 0.5),
+]
+
+# 生年月日の説明（「3月生まれの彼」）は対象日時ではない
+_BIRTH_SUFFIX = re.compile(r'[\d年月日/.\-\s]*(?:生まれ|産まれ|生れ|誕生)')
+# 回数・期間の表現（「1日3回」「1日中」「3日おき」）は日付ではない
+_COUNT_SUFFIX = re.compile(r'\s*(?:[にでの]?\s*\d|中|おき|置き|あたり|当たり|分|以上|以内|ぶり|ほど|くらい|ぐらい|毎|ごと)')
+
+
+def _date_matches(pattern: re.Pattern, kind: str, text: str):
+    """日付として扱える一致を順に返す（生年月日・回数の表現は除く）"""
+    for match in pattern.finditer(text):
+        rest = text[match.end():]
+        if _BIRTH_SUFFIX.match(rest):
+            continue
+        if kind == 'd' and _COUNT_SUFFIX.match(rest):
+            continue
+        yield match
+
+
+# ---- 年の指定（「来年の年末」「再来年の春」「来年3月」） ----
+
+# 長い表現から先に判定する（「再来年」を「来年」より先に）
+_YEAR_QUALIFIERS: List[Tuple[str, int]] = [('再来年', 2), ('来年', 1), ('去年', -1), ('昨年', -1), ('今年', 0)]
+
+
+def _year_offset(text: str) -> Tuple[int, str] | None:
+    """相談内容の年の指定（今年からの年数, 一致した表現）"""
+    for keyword, offset in _YEAR_QUALIFIERS:
+        if keyword in text:
+            return offset, keyword
+    return None
+
+
+def _parse_absolute(text: str, today: date):
+    year = _year_offset(text)
+    for pattern, kind, confidence in _ABSOLUTE_PATTERNS:
+        match = next(_date_matches(pattern, kind, text), None)
+        if not match:
+            continue
+        groups = [int(g) for g in match.groups()]
+        if kind == 'ymd':
+            target = _safe_date(groups[0], groups[1], groups[2])
+        elif kind == 'mdy':
+            target = _safe_date(groups[2], groups[0], groups[1])
+        elif kind in ('md', 'm') and year is not None:
+            # 「来年3月」「今年の5月10日」は指定された年のその月日
+            target = _safe_date(today.year + year[0], groups[0], groups[1] if kind == 'md' else 15)
+            if target:
+                return target, DEFAULT_HOUR, confidence, year[1] + match.group(0)
+        elif kind == 'md':
+            target = _next_occurrence(today, groups[0], groups[1])
+        elif kind == 'ym':
+            target = _safe_date(groups[0], groups[1], 15)
+        elif kind == 'm':
+            # 今月の指定は（15日を過ぎていても）今日、それ以外は直近のその月の15日
+            if groups[0] == today.month:
+                target = today
+            else:
+                target = _next_occurrence(today, groups[0], 15) if 1 <= groups[0] <= 12 else None
+        else:
+            target = _safe_date(today.year, today.month, groups[0])
+            if target and target < today:
+                next_month = _add_months(today, 1, day=1)
+                target = _safe_date(next_month.year, next_month.month, groups[0])
+        if target:
+            return target, DEFAULT_HOUR, confidence, match.group(0)
+    return None
+
+
+# ---- 相対表現 ----
+
+_OFFSET_PATTERNS: List[Tuple[re.Pattern, Callable[[date, int], date]]] = [
+    (re.compile(r'(\d+)日(?:後|先)'), lambda today, n: today + timedelta(days=n)),
+    (re.compile(r'(\d+)週間?(?:後|先)'), lambda today, n: today + timedelta(weeks=n)),
+    (re.compile(r'(\d+)[ヶかカケ]?月(?:後|先)'), lambda today, n: _add_months(today, n, day=min(today.day, 28))),
+    (re.compile(r'(\d+)年(?:後|先)'), lambda today, n: _safe_date(today.year + n, today.month, min(today.day, 28))),
+]
+
+
+def _next_weekday(today: date, weekday: int) -> date:
+    days = (weekday - today.weekday()) % 7
+    return today + timedelta(days=days)
+
+
+def _year_start(today: date) -> date:
+    # 1月上旬は今年の年始、それ以外は翌年の年始
+    return date(today.year, 1, 1) if today.month == 1 and today.day <= 7 else date(today.year + 1, 1, 1)
+
+
+def _fiscal_year_end(today: date) -> date:
+    return date(today.year, 3, 31) if today <= date(today.year, 3, 31) else date(today.year + 1, 3, 31)
+
+
+# 「明日香」「今日子」など名前の一部の可能性がある表現と、続いても日付の意味のままの漢字
+_NAME_PRONE_KEYWORDS = ('明後日', '明日', '今日', '昨日')
+_DATE_SUFFIX_KANJI = '中以降頃朝昼夕夜午前後迄'
+_KANJI = re.compile(r'[\u4e00-\u9fff々]')
+
+# 年の指定と組み合わせて解決する時期（「来年の年末」は来年の12/31、「来年のお正月」は来年の1/1）
+_YEAR_PERIODS: List[Tuple[Tuple[str, ...], int, int]] = [
+    (('年末年始', '年末', '大晦日'), 12, 31),
+    (('年始', '年明け', 'お正月', '正月', '元旦', '元日'), 1, 1),
+]
+
+# 長い表現から先に判定する（「明後日」を「明日」より先に）
+_RELATIVE_KEYWORDS: List[Tuple[Tuple[str, ...], Callable[[date], Tuple[date, int]], float]] = [
+    (('明明後日', 'しあさって'), lambda t: (t + timedelta(days=3), DEFAULT_HOUR), 0.95),
+    (('明後日', 'あさって'), lambda t: (t + timedelta(days=2), DEFAULT_HOUR), 0.95),
+    (('一昨日', 'おととい'), lambda t: (t - timedelta(days=2), DEFAULT_HOUR), 0.95),
+    (('明日', 'あした'), lambda t: (t + timedelta(days=1), DEFAULT_HOUR), 0.95),
+    (('昨日', 'きのう'), lambda t: (t - timedelta(days=1), DEFAULT_HOUR), 0.95),
+    (('今夜', '今晩'), lambda t: (t, 21), 0.9),
+    (('今日', '本日'), lambda t: (t, DEFAULT_HOUR), 0.9),
+    (('再来週',), lambda t: (t + timedelta(days=14), DEFAULT_HOUR), 0.9),
+    (('来週末',), lambda t: (_next_weekday(t, 5) + timedelta(days=7), DEFAULT_HOUR), 0.9),
+    (('今週末', '週末'), lambda t: (_next_weekday(t, 5), DEFAULT_HOUR), 0.9),
+    (('来週',), lambda t: (t + timedelta(days=7), DEFAULT_HOUR), 0.9),
+    (('先週',), lambda t: (t - timedelta(days=7), DEFAULT_HOUR), 0.85),
+    (('今週',), lambda t: (t, DEFAULT_HOUR), 0.85),
+    (('再来月',), lambda t: (_add_months(t, 2), DEFAULT_HOUR), 0.9),
+    (('来月',), lambda t: (_add_months(t, 1), DEFAULT_HOUR), 0.9),
+    (('先月',), lambda t: (_add_months(t, -1), DEFAULT_HOUR), 0.85),
+    (('今月',), lambda t: (t, DEFAULT_HOUR), 0.85),
+    (('年度末',), lambda t: (_fiscal_year_end(t), DEFAULT_HOUR), 0.85),
+    (('年末年始', '年末'), lambda t: (date(t.year, 12, 31), DEFAULT_HOUR), 0.9),
+    (('年始', '年明け', 'お正月', '正月', '元旦', '元日'), lambda t: (_year_start(t), DEFAULT_HOUR), 0.9),
+    (('大晦日',), lambda t: (date(t.year, 12, 31), DEFAULT_HOUR), 0.95),
+    (('再来年',), lambda t: (date(t.year + 2, 7, 1), DEFAULT_HOUR), 0.8),
+    (('来年',), lambda t: (date(t.year + 1, 7, 1), DEFAULT_HOUR), 0.8),
+    (('去年', '昨年'), lambda t: (date(t.year - 1, 7, 1), DEFAULT_HOUR), 0.8),
+    (('今年',), lambda t: (t, DEFAULT_HOUR), 0.8),
+]
+
+# ---- 名前付きイベント（月, 日） ----
+
+_NAMED_EVENTS: List[Tuple[Tuple[str, ...], int, int, float]] = [
+    (('クリスマスイブ', 'クリスマス・イブ'), 12, 24, 0.9),
+    (('クリスマス', 'Xmas', 'xmas'), 12, 25, 0.9),
+    (('バレンタイン',), 2, 14, 0.9),
+    (('ホワイトデー',), 3, 14, 0.9),
+    (('七夕',), 7, 7, 0.9),
+    (('ハロウィン', 'ハロウィーン'), 10, 31, 0.9),
+    (('ゴールデンウィーク', 'GW'), 5, 3, 0.85),
+    (('お盆',), 8, 13, 0.85),
+    (('シルバーウィーク',), 9, 21, 0.75),
+    (('成人式',), 1, 13, 0.75),
+    (('入学式', '入社式', '新年度'), 4, 1, 0.75),
+    (('卒業式',), 3, 15, 0.7),
+]
+
+# ---- 季節（代表日: 月, 日 / 該当月） ----
+
+_SEASONS: List[Tuple[str, int, int, Tuple[int, ...]]] = [
+    ('春', 4, 15, (3, 4, 5)),
+    ('夏', 7, 20, (6, 7, 8)),
+    ('秋', 10, 15, (9, 10, 11)),
+    ('冬', 1, 15, (12, 1, 2)),
+]
+_SEASON_EXCLUDES = ('青春', '思春期', '春日', '夏目', '秋田', '冬眠')
+
+# 日付が特定できない時期的な相談（トランジット対象だがLLMに日時推測を委ねる）
+_VAGUE_TIME_CUES = ('誕生日', '試験', '受験', '面接', '旅行', '引っ越し', '引越し', '結婚式', 'デート', '発表', 'いつ', '時期', '近いうち', '近々', 'そのうち', '今度', '今後', '将来', 'これから', 'この先')
+
+# トランジット法が不要な一般的な相談
+_GENERAL_CUES = ('性格', '本質', '才能', '適職', '向いて', '相性', '資質', '長所', '短所', '使命', '生き方', '価値観', 'どんな人')
+
+
+def _parse_year_period(text: str, today: date):
+    """年の指定と年末・年始・季節・イベントの組み合わせ（「来年末」「来年の春」「再来年のクリスマス」）"""
+    year = _year_offset(text)
+    if year is None:
+        return None
+    offset, qualifier = year
+    # 「来年」の部分を除いて判定する（「来年末」「来年始」は「年末」「年始」として残す）
+    start = text.find(qualifier)
+    joined = text[start + len(qualifier):start + len(qualifier) + 1] in ('末', '始')
+    rest = text[:start] + ('年' if joined else '') + text[start + len(qualifier):]
+    for keywords, month, day in _YEAR_PERIODS:
+        for keyword in keywords:
+            if keyword in rest:
+                return date(today.year + offset, month, day), DEFAULT_HOUR, 0.85, qualifier + keyword
+    for keywords, month, day, confidence in _NAMED_EVENTS:
+        for keyword in keywords:
+            if keyword in rest:
+                return _safe_date(today.year + offset, month, day), DEFAULT_HOUR, min(confidence, 0.85), qualifier + keyword
+    season = _parse_season(rest, today)
+    if season:
+        _, _, _, name = season
+        month, day = next((month, day) for candidate, month, day, _ in _SEASONS if candidate == name)
+        # 冬（代表日は1月）は指定された年の冬の始まりの翌年1月
+        target_year = today.year + offset + (1 if name == '冬' else 0)
+        return date(target_year, month, day), DEFAULT_HOUR, 0.8, qualifier + name
+    return None
+
+
+def _relative_matches(text: str, today: date) -> List[Tuple[int, int, date, int, float, str]]:
+    """相対表現の一致をすべて返す（より長い一致に含まれるもの（「来週末」の「週末」）は除く）"""
+    matches = []
+    for keywords, resolver, confidence in _RELATIVE_KEYWORDS:
+        for keyword in keywords:
+            for match in re.finditer(re.escape(keyword), text):
+                target, hour = resolver(today)
+                following = text[match.end():match.end() + 1]
+                if keyword in _NAME_PRONE_KEYWORDS and _KANJI.match(following) and following not in _DATE_SUFFIX_KANJI:
+                    # 「明日香との相性」のような名前の可能性があるためLLMに判断を委ねる
+                    confidence = min(confidence, 0.5)
+                matches.append((match.start(), match.end(), target, hour, confidence, keyword))
+    return [
+        m for m in matches
+        if not any(o is not m and o[0] <= m[0] and m[1] <= o[1] and o[1] - o[0] > m[1] - m[0] for o in matches)
+    ]
+
+
+def _parse_relative(text: str, today: date):
+    for pattern, resolver in _OFFSET_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            target = resolver(today, int(match.group(1)))
+            if target:
+                return target, DEFAULT_HOUR, 0.9, match.group(0)
+    matches = _relative_matches(text, today)
+    if not matches:
+        return None
+    # 先に登録された（長い・具体的な）表現を優先する
+    order = {keyword: index for index, (keywords, _, _) in enumerate(_RELATIVE_KEYWORDS) for keyword in keywords}
+    _, _, target, hour, confidence, keyword = min(matches, key=lambda m: order[m[5]])
+    if len({m[2] for m in matches}) > 1:
+        # 「明日か来週」のように異なる日を指す表現が混在する場合はLLMに判断を委ねる
+        confidence = min(confidence, 0.5)
+    return target, hour, confidence, keyword
+
+
+def _parse_event(text: str, today: date):
+    for keywords, month, day, confidence in _NAMED_EVENTS:
+        for keyword in keywords:
+            if keyword in text:
+                return _next_occurrence(today, month, day), DEFAULT_HOUR, confidence, keyword
+    return None
+
+
+def _parse_season(text: str, today: date):
+    cleaned = text
+    for word in _SEASON_EXCLUDES:
+        cleaned = cleaned.replace(word, '')
+    for season, month, day, months in _SEASONS:
+        if season in cleaned:
+            if today.month in months:
+                return today, DEFAULT_HOUR, 0.8, season
+            return _next_occurrence(today, month, day), DEFAULT_HOUR, 0.8, season
+    return None
+
+
+def _next_birthday(birth_date: str, today: date) -> date | None:
+    try:
+        born = datetime.strptime(str(birth_date)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    return _next_occurrence(today, born.month, min(born.day, 28) if born.month == 2 else born.day)
+
+
+def parse_consultation_date(consultation: str, now: datetime | None = None, birth_date: str | None = None) -> TemporalParseResult:
+    """
+    相談内容からトランジット法の要否と対象日時を判定する
+
+    Args:
+        consultation: 相談内容
+        now: 基準日時（省略時は現在時刻）
+        birth_date: 「誕生日」の解決に使う生年月日（YYYY-MM-DD）
+
+    Returns:
+        TemporalParseResult（confidenceが低い場合は呼び出し側でLLMに委ねる）
+    """
+    if not consultation or not consultation.strip():
+        return TemporalParseResult(False, None, 1.0)
+
+    text = unicodedata.normalize('NFKC', consultation)
+    today = (now or datetime.now()).date()
+
+    for parser in (_parse_absolute, _parse_year_period, _parse_relative, _parse_event, _parse_season):
+        parsed = parser(text, today)
+        if parsed and parsed[0]:
+            target, hour, confidence, matched = parsed
+            return TemporalParseResult(True, _format(target, hour), confidence, matched)
+
+    if birth_date and '誕生日' in text:
+        birthday = _next_birthday(birth_date, today)
+        if birthday:
+            return TemporalParseResult(True, _format(birthday), 0.85, '誕生日')
+
+    for cue in _VAGUE_TIME_CUES:
+        if cue in text:
+            # 時期的な相談だが日付を特定できない
+            return TemporalParseResult(True, _format(today + timedelta(days=7)), 0.4, cue)
+
+    if any(cue in text for cue in _GENERAL_CUES):
+        return TemporalParseResult(False, None, 0.9)
+
+    return TemporalParseResult(False, None, 0.75)
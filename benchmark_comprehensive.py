@@ -0,0 +1,119 @@
+"""
+総合占いの生成方式ベンチマーク
+従来の統合方式（chained）・構造化出力方式（structured）・セクション並列方式（sections）の所要時間とLLM呼び出し回数を比較する
+
+使い方:
+    python benchmark_comprehensive.py [--runs 3] [--purpose both]
+    python benchmark_comprehensive.py --stub-latency 2.0   # APIを呼ばず、固定遅延の代替プロバイダーで計測
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# ai_analysisなどは絶対インポートのためbackendをパスに追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+PROFILES = [
+    {
+        'nickname': 'コバトン',
+        'name_hiragana': 'こばやし　よしたか',
+        'birth_date': '1999-04-02',
+        'birth_time': '12:00',
+        'birth_location_json': {'place': '東京', 'lat': 35.6762, 'lng': 139.6503, 'tz_str': 'Asia/Tokyo'}
+    },
+    {
+        'nickname': 'ハナコ',
+        'name_hiragana': 'やまだ　はなこ',
+        'birth_date': '1985-05-15',
+        'birth_time': '08:30',
+        'birth_location_json': {'place': '大阪', 'lat': 34.6937, 'lng': 135.5023, 'tz_str': 'Asia/Tokyo'}
+    },
+]
+
+CONSULTATIONS = ['これからの仕事と恋愛について', '今年の運勢を総合的に知りたいです', '人間関係で悩んでいます']
+
+
+def install_stub_provider(latency: float):
+    """LLM APIの代わりに固定遅延で応答する代替プロバイダーを設定（スケジューラー・統計は通常どおり通す）"""
+    os.environ.setdefault('GROQ_API_KEY', 'stub')
+    os.environ.pop('GOOGLE_GEMINI_API_KEY', None)
+    for name in ('GROQ_RPM', 'GROQ_TPM', 'GEMINI_RPM', 'GEMINI_TPM'):
+        os.environ[name] = '1000000'
+
+    import ai_analysis
+    import backend.ai_analysis
+    from structured_reading import COMPREHENSIVE_SECTIONS, COMPATIBILITY_SECTIONS
+
+    def respond(prompt: str) -> str:
+        time.sleep(latency)
+        if 'JSON形式' in prompt:
+            layout = COMPATIBILITY_SECTIONS if 'overall_score' in prompt else COMPREHENSIVE_SECTIONS
+            reading = {'overall_score': 72, 'horoscope_score': 68, 'sections': {key: f"{title}についての鑑定文です。" * 5 for key, title in layout}}
+            return json.dumps(reading, ensure_ascii=False)
+        if '整数' in prompt:
+            return '70'
+        return 'ベンチマーク用の鑑定文です。' * 20
+
+    def call_groq(self, prompt: str, max_tokens: int = 1000, model: str | None = None, temperature: float = 0.7) -> str:
+        return self._scheduled_call('groq', prompt, max_tokens, lambda timeout: respond(prompt))
+
+    # 計算クラス（絶対インポート）とサービス（相対インポート）の両方のモジュールに適用
+    ai_analysis.AIAnalysisGenerator._call_groq = call_groq
+    backend.ai_analysis.AIAnalysisGenerator._call_groq = call_groq
+
+
+def count_llm_calls() -> int:
+    from prompt_builder import prompt_token_stats
+    return sum(stats['calls'] for stats in prompt_token_stats.snapshot().values())
+
+
+def run(mode: str, purpose: str, runs: int):
+    from backend.divination_service import DivinationService
+
+    latencies, calls = [], []
+    for index in range(runs):
+        # キャッシュの影響を除くため毎回新しいサービスを使う
+        service = DivinationService()
+        service.comprehensive_mode = mode
+        # 占い結果キャッシュ（プロセス全体で共有）からは返さず、毎回生成させる
+        service.result_cache_enabled = False
+        profiles = PROFILES[:1] if purpose == 'personal' else PROFILES
+        request_data = {'type': 'comprehensive', 'profiles': profiles, 'consultation': CONSULTATIONS[index % len(CONSULTATIONS)]}
+
+        calls_before = count_llm_calls()
+        started = time.perf_counter()
+        service.generate_divination_result(request_data)
+        latencies.append(time.perf_counter() - started)
+        calls.append(count_llm_calls() - calls_before)
+
+    return {
+        'median_seconds': round(statistics.median(latencies), 2),
+        'max_seconds': round(max(latencies), 2),
+        'avg_llm_calls': round(statistics.mean(calls), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='総合占いの生成方式ベンチマーク')
+    parser.add_argument('--runs', type=int, default=3, help='方式ごとの実行回数')
+    parser.add_argument('--purpose', choices=['personal', 'compatibility', 'both'], default='both')
+    parser.add_argument('--stub-latency', type=float, help='代替プロバイダーの応答遅延（秒）。指定時はLLM APIを呼ばない')
+    args = parser.parse_args()
+
+    if args.stub_latency is not None:
+        install_stub_provider(args.stub_latency)
+
+    purposes = ['personal', 'compatibility'] if args.purpose == 'both' else [args.purpose]
+    print(f"{'purpose':<15}{'mode':<12}{'median(s)':>10}{'max(s)':>10}{'LLM calls':>12}")
+    for purpose in purposes:
+        for mode in ('chained', 'structured', 'sections'):
+            result = run(mode, purpose, args.runs)
+            print(f"{purpose:<15}{mode:<12}{result['median_seconds']:>10}{result['max_seconds']:>10}{result['avg_llm_calls']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,12 @@ def check_and_create_database():
                         print(f"  {row[0]}: {row[1]}")
             else:
                 print("既存のテーブルを確認中...")
+                if 'divination_results' in tables:
+                    # 後から追加したカラムを既存のテーブルに反映
+                    conn.execute(text("ALTER TABLE divination_results ADD COLUMN IF NOT EXISTS llm_usage JSON"))
+                    conn.commit()
+                    print("divination_results.llm_usage カラムを確認しました")
+                
                 if 'users' in tables:
                     # usersテーブルの構造を確認
                     result = conn.execute(text("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = 'users' ORDER BY ordinal_position"))
@@ -0,0 +1,116 @@
+"""
+スプレッド選択ルーターのオフライン評価
+判定ログ中のLLMの選択を正解とし、ローカル判定との一致率・混同行列・判定時間を表示する
+確信度に関係なく抽出してLLMで判定したラベルがあれば、それだけで評価する（補助判定のラベルは確信度の低い相談に偏るため）
+
+使い方:
+    python evaluate_spread_router.py [--log backend/cache/spread_decisions.jsonl] [--folds 5]
+    python evaluate_spread_router.py --label questions.txt   # LLMで質問を判定してログに追記
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+from backend.spread_router import (
+    SpreadRouter, SPREAD_IDS, PERSONAL, COMPATIBILITY, DEFAULT_LOG_PATH, load_decisions
+)
+
+
+def label_with_llm(questions_path: str, log_path: str):
+    """質問ファイル（1行1件、相性は「compatibility<TAB>相談内容」）をLLMで判定しログに追記"""
+    # ai_analysisは絶対インポートのためbackendをパスに追加
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+    from backend.tarot import TarotCalculator
+    from backend.spread_router import SpreadDecision
+
+    calculator = TarotCalculator()
+    router = SpreadRouter(log_path=log_path, train=False)
+    labeled = 0
+    with open(questions_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            mode, text = (line.split('\t', 1) if '\t' in line else (PERSONAL, line))
+            select = calculator._select_compatibility_spread_with_ai if mode == COMPATIBILITY else calculator._select_spread_with_ai
+            spread_id = select(text)
+            if spread_id not in SPREAD_IDS:
+                print(f"判定失敗: {text}")
+                continue
+            local = router.classify(text, mode)
+            router.record(text, mode, SpreadDecision(spread_id, local.confidence, 'llm', local.scores), local_spread_id=local.spread_id)
+            labeled += 1
+    router.flush()
+    print(f"{labeled}件をLLMで判定し {log_path} に追記しました")
+
+
+def print_confusion(title: str, confusion):
+    print(f"\n{title}（行: LLM / 列: ローカル）")
+    print(f"{'':>14}" + ''.join(f"{spread_id:>14}" for spread_id in SPREAD_IDS))
+    for expected in SPREAD_IDS:
+        print(f"{expected:>14}" + ''.join(f"{confusion[expected][predicted]:>14}" for predicted in SPREAD_IDS))
+
+
+def evaluate(log_path: str, folds: int):
+    decisions = load_decisions(log_path, sampled_only=True)
+    sampled = bool(decisions)
+    if not sampled:
+        decisions = load_decisions(log_path)
+    if not decisions:
+        print(f"評価データがありません: {log_path}（--labelでLLMの判定を作成してください）")
+        return
+
+    folds = max(1, min(folds, len(decisions)))
+    keyword_router = SpreadRouter(log_path='', train=False)
+    results = defaultdict(lambda: {'total': 0, 'keyword': 0, 'trained': 0})
+    confusion = defaultdict(lambda: defaultdict(int))
+    elapsed = 0.0
+
+    for fold in range(folds):
+        train = [d for i, d in enumerate(decisions) if folds > 1 and i % folds != fold]
+        test = [d for i, d in enumerate(decisions) if folds == 1 or i % folds == fold]
+        router = SpreadRouter(log_path='', train=False)
+        router.model.fit([(router.entry_features(d)[1], d.get('mode', PERSONAL), d['spread_id']) for d in train])
+
+        for d in test:
+            mode = d.get('mode', PERSONAL)
+            keyword_scores, grams = router.entry_features(d)
+            started = time.perf_counter()
+            predicted = router.classify_features(keyword_scores, grams, mode).spread_id
+            elapsed += time.perf_counter() - started
+            baseline = keyword_router.classify_features(keyword_scores, grams, mode).spread_id
+
+            for key in (mode, 'all'):
+                results[key]['total'] += 1
+                results[key]['keyword'] += baseline == d['spread_id']
+                results[key]['trained'] += predicted == d['spread_id']
+            confusion[d['spread_id']][predicted] += 1
+
+    print(f"評価件数: {len(decisions)}件（{folds}分割交差検証、{'抽出ラベルのみ' if sampled else '補助判定のラベルを含む'}）")
+    for key in ('all', PERSONAL, COMPATIBILITY):
+        stats = results.get(key)
+        if not stats or not stats['total']:
+            continue
+        print(f"  {key:>14}: キーワードのみ {stats['keyword'] / stats['total']:.1%} / "
+              f"n-gram学習込み {stats['trained'] / stats['total']:.1%}（{stats['total']}件）")
+    print(f"  平均判定時間: {elapsed / results['all']['total'] * 1e6:.1f}µs")
+    print_confusion('混同行列', confusion)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='スプレッド選択ルーターのオフライン評価')
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH, help='判定ログ（JSONL）のパス')
+    parser.add_argument('--folds', type=int, default=5, help='交差検証の分割数')
+    parser.add_argument('--label', help='LLMで判定する質問ファイル')
+    args = parser.parse_args()
+
+    if args.label:
+        label_with_llm(args.label, args.log)
+    evaluate(args.log, args.folds)
+
+
+if __name__ == "__main__":
+    main()
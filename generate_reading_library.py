@@ -0,0 +1,148 @@
+"""
+鑑定文ライブラリのバッチ生成
+相談内容のない数秘術・西洋占星術の基本鑑定文をシグネチャごとに事前生成して backend/cache/reading_library.sqlite に保存する
+
+使い方:
+    python generate_reading_library.py --kind horoscope            # 太陽・月・上昇星座の全1,728通り
+    python generate_reading_library.py --kind numerology           # 登録済みプロフィールと過去の占い結果に現れた数の組み合わせ
+    python generate_reading_library.py --kind numerology --all --limit 5000   # 数の組み合わせを網羅的に（件数上限付き）
+    python generate_reading_library.py --force                     # 生成済みのシグネチャも作り直す
+
+READING_LIBRARY_VERSION を上げると、古いバージョンの鑑定文は配信されなくなり再生成の対象になる
+"""
+
+import argparse
+import contextvars
+import concurrent.futures
+import itertools
+import os
+import sys
+import time
+from typing import Dict, Any, Iterator, Tuple
+
+# ai_analysisなどは絶対インポートのためbackendをパスに追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from ai_analysis import AIAnalysisGenerator
+from llm_scheduler import background_priority
+from numerology_scoring import NUMEROLOGY_NUMBERS
+from reading_library import (
+    reading_library, horoscope_signatures, horoscope_signature, numerology_signature, to_template, GENERATION_NICKNAME
+)
+
+NUMEROLOGY_KEYS = ('life_path', 'destiny', 'soul', 'personal', 'birthday', 'maturity')
+
+
+def numerology_data(numbers: Tuple[int, ...]) -> Dict[str, Any]:
+    return {key: {'number': number} for key, number in zip(NUMEROLOGY_KEYS, numbers)}
+
+
+def all_numerology_numbers() -> Iterator[Tuple[int, ...]]:
+    """数の組み合わせを網羅（バースデーはマスターナンバーなしの1-9）"""
+    for life_path, destiny, soul, personal, maturity in itertools.product(NUMEROLOGY_NUMBERS, repeat=5):
+        for birthday in range(1, 10):
+            yield life_path, destiny, soul, personal, birthday, maturity
+
+
+def observed_numerology_numbers() -> Iterator[Tuple[int, ...]]:
+    """登録済みプロフィールと過去の占い結果のプロフィールから数の組み合わせを集める"""
+    from backend.database import SessionLocal, Profile, DivinationResult
+    from numerology_calculator import NumerologyCalculator
+
+    calculator = NumerologyCalculator()
+    seen = set()
+
+    def numbers_of(profile: Dict[str, Any]) -> Tuple[int, ...] | None:
+        if not profile.get('name_hiragana') or not profile.get('birth_date'):
+            return None
+        reading = calculator.get_numerology_reading(profile)
+        numbers = tuple(reading[key]['number'] for key in NUMEROLOGY_KEYS)
+        return None if 0 in numbers else numbers
+
+    db = SessionLocal()
+    try:
+        profiles = [
+            {'name_hiragana': p.name_hiragana, 'birth_date': str(p.birth_date) if p.birth_date else ''}
+            for p in db.query(Profile).yield_per(500)
+        ]
+        for (request_data,) in db.query(DivinationResult.request_data).yield_per(500):
+            profiles.extend((request_data or {}).get('profiles', []))
+    finally:
+        db.close()
+
+    for profile in profiles:
+        numbers = numbers_of(profile)
+        if numbers and numbers not in seen:
+            seen.add(numbers)
+            yield numbers
+
+
+def build_jobs(generator: AIAnalysisGenerator, kind: str, all_numerology: bool) -> Iterator[Tuple[str, str]]:
+    """(シグネチャ, プロンプト) を列挙"""
+    if kind in ('horoscope', 'all'):
+        for sun, moon, rising in horoscope_signatures():
+            yield horoscope_signature(sun, moon, rising), generator.horoscope_prompt(sun, moon, rising, "", GENERATION_NICKNAME)
+    if kind in ('numerology', 'all'):
+        numbers_iter = all_numerology_numbers() if all_numerology else observed_numerology_numbers()
+        for numbers in numbers_iter:
+            data = numerology_data(numbers)
+            yield numerology_signature(data), generator.numerology_prompt(data, "", GENERATION_NICKNAME)
+
+
+def pending_jobs(jobs: Iterator[Tuple[str, str]], force: bool, limit: int | None) -> Iterator[Tuple[str, str]]:
+    """生成済みのシグネチャを除き、上限件数まで返す（網羅生成でも全件をメモリに載せない）"""
+    count = 0
+    while limit is None or count < limit:
+        chunk = list(itertools.islice(jobs, 500))
+        if not chunk:
+            return
+        done = set() if force else reading_library.existing([signature for signature, _ in chunk])
+        for job in chunk:
+            if job[0] in done:
+                continue
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield job
+
+
+def main():
+    parser = argparse.ArgumentParser(description='鑑定文ライブラリのバッチ生成')
+    parser.add_argument('--kind', choices=['horoscope', 'numerology', 'all'], default='all')
+    parser.add_argument('--all', dest='all_numerology', action='store_true', help='数秘術の数の組み合わせを網羅的に生成')
+    parser.add_argument('--limit', type=int, help='今回生成する件数の上限')
+    parser.add_argument('--force', action='store_true', help='生成済みのシグネチャも作り直す')
+    parser.add_argument('--workers', type=int, default=4, help='並列に発行するLLM呼び出し数')
+    args = parser.parse_args()
+
+    generator = AIAnalysisGenerator()
+    jobs = list(pending_jobs(build_jobs(generator, args.kind, args.all_numerology), args.force, args.limit))
+    print(f"鑑定文ライブラリ v{reading_library.version}: {len(jobs)}件を生成します")
+
+    timeout_message = generator._get_timeout_message()
+
+    def generate(signature: str, prompt: str) -> bool:
+        text = generator._generate_analysis_with_gemini(prompt)
+        if not text or text == timeout_message:
+            print(f"生成失敗: {signature}")
+            return False
+        reading_library.put(signature, to_template(text))
+        return True
+
+    started = time.perf_counter()
+    succeeded = 0
+    # ユーザーのリクエストを妨げないよう、最低優先度でスケジューラーを通す
+    with background_priority():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, generate, signature, prompt) for signature, prompt in jobs]
+            for index, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                succeeded += bool(future.result())
+                if index % 50 == 0:
+                    print(f"  {index}/{len(jobs)}件 完了（{time.perf_counter() - started:.0f}秒）")
+
+    print(f"完了: {succeeded}/{len(jobs)}件（{time.perf_counter() - started:.0f}秒）")
+    print(reading_library.stats()['entries'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+LLM呼び出しの期限ストレステスト
+遅い代替プロバイダーで鑑定文生成を一斉にタイムアウトさせ、直後のリクエストが詰まらずに処理されるかを確認する
+
+- deadline: 代替プロバイダーがHTTPタイムアウトを守る（期限で呼び出しが中断され、スレッドがすぐ解放される）
+- ignore:   代替プロバイダーがタイムアウトを無視する（従来の挙動。タイムアウト後も呼び出しがスレッドを占有し続ける）
+
+使い方:
+    python stress_llm_timeouts.py [--slow-latency 6] [--fast-latency 0.3] [--timeout 2] [--burst 12] [--followers 6]
+"""
+
+import argparse
+import concurrent.futures
+import os
+import statistics
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+# ai_analysisなどは絶対インポートのためbackendをパスに追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+NUMEROLOGY_DATA = {
+    key: {'number': number, 'meaning': ''}
+    for key, number in [('life_path', 7), ('destiny', 3), ('soul', 5), ('personal', 8), ('birthday', 2), ('maturity', 1)]
+}
+
+
+class StandInProvider:
+    """Groqクライアントの chat.completions の代わりに固定遅延で応答する代替プロバイダー"""
+
+    def __init__(self, honor_timeout: bool):
+        self.honor_timeout = honor_timeout
+        self.latency = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def create(self, *, model, messages, max_tokens, temperature, top_p, timeout=None):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            latency = self.latency
+            if self.honor_timeout and timeout is not None and timeout < latency:
+                # httpxのタイムアウトと同じく、期限で接続を切って例外を送出
+                time.sleep(timeout)
+                raise TimeoutError(f"stand-in provider timed out after {timeout:.2f}s")
+            time.sleep(latency)
+            content = 'ストレステスト用の鑑定文です。' * 10
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def run_phase(generator, count: int, tag: str):
+    """count件の鑑定文生成を同時に発行し、(レイテンシ, タイムアウト件数) を返す"""
+    timeout_message = generator._get_timeout_message()
+
+    def request(index: int):
+        started = time.perf_counter()
+        # 相談内容の番号を変えてキャッシュ・類似判定に当たらないようにする
+        result = generator.generate_numerology_analysis(dict(NUMEROLOGY_DATA, nickname='テスト'), f"{tag}{index}番目の相談です")
+        return time.perf_counter() - started, result == timeout_message
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as pool:
+        results = list(pool.map(request, range(count)))
+    return [latency for latency, _ in results], sum(timed_out for _, timed_out in results)
+
+
+def scenario(honor_timeout: bool, args) -> dict:
+    from ai_analysis import AIAnalysisGenerator
+
+    generator = AIAnalysisGenerator()
+    provider = StandInProvider(honor_timeout)
+    generator.groq_client = SimpleNamespace(chat=SimpleNamespace(completions=provider))
+
+    # 1. 遅いプロバイダーで一斉にタイムアウトさせる
+    provider.latency = args.slow_latency
+    burst_latencies, burst_timeouts = run_phase(generator, args.burst, 'burst')
+    time.sleep(0.2)
+    stuck_after_burst = provider.in_flight
+
+    # 2. プロバイダーが回復した直後のリクエスト
+    provider.latency = args.fast_latency
+    follower_latencies, follower_timeouts = run_phase(generator, args.followers, 'follower')
+
+    return {
+        'burst_timeouts': f"{burst_timeouts}/{args.burst}",
+        'burst_max_s': round(max(burst_latencies), 2),
+        'stuck_calls': stuck_after_burst,
+        'peak_calls': provider.peak_in_flight,
+        'follower_ok': f"{args.followers - follower_timeouts}/{args.followers}",
+        'follower_p50_s': round(statistics.median(follower_latencies), 2),
+        'follower_max_s': round(max(follower_latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM呼び出しの期限ストレステスト')
+    parser.add_argument('--slow-latency', type=float, default=6.0, help='タイムアウトさせる遅い応答の遅延（秒）')
+    parser.add_argument('--fast-latency', type=float, default=0.3, help='回復後の応答の遅延（秒）')
+    parser.add_argument('--timeout', type=float, default=2.0, help='鑑定文生成の期限（LLM_ANALYSIS_TIMEOUT）')
+    parser.add_argument('--burst', type=int, default=12, help='タイムアウトさせるリクエスト数')
+    parser.add_argument('--followers', type=int, default=6, help='回復直後に発行するリクエスト数')
+    args = parser.parse_args()
+
+    os.environ['GROQ_API_KEY'] = os.getenv('GROQ_API_KEY', 'stub')
+    os.environ.pop('GOOGLE_GEMINI_API_KEY', None)
+    os.environ['LLM_ANALYSIS_TIMEOUT'] = str(args.timeout)
+    os.environ['LLM_TIMEOUT_FLOOR'] = str(args.timeout)
+    # タイムアウトでサーキットが開くと後続のリクエストが即座に諦めてしまい、プールの詰まりを測れないため無効化
+    os.environ['LLM_BREAKER_FAILURES'] = '1000000'
+    # タイムアウトをタイムアウト文面で数えるため、テンプレート鑑定文への切り替えを無効化
+    os.environ['LLM_TEMPLATE_FALLBACK'] = 'false'
+    for name in ('GROQ_RPM', 'GROQ_TPM', 'GEMINI_RPM', 'GEMINI_TPM'):
+        os.environ[name] = '1000000'
+
+    # タイムアウトを無視するシナリオは占有したスレッドが残るため後に実行する
+    rows = [('deadline', scenario(True, args)), ('ignore', scenario(False, args))]
+
+    columns = ['burst_timeouts', 'burst_max_s', 'stuck_calls', 'peak_calls', 'follower_ok', 'follower_p50_s', 'follower_max_s']
+    print(f"{'provider':<10}" + ''.join(f"{column:>16}" for column in columns))
+    for name, row in rows:
+        print(f"{name:<10}" + ''.join(f"{str(row[column]):>16}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+占い結果キャッシュ：過負荷時などのテンプレート鑑定文（クイック鑑定以外）はキャッシュしない
+"""
+
+import pytest
+
+for module in ('numpy', 'sqlalchemy', 'dotenv', 'groq', 'google.generativeai', 'kerykeion', 'pykakasi', 'googlemaps'):
+    pytest.importorskip(module)
+
+from backend.divination_service import DivinationService
+from backend.result_cache import result_cache
+
+REQUEST = {
+    'type': 'numerology',
+    'profiles': [{'profile_id': 9001, 'nickname': 'テスト', 'name_hiragana': 'やまだ たろう', 'birth_date': '1990-04-12'}],
+    'consultation': '仕事運を知りたい'
+}
+
+
+@pytest.fixture
+def service(monkeypatch):
+    # LLMは呼ばないのでキーはダミーでよい
+    monkeypatch.setenv('GROQ_API_KEY', 'test')
+    service = DivinationService()
+    # 全プロバイダーの遮断・過負荷と同じく、LLMを呼ばずにテンプレート鑑定文で答えさせる
+    monkeypatch.setattr(service.ai_generator, 'use_template_tier', lambda: True)
+    result_cache.invalidate_profile(9001)
+    yield service
+    result_cache.invalidate_profile(9001)
+
+
+def test_template_fallback_is_not_cached(service):
+    before = result_cache.stats()['stores']
+    result = service.generate_divination_result(dict(REQUEST), plan_type='Premium')
+
+    assert result['llm_usage']['calls'] == 0
+    assert result['llm_usage']['degraded'].get('template_fallback')
+    assert result_cache.stats()['stores'] == before
+    assert service.invalidate_profile(9001) == 0
+
+
+def test_quick_template_reading_is_cached(service):
+    before = result_cache.stats()['stores']
+    service.generate_divination_result(dict(REQUEST, quick=True), plan_type='Premium')
+    cached = service.generate_divination_result(dict(REQUEST, quick=True), plan_type='Premium')
+
+    assert result_cache.stats()['stores'] == before + 1
+    assert cached['llm_usage']['cache_hit_sources'] == {'result_cache': 1}